@@ -1,14 +1,22 @@
 # aegis_server.py
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import concurrent.futures
 import datetime
+import os
+from werkzeug.utils import secure_filename
 
-# Import the necessary Google Calendar functions from your main script
-# (This assumes your functions are in a file named scheduler.py)
-from scheduler import setup_google_calendar_api, LOCAL_TIMEZONE
+# The lightweight Calendar client, so the server never imports the planner or LLM stack.
+from calendar_client import setup_google_calendar_api
+from calendar_sync import send_wake_signal
+from calendar_writes import submit_event
+from default_variables import WEBHOOK_TOKEN, INGEST_DROP_DIR, WRITE_TIMEOUT_SECONDS, SERVER_THREADS, LOCAL_TIMEZONE
+from ingest_jobs import load_jobs, is_audio_file
+from metrics import take_snapshot, load_snapshots, render_prometheus
 
 app = Flask(__name__)
 
-# Initialize the Google Calendar service once on startup
+# Initialize the Google Calendar service once on startup, so OAuth runs before serving.
+# Requests never use it directly: the write queue's thread builds its own client.
 try:
     print("Initializing Google Calendar service for server...")
     google_service = setup_google_calendar_api()
@@ -17,19 +25,11 @@ except Exception as e:
     print(f"FATAL: Could not initialize Google Calendar service: {e}")
     google_service = None
 
-@app.route('/add_event', methods=['POST'])
-def add_event():
-    if not google_service:
-        return jsonify({"error": "Google Calendar service not available"}), 500
-
-    data = request.json
-    print(f"Received request to add event: {data}")
-
-    # Basic validation
-    if not all(k in data for k in ['summary', 'start_time', 'end_time']):
-        return jsonify({"error": "Missing required fields: summary, start_time, end_time"}), 400
-
-    event = {
+def build_event_body(data):
+    """Turns an add-event payload into a Calendar event body, or returns None if fields are missing."""
+    if not isinstance(data, dict) or not all(k in data for k in ['summary', 'start_time', 'end_time']):
+        return None
+    return {
         'summary': data['summary'],
         'start': {
             'dateTime': data['start_time'], # Expects "YYYY-MM-DDTHH:MM:SS"
@@ -41,17 +41,111 @@ def add_event():
         },
     }
 
+def wait_for_write(future):
+    """Waits for a queued insert and turns its outcome into a per-event result."""
     try:
-        created_event = google_service.events().insert(
-            calendarId='primary', # Add to the PRIMARY calendar
-            body=event
-        ).execute()
-        print(f"Successfully added event to primary calendar: {created_event.get('htmlLink')}")
-        return jsonify({"status": "success", "eventId": created_event['id']}), 200
+        return future.result(timeout=WRITE_TIMEOUT_SECONDS)
+    except concurrent.futures.TimeoutError:
+        return {"status": "pending", "error": "Timed out waiting for Google Calendar; retry with the same idempotency key"}
     except Exception as e:
         print(f"Error creating calendar event: {e}")
-        return jsonify({"error": "Failed to create calendar event"}), 500
+        return {"status": "error", "error": "Failed to create calendar event"}
+
+@app.route('/add_event', methods=['POST'])
+def add_event():
+    if not google_service:
+        return jsonify({"error": "Google Calendar service not available"}), 500
+
+    data = request.json
+    print(f"Received request to add event: {data}")
+
+    # Basic validation
+    event = build_event_body(data)
+    if event is None:
+        return jsonify({"error": "Missing required fields: summary, start_time, end_time"}), 400
+
+    # A client that retries with the same key gets the original event back instead of a copy.
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    result = wait_for_write(submit_event('primary', event, idempotency_key)) # Add to the PRIMARY calendar
+    if result["status"] in ("created", "duplicate"):
+        print(f"Added event to primary calendar ({result['status']}): {result['eventId']}")
+        return jsonify({"status": "success", **result}), 200
+    return jsonify(result), 504 if result["status"] == "pending" else 500
+
+@app.route('/add_events', methods=['POST'])
+def add_events():
+    """Adds many events at once; they are written in as few Google batch requests as possible."""
+    if not google_service:
+        return jsonify({"error": "Google Calendar service not available"}), 500
+
+    payload = request.get_json(silent=True)
+    items = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty 'events' list"}), 400
+    events = [build_event_body(item) for item in items]
+    invalid = [index for index, event in enumerate(events) if event is None]
+    if invalid:
+        return jsonify({"error": "Missing required fields: summary, start_time, end_time", "invalid": invalid}), 400
+    print(f"Received request to add {len(events)} events.")
+
+    # Everything is queued before waiting, so the whole request shares the same batches.
+    futures = [submit_event('primary', event, item.get('idempotency_key')) for item, event in zip(items, events)]
+    results = [wait_for_write(future) for future in futures]
+    all_written = all(result["status"] in ("created", "duplicate") for result in results)
+    return jsonify({"results": results}), 200 if all_written else 207
+
+@app.route('/calendar_webhook', methods=['POST'])
+def calendar_webhook():
+    """Receives Calendar push notifications and wakes the scheduler daemon."""
+    if WEBHOOK_TOKEN and request.headers.get('X-Goog-Channel-Token') != WEBHOOK_TOKEN:
+        return jsonify({"error": "Invalid channel token"}), 403
+
+    resource_state = request.headers.get('X-Goog-Resource-State')
+    # The first "sync" message only confirms that the channel was opened.
+    if resource_state != 'sync':
+        print(f"Calendar push notification received (state: {resource_state}). Waking daemon.")
+        send_wake_signal(request.headers.get('X-Goog-Channel-ID'))
+    return '', 200
+
+@app.route('/ingest', methods=['POST'])
+def ingest_recording():
+    """Accepts a meeting recording upload and drops it where the ingest daemon picks it up."""
+    upload = request.files.get('file')
+    if not upload or not is_audio_file(upload.filename or ''):
+        return jsonify({"error": "Expected an audio file in the 'file' form field"}), 400
+
+    job_id = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}_{secure_filename(upload.filename)}"
+    os.makedirs(INGEST_DROP_DIR, exist_ok=True)
+    # Write under a temporary name first so the daemon never sees a partial upload.
+    temp_path = os.path.join(INGEST_DROP_DIR, f".{job_id}.part")
+    upload.save(temp_path)
+    os.replace(temp_path, os.path.join(INGEST_DROP_DIR, job_id))
+    print(f"Queued recording for ingestion: {job_id}")
+    return jsonify({"status": "queued", "job_id": job_id}), 202
+
+@app.route('/ingest/<job_id>', methods=['GET'])
+def ingest_status(job_id):
+    """Reports the status (and summary, once done) of an ingest job."""
+    job = load_jobs().get(job_id)
+    if job is None:
+        # The daemon only records a job once the file has been picked up.
+        if os.path.exists(os.path.join(INGEST_DROP_DIR, job_id)):
+            return jsonify({"job_id": job_id, "status": "waiting"}), 200
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify({"job_id": job_id, **job}), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Serves this server's metrics and the daemons' latest snapshots in the Prometheus text format."""
+    snapshots = {**load_snapshots(), "server": take_snapshot()}
+    return Response(render_prometheus(snapshots), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     # Runs on http://0.0.0.0:5678, accessible from other devices on your network
-    app.run(host='0.0.0.0', port=5678, debug=True)
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress is not installed; falling back to Flask's threaded development server.")
+        app.run(host='0.0.0.0', port=5678, threaded=True)
+    else:
+        serve(app, host='0.0.0.0', port=5678, threads=SERVER_THREADS)
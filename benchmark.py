@@ -0,0 +1,401 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import pytz
+
+import briefing
+import calendar_client
+import calendar_sync
+import event_store
+import llm_cache
+import planner
+import prompt_builder
+import scheduler
+from calendar_client import find_or_create_aegis_calendar
+from default_variables import LOCAL_TIMEZONE
+from fake_calendar import FakeCalendarService, parse_bound
+from llm_client import record_token_usage
+from profiles import make_profile
+from task_store import mark_tasks_completed
+
+
+# Offline benchmark: replays simulated days against the in-memory Calendar fake and a
+# deterministic fake LLM, and reports replan latency, API round trips and bytes.
+#   python benchmark.py                       # every scenario
+#   python benchmark.py busy --json           # one scenario, machine-readable
+#   python benchmark.py --llm-noise 0.3       # a sloppy LLM, to exercise the schedule repair
+#   python benchmark.py --check-cache         # also check that a reverted change is an LLM cache hit
+#   python benchmark.py --max-replan-p95-ms 500 --max-requests-per-cycle 12   # exit 1 on regression
+
+SCENARIOS = {
+    "light": {"meetings": 3, "tasks": 8, "churn": 0.2, "days": 1, "cycles": 6},
+    "busy": {"meetings": 12, "tasks": 25, "churn": 0.5, "days": 1, "cycles": 10},
+    "many_tasks": {"meetings": 5, "tasks": 120, "churn": 0.3, "days": 1, "cycles": 6},
+    "multi_day": {"meetings": 6, "tasks": 15, "churn": 0.25, "days": 5, "cycles": 6},
+    "catalog": {"meetings": 5, "tasks": 3000, "churn": 0.3, "days": 2, "cycles": 6},
+}
+CATEGORIES = ["health", "deep_work", "learning", "hobby_skill", "hobby_creative", "chores"]
+FIRST_DAY = datetime.date(2026, 3, 2)  # a Monday, so results don't depend on today's date
+
+# --- Simulated Clock ---
+
+# The scheduler reads the wall clock; the benchmark swaps in this one so runs are repeatable.
+simulated_now = None
+
+
+class SimulatedDatetime(datetime.datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return simulated_now.astimezone(tz) if tz else simulated_now.astimezone().replace(tzinfo=None)
+
+
+class SimulatedDate(datetime.date):
+    @classmethod
+    def today(cls):
+        return simulated_now.astimezone().date()
+
+
+def install_simulated_clock():
+    """Points the datetime module of every planning module at the simulated clock."""
+    clock = type(datetime)("simulated_datetime")
+    clock.__dict__.update(datetime.__dict__)
+    clock.datetime, clock.date = SimulatedDatetime, SimulatedDate
+    for module in (scheduler, prompt_builder, calendar_sync, event_store, briefing, planner):
+        module.datetime = clock
+
+def set_clock(day, hour, minute=0):
+    """Moves the simulated clock to a local time on a given date."""
+    global simulated_now
+    local = pytz.timezone(LOCAL_TIMEZONE).localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
+    simulated_now = local.astimezone(datetime.timezone.utc)
+
+# --- Fake LLM ---
+
+fake_llm_latency = 0.0
+fake_llm_noise = 0.0  # share of entries the fake LLM gets wrong, like a small local model
+fake_llm_rng = random.Random(0)
+fake_llm_calls = 0
+fake_llm_prompt_tokens = []
+
+
+def read_prompt_table(prompt, header, next_header):
+    """Returns the pipe-separated rows between two section headers of a planner prompt."""
+    section = prompt.split(header, 1)[1].split(next_header, 1)[0]
+    lines = [line for line in section.strip().splitlines() if "|" in line]
+    return [line.split("|") for line in lines[1:]]
+
+def parse_prompt_time(value, today, local_tz):
+    """Parses an HH:MM (today) or YYYY-MM-DD HH:MM prompt timestamp."""
+    if len(value) == 5:
+        value = f"{today.isoformat()} {value}"
+    return local_tz.localize(datetime.datetime.strptime(value, "%Y-%m-%d %H:%M")).isoformat()
+
+def fake_plan(prompt):
+    """Deterministic 'model': reads the tasks and free slots back out of the prompt and packs them."""
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    prompt = prompt[prompt.rindex("Current Time: "):]  # skip the system prompt, if it was prepended
+    today = datetime.date.fromisoformat(prompt[len("Current Time: "):][:10])
+    tasks = [
+        {"id": row[0], "name": row[1], "category": row[2],
+         "min_duration_minutes": int(row[3]), "max_duration_minutes": int(row[4])}
+        for row in read_prompt_table(prompt, "Available Tasks:", "Completed or In-Progress")
+    ]
+    slots = [
+        {"start": parse_prompt_time(row[0], today, local_tz), "end": parse_prompt_time(row[1], today, local_tz)}
+        for row in read_prompt_table(prompt, "Future Free Time Slots", "Recent User Feedback")
+    ]
+    events = planner.plan_schedule(tasks, slots, [])["events"]
+    return json.dumps({"events": [add_noise(event) if fake_llm_rng.random() < fake_llm_noise else event
+                                  for event in events]})
+
+def add_noise(event):
+    """Makes one of the mistakes small models make: a shifted or overlong block, or an invented task id."""
+    mistake = fake_llm_rng.choice(["shift", "stretch", "unknown_task"])
+    if mistake == "unknown_task":
+        return {**event, "task_id": f"{event['task_id']}_v2"}
+    start = datetime.datetime.fromisoformat(event["start_time"])
+    end = datetime.datetime.fromisoformat(event["end_time"])
+    offset = datetime.timedelta(minutes=fake_llm_rng.choice([-20, -10, 10, 20]))
+    if mistake == "shift":
+        start, end = start + offset, end + offset
+    else:
+        end += datetime.timedelta(minutes=45)
+    return {**event, "start_time": start.strftime("%Y-%m-%dT%H:%M:%S"), "end_time": end.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def fake_generate(prompt, json_format=False):
+    """Stands in for gemini_generate: sleeps for the configured latency, then answers."""
+    global fake_llm_calls
+    fake_llm_calls += 1
+    fake_llm_prompt_tokens.append(prompt_builder.estimate_tokens(prompt))
+    time.sleep(fake_llm_latency)
+    response_text = fake_plan(prompt)
+    record_token_usage("fake", prompt_builder.estimate_tokens(prompt), prompt_builder.estimate_tokens(response_text))
+    return response_text
+
+def fake_stream(prompt, json_format=False):
+    """Stands in for gemini_stream: yields the answer in pieces spread over the configured latency."""
+    global fake_llm_calls
+    fake_llm_calls += 1
+    fake_llm_prompt_tokens.append(prompt_builder.estimate_tokens(prompt))
+    response_text = fake_plan(prompt)
+    pieces = [response_text[i:i + 64] for i in range(0, len(response_text), 64)]
+    for piece in pieces:
+        time.sleep(fake_llm_latency / len(pieces))
+        yield piece
+    record_token_usage("fake", prompt_builder.estimate_tokens(prompt), prompt_builder.estimate_tokens(response_text))
+
+def install_fake_llm(latency, noise=0.0):
+    """Routes the scheduler's LLM calls (both backends) to the fake model."""
+    global fake_llm_latency, fake_llm_noise
+    fake_llm_latency = latency
+    fake_llm_noise = noise
+    scheduler.gemini_generate = fake_generate
+    scheduler.gemini_stream = fake_stream
+    scheduler.ollama_generate = lambda system_prompt, prompt, json_format=False: fake_generate(prompt)
+    scheduler.ollama_stream = lambda system_prompt, prompt, json_format=False: fake_stream(prompt)
+
+# --- Scenario Data ---
+
+def write_tasks(path, count, rng):
+    """Writes a task library with count tasks spread over the categories."""
+    tasks = []
+    for index in range(count):
+        min_minutes = rng.choice([15, 20, 30, 45])
+        tasks.append({
+            "id": f"task_{index}",
+            "name": f"Task {index}",
+            "category": CATEGORIES[index % len(CATEGORIES)],
+            "min_duration_minutes": min_minutes,
+            "max_duration_minutes": min_minutes + rng.choice([0, 15, 30, 60, 90]),
+            "last_completed_utc": None,
+        })
+    with open(path, "w") as f:
+        json.dump({"tasks": tasks}, f, indent=2)
+
+def meeting_time(day, rng):
+    """Picks a random 30-90 minute meeting between 09:00 and 18:00 on a quarter hour."""
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    start_minute = rng.randrange(9 * 60, 17 * 60, 15)
+    start = local_tz.localize(datetime.datetime.combine(day, datetime.time(start_minute // 60, start_minute % 60)))
+    return start, start + datetime.timedelta(minutes=rng.choice([30, 45, 60, 90]))
+
+def apply_churn(service, day, churn, rng):
+    """Moves, cancels or adds meetings like colleagues would during the day."""
+    for event in list(service.list_live_events()):
+        if rng.random() >= churn:
+            continue
+        if rng.random() < 0.2:
+            service.cancel_meeting(event["id"])
+        else:
+            service.move_meeting(event["id"], *meeting_time(day, rng))
+    if rng.random() < churn:
+        service.add_meeting(*meeting_time(day, rng))
+
+# --- Runner ---
+
+def count_conflicts(service, aegis_calendar_id, now_utc):
+    """Counts Aegis events that overlap a meeting or another Aegis event from now on."""
+    meetings = [(parse_bound(event["start"]), parse_bound(event["end"])) for event in service.list_live_events()]
+    blocks = sorted((max(parse_bound(event["start"]), now_utc), parse_bound(event["end"]))
+                    for event in service.list_live_events(aegis_calendar_id))
+    blocks = [block for block in blocks if block[1] > now_utc]
+    conflicts = sum(1 for start, end in blocks if any(start < m_end and end > m_start for m_start, m_end in meetings))
+    return conflicts + sum(1 for previous, block in zip(blocks, blocks[1:]) if block[0] < previous[1])
+
+def run_scenario(name, meetings, tasks, churn, days, cycles, planner_mode, detection, stream, preplan=False, seed=7):
+    """Replays one scenario and returns its measurements. With preplan, each night drafts the next day."""
+    rng = random.Random(seed)
+    scheduler.PLANNER_MODE = planner_mode
+    scheduler.CHANGE_DETECTION = detection
+    scheduler.STREAM_LLM_OUTPUT = stream
+    scheduler.LLM_BACKEND = "gemini"
+    scheduler.LLM_CACHE_ENABLED = False
+    service = FakeCalendarService()
+    replan_seconds = []
+    check_seconds = []
+    replan_stats = []
+    preplan_seconds = []
+    conflicts = 0
+    llm_calls_before = fake_llm_calls
+    del fake_llm_prompt_tokens[:]
+
+    with tempfile.TemporaryDirectory() as directory:
+        profile = make_profile(name, directory)
+        write_tasks(profile["tasks_file"], tasks, rng)
+        store = event_store.open_event_store(profile["event_store_file"]) if detection == "sync" else None
+        state = {}
+        set_clock(FIRST_DAY, 7)
+        aegis_calendar_id = find_or_create_aegis_calendar(service)
+        for _ in range(meetings):
+            service.add_meeting(*meeting_time(FIRST_DAY, rng))
+        for day_index in range(days):
+            day = FIRST_DAY + datetime.timedelta(days=day_index)
+            for cycle in range(cycles):
+                minutes = 8 * 60 + cycle * (13 * 60 // cycles)
+                set_clock(day, minutes // 60, minutes % 60)
+                if cycle:
+                    apply_churn(service, day, churn, rng)
+                before = service.stats.copy()
+                started = time.perf_counter()
+                changed = scheduler.check_for_changes(service, aegis_calendar_id, state, store)
+                checked = time.perf_counter()
+                check_seconds.append(checked - started)
+                if changed:
+                    scheduler.replan_schedule(service, aegis_calendar_id, state, store, profile)
+                    replan_seconds.append(time.perf_counter() - started)
+                    replan_stats.append(service.stats - before)
+                    conflicts += count_conflicts(service, aegis_calendar_id, simulated_now)
+            briefing.get_todays_briefing(service, aegis_calendar_id)
+            # Tomorrow's meetings are booked in advance; the night's check and draft see them.
+            for _ in range(meetings):
+                service.add_meeting(*meeting_time(day + datetime.timedelta(days=1), rng))
+            if preplan and day_index + 1 < days:
+                set_clock(day, 23, 30)
+                scheduler.check_for_changes(service, aegis_calendar_id, state, store)
+                started = time.perf_counter()
+                scheduler.preplan_days(service, aegis_calendar_id, state, store, profile, days=1)
+                preplan_seconds.append(time.perf_counter() - started)
+        if store is not None:
+            store.close()
+
+    stats = service.stats
+    total_cycles = days * cycles
+    return {
+        "scenario": name,
+        "planner": planner_mode,
+        "detection": detection,
+        "stream": stream,
+        "cycles": total_cycles,
+        "preplan": preplan,
+        "replans": len(replan_seconds),
+        "check_ms_mean": round(statistics.mean(check_seconds) * 1000, 2),
+        "replan_ms_p50": round(statistics.median(replan_seconds) * 1000, 2) if replan_seconds else 0,
+        "replan_ms_p95": round(percentile(replan_seconds, 95) * 1000, 2),
+        "replan_ms_max": round(max(replan_seconds, default=0) * 1000, 2),
+        "requests": stats["requests"],
+        "requests_per_cycle": round(stats["requests"] / total_cycles, 2),
+        "requests_per_replan": round(statistics.mean(s["requests"] for s in replan_stats), 2) if replan_stats else 0,
+        "calls": stats["calls"],
+        "batches": stats["batches"],
+        "bytes_sent": stats["bytes_sent"],
+        "bytes_received": stats["bytes_received"],
+        "bytes_per_replan": round(statistics.mean(s["bytes_sent"] + s["bytes_received"] for s in replan_stats))
+        if replan_stats else 0,
+        "llm_calls": fake_llm_calls - llm_calls_before,
+        "conflicts": conflicts,
+        "prompt_tokens_mean": round(statistics.mean(fake_llm_prompt_tokens)) if fake_llm_prompt_tokens else 0,
+        "preplan_ms_mean": round(statistics.mean(preplan_seconds) * 1000, 2) if preplan_seconds else 0,
+        "calls_by_method": {key: value for key, value in sorted(stats.items()) if key.startswith("calendar.")},
+    }
+
+def check_cache_revert(seed=7):
+    """
+    Plans one day three times through the LLM cache: as booked, with its meeting moved
+    and with it moved back, rewriting the completion times after each plan as a replan
+    does. Returns (LLM calls, cache hits); the revert should be the one hit.
+    """
+    rng = random.Random(seed)
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    scheduler.LLM_BACKEND = "gemini"
+    scheduler.LLM_CACHE_ENABLED = True
+    llm_calls_before = fake_llm_calls
+
+    def at(hour):
+        return local_tz.localize(datetime.datetime.combine(FIRST_DAY, datetime.time(hour))).isoformat()
+
+    with tempfile.TemporaryDirectory() as directory:
+        llm_cache.LLM_CACHE_DIR = directory
+        profile = make_profile("cache", directory)
+        write_tasks(profile["tasks_file"], 8, rng)
+        with open(profile["tasks_file"]) as f:
+            tasks = json.load(f)["tasks"]
+        set_clock(FIRST_DAY, 8)
+        for meeting_hour in (11, 14, 11):
+            prompt_data = {
+                "tasks": tasks,
+                "past_events": [],
+                "future_free_slots": [{"start": at(9), "end": at(meeting_hour)}, {"start": at(meeting_hour + 1), "end": at(18)}],
+            }
+            mark_tasks_completed(tasks, scheduler.parse_schedule(scheduler.query_llm(prompt_data, "")))
+        hits = llm_cache.get_cache_stats()["hits"]
+    scheduler.LLM_CACHE_ENABLED = False
+    return fake_llm_calls - llm_calls_before, hits
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of a list of numbers (0 when empty)."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))]
+
+def print_report(results):
+    """Prints one table row per scenario run."""
+    columns = ["scenario", "planner", "detection", "replans", "check_ms_mean", "replan_ms_p50", "replan_ms_p95",
+               "replan_ms_max", "requests_per_cycle", "requests_per_replan", "bytes_per_replan", "llm_calls", "prompt_tokens_mean", "conflicts"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Aegis replan benchmark (fake Calendar, fake LLM).")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help=f"any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--planner", choices=["llm", "native"], default="llm")
+    parser.add_argument("--detection", choices=["sync", "hash"], default="sync")
+    parser.add_argument("--no-stream", action="store_true", help="wait for the whole LLM answer before writing")
+    parser.add_argument("--preplan", action="store_true", help="draft each next day overnight, as the daemon does")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds the fake LLM takes per answer")
+    parser.add_argument("--llm-noise", type=float, default=0.0, help="share of the fake LLM's entries to get wrong")
+    parser.add_argument("--check-cache", action="store_true", help="fail unless a reverted change hits the LLM cache")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the scheduler's own output")
+    parser.add_argument("--max-replan-p95-ms", type=float, help="fail if any scenario's p95 replan is slower")
+    parser.add_argument("--max-requests-per-cycle", type=float, help="fail if any scenario uses more round trips")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    install_simulated_clock()
+    install_fake_llm(args.llm_latency, args.llm_noise)
+    # A simulated day passes in milliseconds of real time, so the real-time quota would only add sleeps.
+    calendar_client.CALENDAR_QUOTA_PER_SECOND = calendar_client.CALENDAR_QUOTA_BURST = 10 ** 9
+
+    results = []
+    for name in args.scenarios:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            results.append(run_scenario(name, **SCENARIOS[name], planner_mode=args.planner,
+                                        detection=args.detection, stream=not args.no_stream, preplan=args.preplan))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+    failures = [
+        f"{result['scenario']}: {label} {result[key]} > {limit}"
+        for result in results
+        for key, label, limit in (("replan_ms_p95", "p95 replan ms", args.max_replan_p95_ms),
+                                  ("requests_per_cycle", "requests per cycle", args.max_requests_per_cycle))
+        if limit is not None and result[key] > limit
+    ]
+    if args.check_cache:
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+            llm_calls, hits = check_cache_revert()
+        print(f"LLM cache (booked, moved, reverted): {llm_calls} LLM calls, {hits} cache hits", file=sys.stderr)
+        if hits != 1:
+            failures.append(f"cache: reverted change was not a cache hit ({hits} hits)")
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
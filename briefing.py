@@ -1,103 +1,148 @@
+import argparse
 import datetime
+import json
 import os.path
-from tzlocal import get_localzone_name
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
-AEGIS_CALENDAR_NAME = "Aegis_Shasanam"
-
-# Dynamic timezone detection (same as in scheduler_v3.py)
-try:
-    LOCAL_TIMEZONE = get_localzone_name()
-except Exception:
-    print("Warning: Could not automatically detect timezone. Falling back to UTC.")
-    LOCAL_TIMEZONE = "UTC"
-
-def setup_google_calendar_api():
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    return build("calendar", "v3", credentials=creds)
-
-def find_aegis_calendar_id(service):
-    calendar_list = service.calendarList().list().execute()
-    for calendar_list_entry in calendar_list["items"]:
-        if calendar_list_entry["summary"] == AEGIS_CALENDAR_NAME:
-            return calendar_list_entry["id"]
-    return None
+
+from default_variables import EVENT_STORE_FILE, STATE_FILE, AEGIS_CALENDAR_NAME, LOCAL_TIMEZONE, \
+    SCHEDULE_SNAPSHOT_FILE
+from calendar_client import setup_google_calendar_api, find_aegis_calendar_id, iter_events
+from event_store import open_event_store, query_events, find_calendar_id_by_name, get_calendar_sync_time
+from schedule_snapshot import to_snapshot_row, load_schedule_snapshot
+
+# Named briefing ranges, in days from the start date.
+BRIEFING_RANGES = {"today": 1, "week": 7, "month": 30}
+
+def load_saved_calendar_state(state_file=STATE_FILE):
+    """Reads the daemon's state file, which persists the Aegis calendar id; {} if there is none."""
+    try:
+        with open(state_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
 
 def get_local_day_boundaries():
     """
     Returns the start and end of the current local day in UTC.
     Same helper function as in scheduler_v3.py.
     """
+    return get_local_range_boundaries(datetime.date.today(), 1)
+
+def get_local_range_boundaries(start_date, days):
+    """Returns the start of start_date and the end of its days-th day (local time) in UTC."""
     local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
-    now_local = datetime.datetime.now(local_tz)
-    
-    start_of_local_day = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_of_local_day = now_local.replace(hour=23, minute=59, second=59, microsecond=0)
-    
+    start_of_range = datetime.datetime.combine(start_date, datetime.time(), tzinfo=local_tz)
+    end_of_range = datetime.datetime.combine(
+        start_date + datetime.timedelta(days=days - 1), datetime.time(23, 59, 59), tzinfo=local_tz
+    )
+
     # Convert to UTC for API calls
-    start_utc = start_of_local_day.astimezone(datetime.timezone.utc)
-    end_utc = end_of_local_day.astimezone(datetime.timezone.utc)
-    
-    return start_utc, end_utc
+    return start_of_range.astimezone(datetime.timezone.utc), end_of_range.astimezone(datetime.timezone.utc)
 
-def get_todays_briefing(service, calendar_id):
-    """Gets today's Aegis events using consistent timezone logic."""
-    start_utc, end_utc = get_local_day_boundaries()
-    
-    print(f"--- Aegis_Shasanam Daily Briefing for {datetime.date.today()} ({LOCAL_TIMEZONE}) ---")
+def print_briefing_header(start_date, days):
+    """Prints the title line of a one-day or multi-day briefing."""
+    if days == 1:
+        print(f"--- Aegis_Shasanam Daily Briefing for {start_date} ({LOCAL_TIMEZONE}) ---")
+    else:
+        last_date = start_date + datetime.timedelta(days=days - 1)
+        print(f"--- Aegis_Shasanam Briefing for {start_date} to {last_date} ({LOCAL_TIMEZONE}) ---")
 
-    events_result = service.events().list(
+def get_briefing(service, calendar_id, start_date, days=1):
+    """Prints the Aegis events of a range, page by page as the API returns them."""
+    start_utc, end_utc = get_local_range_boundaries(start_date, days)
+    print_briefing_header(start_date, days)
+    events = iter_events(
+        service,
         calendarId=calendar_id,
         timeMin=start_utc.isoformat(),
         timeMax=end_utc.isoformat(),
         timeZone=LOCAL_TIMEZONE,
         singleEvents=True,
         orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
+    )
+    print_briefing_events(events, multi_day=days > 1)
 
-    if not events:
-        print("Your schedule is clear. A new plan will be generated shortly.")
-        return
+def get_todays_briefing(service, calendar_id):
+    """Gets today's Aegis events using consistent timezone logic."""
+    get_briefing(service, calendar_id, datetime.date.today())
+
+def get_briefing_from_store(store, calendar_id, start_date, days=1):
+    """Prints the Aegis events of a range from the local event store kept current by the daemon."""
+    start_utc, end_utc = get_local_range_boundaries(start_date, days)
+    print_briefing_header(start_date, days)
+    print(f"(from local event store, last synced {get_calendar_sync_time(store, calendar_id)})")
+    print_briefing_events(query_events(store, calendar_id, start_utc, end_utc), multi_day=days > 1)
+
+def get_briefing_from_snapshot(snapshot, start_date, days=1):
+    """Prints a range from the scheduler's pre-rendered snapshot; no parsing, store or API needed."""
+    first_day, last_day = start_date.isoformat(), (start_date + datetime.timedelta(days=days - 1)).isoformat()
+    print_briefing_header(start_date, days)
+    print(f"(from the schedule snapshot of {snapshot['generated_at']})")
+    print_briefing_rows((row for row in snapshot["rows"] if first_day <= row[0] <= last_day), multi_day=days > 1)
 
+def print_briefing_events(events, multi_day=False):
+    """Prints the briefing lines for events sorted by start time; any iterable, consumed lazily."""
     # Get local timezone for display
     local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+    print_briefing_rows((to_snapshot_row(event, local_tz) for event in events), multi_day)
 
-    for event in events:
-        start_str = event['start'].get('dateTime')
-        if start_str:
-            # Parse the datetime and convert to local time for display
-            start_dt_utc = datetime.datetime.fromisoformat(start_str.replace('Z', '+00:00'))
-            local_start = start_dt_utc.astimezone(local_tz)
-            print(f"  - {local_start.strftime('%H:%M')}: {event['summary']}")
-        else:
-            # Handle all-day events
-            print(f"  - All Day: {event['summary']}")
+def print_briefing_rows(rows, multi_day=False):
+    """Prints [local date, HH:MM or None for all-day, summary] rows, with a heading per day if multi_day."""
+    current_date = None
+    printed = 0
+    for date, start_time, summary in rows:
+        if multi_day and date != current_date:
+            print(f"  {date}:")
+            current_date = date
+        print(f"  {'  ' if multi_day else ''}- {start_time or 'All Day'}: {summary}")
+        printed += 1
+    if not printed:
+        print("Your schedule is clear. A new plan will be generated shortly.")
+        return
     print("---------------------------------------------------------")
 
+def parse_briefing_range(value):
+    """Turns a named range or a positive number of days into a number of days, for argparse."""
+    if value in BRIEFING_RANGES:
+        return BRIEFING_RANGES[value]
+    try:
+        days = int(value)
+    except ValueError:
+        days = 0
+    if days < 1:
+        raise argparse.ArgumentTypeError(f"expected {', '.join(BRIEFING_RANGES)} or a positive number of days, got '{value}'")
+    return days
+
 def main():
+    parser = argparse.ArgumentParser(description="Prints the Aegis_Shasanam schedule.")
+    parser.add_argument("range", nargs="?", default="today", type=parse_briefing_range,
+                        help=f"{', '.join(BRIEFING_RANGES)} or a number of days (default: today)")
+    parser.add_argument("--start", type=datetime.date.fromisoformat, help="first day, YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+    days = args.range
+    today = datetime.date.today()
+    start_date = args.start or today
+    start_utc, end_utc = get_local_range_boundaries(start_date, days)
+
     print(f"Using timezone: {LOCAL_TIMEZONE}")
+    # Fastest first: the snapshot written after the last replan, then the daemon's local
+    # event store (which holds everything from the day it first synced on), then the API.
+    snapshot = load_schedule_snapshot(start_utc, end_utc, SCHEDULE_SNAPSHOT_FILE)
+    if snapshot is not None:
+        get_briefing_from_snapshot(snapshot, start_date, days)
+        return
+    if os.path.exists(EVENT_STORE_FILE) and start_date >= today:
+        store = open_event_store()
+        aegis_calendar_id = find_calendar_id_by_name(store, AEGIS_CALENDAR_NAME)
+        if aegis_calendar_id and get_calendar_sync_time(store, aegis_calendar_id):
+            get_briefing_from_store(store, aegis_calendar_id, start_date, days)
+            return
+
     service = setup_google_calendar_api()
-    aegis_calendar_id = find_aegis_calendar_id(service)
+    aegis_calendar_id = find_aegis_calendar_id(service, load_saved_calendar_state())
     if not aegis_calendar_id:
         print(f"Error: Calendar '{AEGIS_CALENDAR_NAME}' not found.")
         return
-    get_todays_briefing(service, aegis_calendar_id)
+    get_briefing(service, aegis_calendar_id, start_date, days)
 
 if __name__ == "__main__":
     main()
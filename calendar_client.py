@@ -0,0 +1,299 @@
+import concurrent.futures
+import copy
+import functools
+import json
+import os.path
+import random
+import threading
+import time
+
+import httplib2
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+from default_variables import SCOPES, AEGIS_CALENDAR_NAME, CALENDAR_BATCH_SIZE, CALENDAR_API_ENDPOINT, \
+    CALENDAR_QUOTA_PER_SECOND, CALENDAR_QUOTA_BURST, CALENDAR_MAX_RETRIES, CALENDAR_BACKOFF_BASE_SECONDS, \
+    CALENDAR_BACKOFF_MAX_SECONDS
+from metrics import record_api_call, increment, observe
+
+
+# The lightweight Calendar client shared by the scheduler, daemon, server and briefing.
+# It imports nothing from the LLM stack, and the OAuth flow and token refresh
+# libraries are only imported when they are actually needed.
+
+_discovery_document = None
+
+# Token buckets by OAuth token file: Calendar quota is per user, so each user's
+# requests share one bucket however many service objects they use.
+_quotas = {}
+_quotas_lock = threading.Lock()
+# Futures of GET requests in flight, by (client, uri), so identical concurrent reads share one call.
+_in_flight_reads = {}
+_in_flight_lock = threading.Lock()
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+# --- Quota and Retry Functions ---
+
+def get_quota(key="default"):
+    """Returns the token bucket for one quota key (a token file), creating it full."""
+    with _quotas_lock:
+        if key not in _quotas:
+            _quotas[key] = {"tokens": float(CALENDAR_QUOTA_BURST), "updated": time.monotonic(),
+                            "lock": threading.Lock()}
+        return _quotas[key]
+
+def acquire_quota(quota, tokens=1):
+    """
+    Blocks until the token bucket can cover `tokens` requests, then takes them all.
+    A request for more than the burst waits for a full bucket and leaves it in debt,
+    so later requests wait until the rate has paid it back.
+    """
+    needed = min(tokens, CALENDAR_QUOTA_BURST)
+    while True:
+        with quota["lock"]:
+            now = time.monotonic()
+            quota["tokens"] = min(CALENDAR_QUOTA_BURST,
+                                  quota["tokens"] + (now - quota["updated"]) * CALENDAR_QUOTA_PER_SECOND)
+            quota["updated"] = now
+            if quota["tokens"] >= needed:
+                quota["tokens"] -= tokens
+                return
+            wait_seconds = (needed - quota["tokens"]) / CALENDAR_QUOTA_PER_SECOND
+        increment("aegis_api_throttled_total")
+        time.sleep(wait_seconds)
+
+def is_retryable_error(error, idempotent=True):
+    """
+    Checks whether a failed call is worth retrying: rate limiting always (the call was
+    refused), server errors and dropped connections only if repeating it is safe.
+    """
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or (status == 403 and any(reason.encode() in (error.content or b"")
+                                                   for reason in RATE_LIMIT_REASONS)):
+            return True
+        return idempotent and status in RETRYABLE_STATUSES
+    return idempotent and isinstance(error, (OSError, httplib2.HttpLib2Error))
+
+def get_backoff_seconds(attempt):
+    """Exponential backoff with full jitter: a random delay up to base * 2^attempt, capped."""
+    return random.uniform(0, min(CALENDAR_BACKOFF_MAX_SECONDS, CALENDAR_BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+def call_with_retries(method, call, quota, idempotent=True, tokens=1):
+    """
+    Runs one API call under the quota's token bucket, retrying retryable failures with
+    backoff up to CALENDAR_MAX_RETRIES times. Latency and retries are counted per method.
+    """
+    for attempt in range(CALENDAR_MAX_RETRIES + 1):
+        acquire_quota(quota, tokens)
+        started = time.perf_counter()
+        try:
+            response = call()
+        except Exception as error:
+            observe("aegis_api_seconds", time.perf_counter() - started, method=method)
+            record_api_call(method, ok=False)
+            if attempt == CALENDAR_MAX_RETRIES or not is_retryable_error(error, idempotent):
+                raise
+            delay = get_backoff_seconds(attempt)
+            increment("aegis_api_retries_total", method=method)
+            print(f"  [RETRY] {method} failed ({error}); retrying in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+        observe("aegis_api_seconds", time.perf_counter() - started, method=method)
+        record_api_call(method, ok=True)
+        return response
+
+# --- Client Setup Functions ---
+
+class InstrumentedHttpRequest(HttpRequest):
+    """
+    An HttpRequest that goes through its user's quota and the shared retry and metrics
+    layer. Identical reads from the same client that overlap in time are sent only once.
+    """
+
+    def __init__(self, *args, quota=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.quota = quota if quota is not None else get_quota()
+
+    def execute(self, *args, **kwargs):
+        method = self.methodId or "unknown"
+        send = lambda: HttpRequest.execute(self, *args, **kwargs)
+        if self.method != "GET":
+            return call_with_retries(method, send, self.quota, idempotent=self.method != "POST")
+
+        key = (id(self.http), self.uri)
+        with _in_flight_lock:
+            future = _in_flight_reads.get(key)
+            leader = future is None
+            if leader:
+                future = _in_flight_reads[key] = concurrent.futures.Future()
+        if not leader:
+            increment("aegis_api_deduplicated_total", method=method)
+            return copy.deepcopy(future.result())
+        try:
+            response = call_with_retries(method, send, self.quota)
+            future.set_result(response)
+            return response
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with _in_flight_lock:
+                _in_flight_reads.pop(key, None)
+
+def get_discovery_document():
+    """
+    Returns the parsed Calendar v3 discovery document, read from the copy bundled with
+    googleapiclient (no network fetch) and parsed once per process.
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        from googleapiclient import discovery_cache
+        document = discovery_cache.get_static_doc("calendar", "v3")
+        if document is not None:
+            _discovery_document = json.loads(document)
+    return _discovery_document
+
+def build_calendar_service(credentials, client_options=None, quota_key="default"):
+    """Builds a Calendar service from the cached discovery document, drawing on quota_key's quota."""
+    document = get_discovery_document()
+    request_builder = functools.partial(InstrumentedHttpRequest, quota=get_quota(quota_key))
+    if document is None:
+        return build("calendar", "v3", credentials=credentials, requestBuilder=request_builder,
+                     client_options=client_options)
+    return build_from_document(document, credentials=credentials, requestBuilder=request_builder,
+                               client_options=client_options)
+
+def load_credentials(token_file="token.json", interactive=True):
+    """
+    Loads the OAuth token, refreshing or (if interactive) re-authorizing it when needed.
+    Without interactive, a missing or unrefreshable token raises instead of opening a browser.
+    """
+    from google.oauth2.credentials import Credentials
+    creds = None
+    if os.path.exists(token_file):
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
+    if creds and creds.valid:
+        return creds
+    if creds and creds.expired and creds.refresh_token:
+        from google.auth.transport.requests import Request
+        creds.refresh(Request())
+    elif not interactive:
+        raise RuntimeError(f"No usable OAuth token in '{token_file}'.")
+    else:
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+        creds = flow.run_local_server(port=0)
+    with open(token_file, "w") as token:
+        token.write(creds.to_json())
+    return creds
+
+def setup_google_calendar_api(token_file="token.json", interactive=True):
+    """Initializes and returns the Google Calendar API service object, rate limited per token file."""
+    quota_key = os.path.abspath(token_file)
+    if CALENDAR_API_ENDPOINT:
+        # A local fake Calendar server needs no OAuth round trip.
+        from google.auth.credentials import AnonymousCredentials
+        return build_calendar_service(AnonymousCredentials(), {"api_endpoint": CALENDAR_API_ENDPOINT}, quota_key)
+    return build_calendar_service(load_credentials(token_file, interactive), quota_key=quota_key)
+
+# --- Calendar Lookup Functions ---
+
+def find_aegis_calendar_id(service, state=None):
+    """
+    Returns the Aegis_Shasanam calendar's id, or None if it doesn't exist. An id
+    persisted in state is used without an API call; a looked-up id is stored there.
+    """
+    if state and state.get("aegis_calendar_id"):
+        return state["aegis_calendar_id"]
+    page_token = None
+    while True:
+        calendar_list = service.calendarList().list(pageToken=page_token).execute()
+        for calendar_list_entry in calendar_list["items"]:
+            if calendar_list_entry["summary"] == AEGIS_CALENDAR_NAME:
+                if state is not None:
+                    state["aegis_calendar_id"] = calendar_list_entry["id"]
+                return calendar_list_entry["id"]
+        page_token = calendar_list.get("nextPageToken")
+        if not page_token:
+            return None
+
+def find_or_create_aegis_calendar(service, state=None):
+    """Finds the Aegis_Shasanam calendar or creates it if it doesn't exist."""
+    print(f"Looking for '{AEGIS_CALENDAR_NAME}' calendar...")
+    calendar_id = find_aegis_calendar_id(service, state)
+    if calendar_id:
+        print("Found calendar.")
+        return calendar_id
+    print("Calendar not found. Creating it...")
+    new_calendar = {"summary": AEGIS_CALENDAR_NAME}
+    created_calendar = service.calendars().insert(body=new_calendar).execute()
+    print("Calendar created.")
+    if state is not None:
+        state["aegis_calendar_id"] = created_calendar["id"]
+    return created_calendar["id"]
+
+# --- List Functions ---
+
+def iter_events(service, **list_kwargs):
+    """
+    Yields events().list results across every page. Each page is fetched only once
+    the previous one is used up, so callers can start on the first events early.
+    """
+    page_token = None
+    while True:
+        result = service.events().list(pageToken=page_token, **list_kwargs).execute()
+        yield from result.get("items", [])
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return
+
+# --- Batch Functions ---
+
+def execute_batched(service, requests_to_send):
+    """
+    Sends API requests as Google batch calls. Each batch takes one token per call from
+    the requests' quota, and calls that fail with a retryable error are re-sent in a
+    later batch. Returns (responses, failures): responses maps each successful request's index in
+    requests_to_send to its response, failures lists (index, error) pairs.
+    """
+    responses = {}
+    errors = {}
+
+    def callback(request_id, response, exception):
+        index = int(request_id)
+        record_api_call(getattr(requests_to_send[index], "methodId", None) or "unknown", ok=exception is None)
+        if exception is not None:
+            errors[index] = exception
+        else:
+            responses[index] = response
+            errors.pop(index, None)
+
+    def is_idempotent(index):
+        return getattr(requests_to_send[index], "method", "POST") != "POST"
+
+    pending = list(range(len(requests_to_send)))
+    quota = getattr(requests_to_send[0], "quota", None) if requests_to_send else None
+    quota = quota if quota is not None else get_quota()
+    for attempt in range(CALENDAR_MAX_RETRIES + 1):
+        for offset in range(0, len(pending), CALENDAR_BATCH_SIZE):
+            chunk = pending[offset:offset + CALENDAR_BATCH_SIZE]
+            batch = service.new_batch_http_request(callback=callback)
+            for index in chunk:
+                batch.add(requests_to_send[index], request_id=str(index))
+            call_with_retries("batch", batch.execute, quota, idempotent=all(is_idempotent(index) for index in chunk),
+                              tokens=len(chunk))
+        pending = [index for index, error in errors.items() if is_retryable_error(error, is_idempotent(index))]
+        if not pending or attempt == CALENDAR_MAX_RETRIES:
+            break
+        delay = get_backoff_seconds(attempt)
+        increment("aegis_api_retries_total", method="batch", value=len(pending))
+        print(f"  [RETRY] {len(pending)} batched request(s) failed; retrying in {delay:.1f}s.")
+        time.sleep(delay)
+    failures = sorted(errors.items())
+    for index, exception in failures:
+        print(f"  [WARN] Batched request {index} failed: {exception}")
+    return responses, failures
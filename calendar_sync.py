@@ -0,0 +1,202 @@
+import datetime
+import socket
+import time
+import uuid
+
+from googleapiclient.errors import HttpError
+
+from event_store import upsert_events, replace_calendar_events, mark_calendar_synced, get_calendar_sync_time
+from default_variables import WEBHOOK_URL, WEBHOOK_TOKEN, WATCH_CHANNEL_TTL_SECONDS, DAEMON_WAKE_PORT
+
+
+# --- Incremental Sync Functions ---
+
+def get_busy_interval(event):
+    """Returns the [start, end] strings an event blocks, or None if it doesn't block time."""
+    if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+        return None
+    start = event.get("start", {})
+    end = event.get("end", {})
+    start_str = start.get("dateTime") or start.get("date")
+    end_str = end.get("dateTime") or end.get("date")
+    if not start_str or not end_str:
+        return None
+    return [start_str, end_str]
+
+def parse_interval_bound(value):
+    """Parses a dateTime or all-day date string into an aware UTC datetime."""
+    if len(value) == 10:
+        local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=local_tz).astimezone(datetime.timezone.utc)
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(datetime.timezone.utc)
+
+def get_changed_intervals(old_busy, new_busy):
+    """
+    Returns the UTC (start, end) intervals whose busy state differs between two
+    {event id: [start, end]} maps: both the old and the new time of a moved event.
+    """
+    intervals = []
+    for event_id in set(old_busy) | set(new_busy):
+        old_interval, new_interval = old_busy.get(event_id), new_busy.get(event_id)
+        if old_interval == new_interval:
+            continue
+        for interval in (old_interval, new_interval):
+            if interval is not None:
+                intervals.append((parse_interval_bound(interval[0]), parse_interval_bound(interval[1])))
+    return intervals
+
+def interval_overlaps(interval, window_start_utc, window_end_utc):
+    """Checks whether a stored [start, end] interval overlaps the given UTC window."""
+    if interval is None:
+        return False
+    return parse_interval_bound(interval[0]) < window_end_utc and parse_interval_bound(interval[1]) > window_start_utc
+
+def list_all_pages(service, **list_kwargs):
+    """Runs events().list across every page; returns (items, nextSyncToken)."""
+    items = []
+    page_token = None
+    while True:
+        result = service.events().list(pageToken=page_token, **list_kwargs).execute()
+        items.extend(result.get("items", []))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return items, result.get("nextSyncToken")
+
+def sync_calendar_changes(service, calendar_id, sync_state, window_start_utc, window_end_utc, store=None):
+    """
+    Fetches only the events changed since the stored syncToken and reports whether
+    any of them moved, appeared or disappeared inside the given window. Etag, attendee
+    or description edits are ignored. Falls back to a full sync when no token is stored
+    or Google invalidates it (HTTP 410). Every fetched event is also written to the
+    local event store when one is given.
+    Returns (changed, new_sync_state, changed_events).
+    """
+    busy = dict(sync_state.get("busy", {}))
+    sync_token = sync_state.get("sync_token")
+    if store is not None and get_calendar_sync_time(store, calendar_id) is None:
+        # A fresh or deleted store can't be patched with deltas; rebuild it.
+        sync_token = None
+    full_sync = sync_token is None
+
+    if not full_sync:
+        try:
+            items, next_token = list_all_pages(service, calendarId=calendar_id, syncToken=sync_token, singleEvents=True)
+        except HttpError as error:
+            if error.resp.status != 410:
+                raise
+            print("  [SYNC] Sync token expired. Performing a full sync.")
+            full_sync = True
+
+    if full_sync:
+        items, next_token = list_all_pages(
+            service, calendarId=calendar_id, timeMin=window_start_utc.isoformat(), singleEvents=True
+        )
+        previous_busy = busy
+        busy = {event["id"]: get_busy_interval(event) for event in items}
+        busy = {event_id: interval for event_id, interval in busy.items() if interval}
+        moved_ids = {
+            event_id for event_id in set(previous_busy) | set(busy)
+            if previous_busy.get(event_id) != busy.get(event_id)
+        }
+        changed = any(
+            interval_overlaps(previous_busy.get(event_id), window_start_utc, window_end_utc)
+            or interval_overlaps(busy.get(event_id), window_start_utc, window_end_utc)
+            for event_id in moved_ids
+        )
+        changed_events = items
+    else:
+        changed = False
+        changed_events = []
+        for event in items:
+            old_interval = busy.get(event["id"])
+            new_interval = get_busy_interval(event)
+            if new_interval:
+                busy[event["id"]] = new_interval
+            else:
+                busy.pop(event["id"], None)
+            if old_interval == new_interval:
+                continue
+            changed_events.append(event)
+            if interval_overlaps(old_interval, window_start_utc, window_end_utc) or \
+                    interval_overlaps(new_interval, window_start_utc, window_end_utc):
+                changed = True
+
+    if store is not None:
+        if full_sync:
+            replace_calendar_events(store, calendar_id, items)
+        else:
+            upsert_events(store, calendar_id, items)
+            mark_calendar_synced(store, calendar_id)
+
+    # Forget events that ended before the window so the state file doesn't grow forever.
+    busy = {
+        event_id: interval for event_id, interval in busy.items()
+        if parse_interval_bound(interval[1]) > window_start_utc
+    }
+    print(f"  [SYNC] {'Full sync' if full_sync else 'Delta sync'} returned {len(items)} events.")
+    return changed, {"sync_token": next_token, "busy": busy}, changed_events
+
+# --- Push Notification Functions ---
+
+def start_watch_channel(service, calendar_id):
+    """Opens an events().watch push channel to WEBHOOK_URL and returns its state entry."""
+    body = {
+        "id": str(uuid.uuid4()),
+        "type": "web_hook",
+        "address": WEBHOOK_URL,
+        "params": {"ttl": str(WATCH_CHANNEL_TTL_SECONDS)},
+    }
+    if WEBHOOK_TOKEN:
+        body["token"] = WEBHOOK_TOKEN
+    channel = service.events().watch(calendarId=calendar_id, body=body).execute()
+    print(f"  [WATCH] Push channel {channel['id']} opened for '{calendar_id}'.")
+    return {"id": channel["id"], "resource_id": channel["resourceId"], "expiration": int(channel.get("expiration", 0))}
+
+def stop_watch_channel(service, channel):
+    """Stops a previously opened push channel, ignoring channels Google already dropped."""
+    try:
+        service.channels().stop(body={"id": channel["id"], "resourceId": channel["resource_id"]}).execute()
+    except HttpError as error:
+        print(f"  [WATCH] Could not stop channel {channel['id']}: {error}")
+
+def ensure_watch_channel(service, calendar_id, channel, renew_margin_seconds=3600):
+    """Returns a live push channel, renewing it shortly before it expires. No-op without WEBHOOK_URL."""
+    if not WEBHOOK_URL:
+        return None
+    now_ms = int(time.time() * 1000)
+    if channel and channel.get("expiration", 0) - now_ms > renew_margin_seconds * 1000:
+        return channel
+    if channel:
+        stop_watch_channel(service, channel)
+    return start_watch_channel(service, calendar_id)
+
+# --- Daemon Wake-up Functions ---
+
+def open_wake_socket():
+    """Binds the local UDP socket the daemon listens on for webhook wake-ups."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.bind(("127.0.0.1", DAEMON_WAKE_PORT))
+    except OSError as e:
+        print(f"  [WARN] Could not bind wake socket on port {DAEMON_WAKE_PORT}: {e}. Push wake-ups disabled.")
+        sock.close()
+        return None
+    sock.setblocking(False)
+    return sock
+
+def drain_wake_socket(sock):
+    """
+    Reads every pending wake signal so a burst of notifications causes one check.
+    Returns the set of channel ids they named (b"wake" when none was given).
+    """
+    payloads = set()
+    while True:
+        try:
+            payloads.add(sock.recv(256))
+        except BlockingIOError:
+            return payloads
+
+def send_wake_signal(channel_id=None):
+    """Tells a running daemon to check the calendar watched by channel_id (or every calendar) right away."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(channel_id.encode("utf-8") if channel_id else b"wake", ("127.0.0.1", DAEMON_WAKE_PORT))
@@ -0,0 +1,135 @@
+import concurrent.futures
+import hashlib
+import queue
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+from default_variables import CALENDAR_BATCH_SIZE, WRITE_BATCH_WINDOW_SECONDS
+from calendar_client import setup_google_calendar_api, execute_batched
+from event_store import open_event_store, upsert_events
+from metrics import span
+
+
+_write_queue = queue.Queue()
+_writer_thread = None
+_writer_lock = threading.Lock()
+# Futures of queued inserts by idempotency key, so a retry that races the original follows its outcome.
+_in_flight = {}
+_thread_clients = threading.local()
+
+# --- Client Functions ---
+
+def get_thread_service():
+    """Returns this thread's own Calendar client; one client must not be shared between threads."""
+    if getattr(_thread_clients, "service", None) is None:
+        _thread_clients.service = setup_google_calendar_api()
+    return _thread_clients.service
+
+def event_id_for_key(idempotency_key):
+    """
+    Derives a deterministic Calendar event id from a client's idempotency key.
+    Google rejects a second insert with the same id (409), so a retried post can
+    never create a duplicate event, even across server restarts.
+    """
+    # Hex digits are a subset of the base32hex alphabet Calendar event ids allow.
+    return hashlib.sha256(idempotency_key.encode("utf-8")).hexdigest()
+
+def is_duplicate_error(error):
+    """Checks whether an insert failed because an event with that id already exists."""
+    return isinstance(error, HttpError) and error.resp.status == 409
+
+def follow_as_duplicate(original):
+    """Returns a Future with the outcome of an insert queued under the same key, reported as a duplicate."""
+    future = concurrent.futures.Future()
+
+    def copy_outcome(done):
+        if done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result({**done.result(), "status": "duplicate"})
+
+    original.add_done_callback(copy_outcome)
+    return future
+
+# --- Write Queue Functions ---
+
+def submit_event(calendar_id, body, idempotency_key=None):
+    """
+    Queues an event insert and returns a Future resolving to {"status", "eventId"}.
+    status is "created", or "duplicate" when the idempotency key was already used.
+    """
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None:
+            _writer_thread = threading.Thread(target=run_writer, name="aegis-calendar-writer", daemon=True)
+            _writer_thread.start()
+        if idempotency_key is not None:
+            if idempotency_key in _in_flight:
+                return follow_as_duplicate(_in_flight[idempotency_key])
+            body = dict(body, id=event_id_for_key(idempotency_key))
+        future = concurrent.futures.Future()
+        if idempotency_key is not None:
+            _in_flight[idempotency_key] = future
+        _write_queue.put((calendar_id, body, idempotency_key, future))
+    return future
+
+def collect_pending_writes():
+    """Blocks for the next insert, then gathers whatever else arrives within the batch window."""
+    pending = [_write_queue.get()]
+    deadline = time.monotonic() + WRITE_BATCH_WINDOW_SECONDS
+    while len(pending) < CALENDAR_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            pending.append(_write_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return pending
+
+def write_pending(store, pending):
+    """Sends one batch of inserts, resolves each caller's Future and writes the new events to the store."""
+    try:
+        service = get_thread_service()
+        events_api = service.events()
+        with span("calendar_batch_write"):
+            responses, failures = execute_batched(
+                service, [events_api.insert(calendarId=calendar_id, body=body) for calendar_id, body, _, _ in pending]
+            )
+    except Exception as e:
+        responses, failures = {}, [(index, e) for index in range(len(pending))]
+    errors = dict(failures)
+
+    with _writer_lock:
+        for _, _, idempotency_key, _ in pending:
+            _in_flight.pop(idempotency_key, None)
+    created = {}
+    for index, (calendar_id, body, idempotency_key, future) in enumerate(pending):
+        if index in responses:
+            created.setdefault(calendar_id, []).append(responses[index])
+            future.set_result({"status": "created", "eventId": responses[index]["id"]})
+        elif idempotency_key is not None and is_duplicate_error(errors[index]):
+            future.set_result({"status": "duplicate", "eventId": body["id"]})
+        else:
+            future.set_exception(errors[index])
+    print(f"Wrote a batch of {len(pending)} event(s): {sum(len(events) for events in created.values())} created.")
+
+    # Keep the local event store in step so the daemon and briefing see new events immediately.
+    if store is not None:
+        try:
+            for calendar_id, events in created.items():
+                upsert_events(store, calendar_id, events)
+        except Exception as e:
+            print(f"Warning: could not update local event store: {e}")
+
+def run_writer():
+    """Writer thread: coalesces queued inserts into Google batch requests, using its own API client and store."""
+    try:
+        store = open_event_store()
+    except Exception as e:
+        print(f"Warning: could not open local event store: {e}")
+        store = None
+    while True:
+        write_pending(store, collect_pending_writes())
@@ -0,0 +1,43 @@
+import os
+import threading
+
+
+# Parsed file contents keyed by path, with the (mtime_ns, size) they were read at.
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_file_signature(path):
+    """Returns (mtime_ns, size) of a file, or None if it doesn't exist. A stat call is all it costs."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def read_cached(path, parse):
+    """
+    Returns parse(file contents), re-reading the file only when its mtime or size
+    changed since the last read. Callers must treat the result as read-only.
+    """
+    signature = get_file_signature(path)
+    if signature is None:
+        raise FileNotFoundError(path)
+    with _cache_lock:
+        entry = _cache.get(path)
+        if entry and entry[0] == signature:
+            return entry[1]
+    with open(path, "r") as f:
+        value = parse(f.read())
+    with _cache_lock:
+        _cache[path] = (signature, value)
+    return value
+
+def load_text(path):
+    """Returns a text file's contents, served from memory while the file is unchanged."""
+    return read_cached(path, lambda text: text)
+
+def forget_file(path):
+    """Drops a file from the cache, e.g. after writing it in place within the same mtime tick."""
+    with _cache_lock:
+        _cache.pop(path, None)
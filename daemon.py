@@ -0,0 +1,373 @@
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import os
+import sys
+import time
+
+import pytz
+from googleapiclient.errors import HttpError
+
+from default_variables import AEGIS_CALENDAR_NAME, LOCAL_TIMEZONE, CHECK_INTERVAL_SECONDS, CHANGE_DETECTION, \
+    PLANNER_MODE, LLM_BACKEND, POLL_INTERVAL_FAST_SECONDS, POLL_FAST_WINDOW_SECONDS, POLL_INTERVAL_OFFICE_SECONDS, \
+    POLL_INTERVAL_NIGHT_SECONDS, OFFICE_HOURS, NIGHT_HOURS, FILE_WATCH_INTERVAL_SECONDS, REPLAN_DEBOUNCE_SECONDS, \
+    PROFILES_DIR, DAEMON_WORKERS, USER_MAX_REPLANS_PER_HOUR, PREPLAN_DAYS, PREPLAN_CHECK_SECONDS
+from calendar_sync import open_wake_socket, drain_wake_socket
+from config_files import get_file_signature
+from event_store import open_event_store, remember_calendar_name
+from llm_client import warm_ollama
+from metrics import span, write_snapshot
+from profiles import DEFAULT_PROFILE, make_profile, load_profiles
+from calendar_client import setup_google_calendar_api, find_or_create_aegis_calendar
+from scheduler import load_state, save_state, check_for_changes, replan_schedule, preplan_days
+
+
+# --- Scheduling Helpers ---
+
+def in_hour_range(hour, hour_range):
+    """Checks whether hour falls in a [start, end) range of local hours, which may wrap past midnight."""
+    start, end = hour_range
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+def get_poll_interval(now_local, seconds_since_change=None):
+    """Picks the calendar poll interval: fast right after a change, then office hours, day, night."""
+    if seconds_since_change is not None and seconds_since_change < POLL_FAST_WINDOW_SECONDS:
+        return POLL_INTERVAL_FAST_SECONDS
+    if in_hour_range(now_local.hour, NIGHT_HOURS):
+        return POLL_INTERVAL_NIGHT_SECONDS
+    if now_local.weekday() < 5 and in_hour_range(now_local.hour, OFFICE_HOURS):
+        return POLL_INTERVAL_OFFICE_SECONDS
+    return CHECK_INTERVAL_SECONDS
+
+async def wait_for_event(event, timeout_seconds):
+    """Waits until the event is set or the timeout passes. Returns True (and clears it) if it was set."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout_seconds)
+    except asyncio.TimeoutError:
+        return False
+    event.clear()
+    return True
+
+def save_metrics():
+    """Publishes the daemon's metrics for aegis_server's /metrics endpoint."""
+    try:
+        write_snapshot("scheduler")
+    except OSError as e:
+        print(f"Could not write metrics snapshot: {e}")
+
+# --- Fair Job Pool ---
+
+def create_job_pool(workers):
+    """Creates a bounded worker pool that runs users' blocking jobs round-robin, one job per user at a time."""
+    return {
+        "executor": concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="aegis-worker"),
+        "free_workers": workers,
+        "jobs": {},  # user name -> deque of (func, args, future)
+        "ready_users": collections.deque(),
+        "running_users": set(),
+    }
+
+def run_user_job(pool, user_name, func, *args):
+    """Queues a blocking job for a user and returns a future for its result."""
+    future = asyncio.get_running_loop().create_future()
+    pool["jobs"].setdefault(user_name, collections.deque()).append((func, args, future))
+    if user_name not in pool["running_users"] and user_name not in pool["ready_users"]:
+        pool["ready_users"].append(user_name)
+    dispatch_jobs(pool)
+    return future
+
+def dispatch_jobs(pool):
+    """
+    Starts queued jobs while workers are free. Users take turns, one job each, so a
+    busy user can't starve the others. A user's jobs never overlap, which keeps their
+    API client and event store on one thread at a time.
+    """
+    loop = asyncio.get_running_loop()
+    while pool["free_workers"] and pool["ready_users"]:
+        user_name = pool["ready_users"].popleft()
+        func, args, future = pool["jobs"][user_name].popleft()
+        pool["free_workers"] -= 1
+        pool["running_users"].add(user_name)
+        job = loop.run_in_executor(pool["executor"], func, *args)
+        job.add_done_callback(lambda job, user_name=user_name, future=future: finish_job(pool, user_name, future, job))
+
+def finish_job(pool, user_name, future, job):
+    """Hands a finished job's outcome to its caller and lets the next job start."""
+    pool["free_workers"] += 1
+    pool["running_users"].discard(user_name)
+    if pool["jobs"][user_name]:
+        pool["ready_users"].append(user_name)
+    if not future.done():
+        if job.cancelled():
+            future.cancel()
+        elif job.exception() is not None:
+            future.set_exception(job.exception())
+        else:
+            future.set_result(job.result())
+    dispatch_jobs(pool)
+
+# --- Users ---
+
+def create_user(profile, pool, labelled):
+    """Builds the in-memory runtime of one user profile."""
+    return {
+        "profile": profile,
+        "label": f"[{profile['name']}] " if labelled else "",
+        "run_blocking": lambda func, *args: run_user_job(pool, profile["name"], func, *args),
+        "service": None,
+        "aegis_calendar_id": None,
+        "store": None,
+        "state": load_state(profile["state_file"]),  # kept in memory and written through after every check
+        "file_signatures": {path: get_file_signature(path) for path in get_watched_files(profile)},
+        "wake": asyncio.Event(),
+        "replan_requested": asyncio.Event(),
+        "replan_reasons": set(),
+        "replanning": False,
+        "last_change": None,
+        "replan_times": collections.deque(),  # monotonic start times of this hour's replans
+    }
+
+def get_watched_files(profile):
+    """Returns the files whose edits trigger a replan; their parsed contents are cached by config_files."""
+    return (profile["tasks_file"], profile["prompt_file"], profile["feedback_file"])
+
+def request_replan(user, reason, is_change=True):
+    """Queues a replan. Requests that arrive while one is pending are merged into it."""
+    user["replan_reasons"].add(reason)
+    if is_change:
+        user["last_change"] = time.monotonic()
+    user["replan_requested"].set()
+
+def wake_users(users, channel_ids):
+    """Wakes the users whose push channels sent a notification, or everyone for an anonymous signal."""
+    woken = [user for user in users if (user["state"].get("watch_channel") or {}).get("id", "").encode() in channel_ids]
+    for user in woken or users:
+        user["wake"].set()
+
+# --- Blocking Steps (run on the worker pool) ---
+
+def connect_user(user):
+    """Builds the user's own API client and event store, and finds their Aegis calendar."""
+    profile = user["profile"]
+    service = setup_google_calendar_api(profile["token_file"], interactive=profile is DEFAULT_PROFILE)
+    user["aegis_calendar_id"] = find_or_create_aegis_calendar(service, user["state"])  # id persisted in state
+    if CHANGE_DETECTION == "sync":
+        user["store"] = open_event_store(profile["event_store_file"])
+        remember_calendar_name(user["store"], user["aegis_calendar_id"], AEGIS_CALENDAR_NAME)
+    user["service"] = service
+
+def check_calendar(user):
+    """Runs change detection and persists the state. Returns (changed, replan pending)."""
+    state = user["state"]
+    if user["service"] is None:
+        connect_user(user)
+    changed = check_for_changes(user["service"], user["aegis_calendar_id"], state, user["store"])
+    if changed:
+        state["replan_pending"] = True
+    save_state(state, user["profile"]["state_file"])
+    return changed, state.get("replan_pending", False)
+
+def run_replan(user, full=False):
+    """
+    Re-plans the user's day (only around the changed calendar windows unless full).
+    A failed replan stays pending so the next poll retries it.
+    """
+    state = user["state"]
+    try:
+        with span("replan"):
+            replan_schedule(user["service"], user["aegis_calendar_id"], state, user["store"], user["profile"], full)
+        state["replan_pending"] = False
+    except Exception:
+        state["replan_pending"] = True
+        raise
+    finally:
+        save_state(state, user["profile"]["state_file"])
+
+def preplan(user):
+    """Drafts the user's coming days and persists the drafts with the state. Returns the drafted dates."""
+    state = user["state"]
+    try:
+        with span("preplan"):
+            return preplan_days(user["service"], user["aegis_calendar_id"], state, user["store"], user["profile"])
+    finally:
+        save_state(state, user["profile"]["state_file"])
+
+# --- Concurrent Tasks ---
+
+async def poll_calendar(user):
+    """Polls a user's calendar at an adaptive interval; webhook wake signals cut the wait short."""
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    label = user["label"]
+    while True:
+        print(f"\n{label}[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking for changes...")
+        failed = True
+        try:
+            changed, replan_pending = await user["run_blocking"](check_calendar, user)
+            if replan_pending:
+                request_replan(user, "calendar change" if changed else "pending replan", is_change=changed)
+            else:
+                print(f"{label}No changes detected. Standing by.")
+            failed = False
+        except HttpError as error:
+            print(f"{label}An API error occurred: {error}")
+            if error.resp.status == 404 and user["state"].pop("aegis_calendar_id", None):
+                user["service"] = None  # The persisted calendar id may be stale; look it up again.
+        except Exception as e:
+            print(f"{label}An unexpected error occurred: {e}")
+        save_metrics()
+
+        last_change = user["last_change"]
+        interval = get_poll_interval(
+            datetime.datetime.now(local_tz), None if last_change is None else time.monotonic() - last_change
+        )
+        if failed:
+            # The API client already retried for seconds; an outage that outlasts that is retried soon too.
+            interval = min(interval, POLL_INTERVAL_FAST_SECONDS)
+        print(f"{label}Next calendar check in {interval} seconds.")
+        if await wait_for_event(user["wake"], interval):
+            print(f"{label}Woken by a calendar push notification.")
+
+async def watch_config_files(users):
+    """Watches every user's config file mtimes and queues a replan when one is edited."""
+    while True:
+        await asyncio.sleep(FILE_WATCH_INTERVAL_SECONDS)
+        signatures = {}
+        for user in users:
+            if user["replanning"]:
+                continue  # The replan rewrites tasks.json itself; its signature is refreshed afterwards.
+            for path in get_watched_files(user["profile"]):
+                if path not in signatures:
+                    signatures[path] = get_file_signature(path)
+                if signatures[path] != user["file_signatures"].get(path):
+                    user["file_signatures"][path] = signatures[path]
+                    print(f"{user['label']}'{path}' changed on disk.")
+                    request_replan(user, f"{path} edited")
+
+async def wait_for_replan_slot(user):
+    """
+    Holds a replan back while the user has used up USER_MAX_REPLANS_PER_HOUR. The cap
+    only shares the pool fairly between users, so a single user is never held back.
+    """
+    if not PROFILES_DIR or USER_MAX_REPLANS_PER_HOUR <= 0:
+        return
+    replan_times = user["replan_times"]
+    while True:
+        while replan_times and time.monotonic() - replan_times[0] >= 3600:
+            replan_times.popleft()
+        if len(replan_times) < USER_MAX_REPLANS_PER_HOUR:
+            replan_times.append(time.monotonic())
+            return
+        delay = 3600 - (time.monotonic() - replan_times[0])
+        print(f"{user['label']}Replan limit reached; the next replan runs in {delay:.0f} seconds.")
+        await asyncio.sleep(delay)
+
+async def run_replan_queue(user):
+    """Runs a user's queued replans one at a time, waiting for REPLAN_DEBOUNCE_SECONDS of quiet first."""
+    requested = user["replan_requested"]
+    label = user["label"]
+    while True:
+        await requested.wait()
+        requested.clear()
+        # A burst of changes keeps pushing the replan back, so it runs once at the end.
+        while await wait_for_event(requested, REPLAN_DEBOUNCE_SECONDS):
+            pass
+        if user["service"] is None:
+            continue  # Not connected yet; the poll that connects will request the replan again.
+        await wait_for_replan_slot(user)
+        reasons = ", ".join(sorted(user["replan_reasons"]))
+        # Calendar changes alone can be re-planned around; edits and retries re-plan the whole day.
+        full = any(reason != "calendar change" for reason in user["replan_reasons"])
+        user["replan_reasons"].clear()
+        print(f"{label}Re-planning after: {reasons}.")
+        user["replanning"] = True
+        try:
+            await user["run_blocking"](run_replan, user, full)
+        except HttpError as error:
+            print(f"{label}An API error occurred while re-planning: {error}")
+        except Exception as e:
+            print(f"{label}An unexpected error occurred while re-planning: {e}")
+        finally:
+            tasks_file = user["profile"]["tasks_file"]
+            user["file_signatures"][tasks_file] = get_file_signature(tasks_file)
+            user["replanning"] = False
+            save_metrics()
+
+async def run_preplanner(user):
+    """
+    During NIGHT_HOURS, keeps drafts of the next PREPLAN_DAYS days current, so the
+    LLM work for a day is done before it starts. Current drafts cost no LLM call.
+    """
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    label = user["label"]
+    while True:
+        await asyncio.sleep(PREPLAN_CHECK_SECONDS)
+        if not in_hour_range(datetime.datetime.now(local_tz).hour, NIGHT_HOURS):
+            continue
+        if user["service"] is None or user["replanning"] or user["replan_requested"].is_set():
+            continue  # Not connected yet, or a real replan comes first.
+        try:
+            drafted = await user["run_blocking"](preplan, user)
+            if drafted:
+                print(f"{label}Pre-planned {', '.join(drafted)}.")
+        except Exception as e:
+            print(f"{label}Pre-planning failed: {e}")
+        save_metrics()
+
+# --- Main Daemon ---
+
+async def run_daemon():
+    """
+    Runs calendar polling and replanning for every user, plus config file watching,
+    on one event loop. Blocking API, store and LLM calls go through a shared, bounded
+    worker pool: one worker for a single user, up to DAEMON_WORKERS with PROFILES_DIR.
+    """
+    print(f"--- Detected local timezone as: {LOCAL_TIMEZONE} ---")
+    loop = asyncio.get_running_loop()
+    profiles = load_profiles(PROFILES_DIR) if PROFILES_DIR else [DEFAULT_PROFILE]
+    if not profiles:
+        print(f"No user profiles found in '{PROFILES_DIR}'.")
+        return
+    pool = create_job_pool(min(DAEMON_WORKERS, len(profiles)) if PROFILES_DIR else 1)
+    users = [create_user(profile, pool, labelled=bool(PROFILES_DIR)) for profile in profiles]
+
+    print("\n--- Aegis_Shasanam Daemon v5 (asyncio) Initialized ---")
+    print(f"Using timezone: {LOCAL_TIMEZONE}")
+    print(f"Serving {len(users)} user(s) with {pool['free_workers']} worker(s).")
+    print(f"Polling for calendar changes every {POLL_INTERVAL_FAST_SECONDS}-{POLL_INTERVAL_NIGHT_SECONDS} seconds "
+          f"({CHANGE_DETECTION} mode), watching each user's tasks, system prompt and feedback.")
+    if PREPLAN_DAYS > 0:
+        print(f"Drafting the next {PREPLAN_DAYS} day(s) during night hours {NIGHT_HOURS[0]}:00-{NIGHT_HOURS[1]}:00.")
+    wake_socket = open_wake_socket()
+    if wake_socket is not None:
+        loop.add_reader(wake_socket, lambda: wake_users(users, drain_wake_socket(wake_socket)))
+    if PLANNER_MODE != "native" and LLM_BACKEND in ("ollama", "hedged"):
+        loop.run_in_executor(None, warm_ollama)
+
+    try:
+        await asyncio.gather(
+            watch_config_files(users),
+            *(poll_calendar(user) for user in users),
+            *(run_replan_queue(user) for user in users),
+            *(run_preplanner(user) for user in users if PREPLAN_DAYS > 0),
+        )
+    finally:
+        if wake_socket is not None:
+            loop.remove_reader(wake_socket)
+            wake_socket.close()
+        pool["executor"].shutdown(wait=False)
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--authorize":
+        # Creates a user's profile directory and runs their OAuth consent flow once.
+        directory = os.path.join(PROFILES_DIR or "profiles", sys.argv[2])
+        os.makedirs(directory, exist_ok=True)
+        setup_google_calendar_api(make_profile(sys.argv[2], directory)["token_file"])
+        print(f"Authorized '{sys.argv[2]}'. Add a tasks.json to '{directory}' to enable scheduling.")
+    else:
+        try:
+            asyncio.run(run_daemon())
+        except KeyboardInterrupt:
+            print("\nAegis daemon stopped.")
@@ -1,4 +1,5 @@
 import os
+import json
 from tzlocal import get_localzone_name
 from dotenv import load_dotenv
 load_dotenv()
@@ -7,18 +8,92 @@ GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
 SCOPES = os.getenv('SCOPES', 'https://www.googleapis.com/auth/calendar'.split(','))
 OLLAMA_API_URL = os.getenv('OLLAMA_API_URL', "http://localhost:11434/api/generate")
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', "qwen2.5-coder:3b")
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', "gemini-2.5-flash")
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')  # 'gemini', 'ollama' or 'hedged' (race both, first valid wins)
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', "30m")
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv('LLM_CONNECT_TIMEOUT_SECONDS', 5))
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 1500))  # planner prompt, excluding the system prompt
+LLM_READ_TIMEOUT_SECONDS = float(os.getenv('LLM_READ_TIMEOUT_SECONDS', 120))
 WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'small')
+INGEST_DROP_DIR = os.getenv('INGEST_DROP_DIR', "recordings")
+INGEST_JOBS_FILE = os.getenv('INGEST_JOBS_FILE', "ingest_jobs.json")
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 0))  # 0 sizes the pool from the CPU core count
+INGEST_POLL_SECONDS = float(os.getenv('INGEST_POLL_SECONDS', 2))
+TRANSCRIBE_WINDOW_SECONDS = int(os.getenv('TRANSCRIBE_WINDOW_SECONDS', 300))
+# Voice activity detection: silences longer than VAD_MIN_SILENCE_SECONDS are cut out before Whisper runs.
+VAD_ENABLED = os.getenv('VAD_ENABLED', 'true').lower() == 'true'
+VAD_MIN_SILENCE_SECONDS = float(os.getenv('VAD_MIN_SILENCE_SECONDS', 1.0))
+VAD_PAD_SECONDS = float(os.getenv('VAD_PAD_SECONDS', 0.2))
+VAD_MARGIN_DB = float(os.getenv('VAD_MARGIN_DB', 12))  # how far above the recording's noise floor speech must be
+SUMMARY_CHUNK_CHARS = int(os.getenv('SUMMARY_CHUNK_CHARS', 6000))  # keeps each prompt inside a small model's context
+SUMMARY_CHUNK_OVERLAP_SEGMENTS = int(os.getenv('SUMMARY_CHUNK_OVERLAP_SEGMENTS', 3))
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', 2))
 TASKS_FILE = "tasks.json"
 PROMPT_FILE = "system_prompt.txt"
 FEEDBACK_FILE = "feedback.log"
 AEGIS_CALENDAR_NAME = "Aegis_Shasanam"
 STATE_FILE = "state.json"
-CHECK_INTERVAL_SECONDS = 900
+SCHEDULE_SNAPSHOT_FILE = "schedule_snapshot.json"  # pre-rendered schedule the briefing prints, written after each replan
+SCHEDULE_SNAPSHOT_DAYS = int(os.getenv('SCHEDULE_SNAPSHOT_DAYS', 30))  # days from today it covers; 30 serves the month briefing
+# Multi-user mode: one subdirectory per user holding token.json, tasks.json, state and feedback.
+PROFILES_DIR = os.getenv('PROFILES_DIR')
+DAEMON_WORKERS = int(os.getenv('DAEMON_WORKERS', 4))  # bounded pool shared by every user's check and replan jobs
+USER_MAX_REPLANS_PER_HOUR = int(os.getenv('USER_MAX_REPLANS_PER_HOUR', 6))  # per user with PROFILES_DIR only; 0 means no cap
+EVENT_STORE_FILE = os.getenv('EVENT_STORE_FILE', "aegis_events.db")
+CHECK_INTERVAL_SECONDS = 900  # daytime poll interval outside office hours
+# Adaptive polling: faster in office hours (weekdays) and right after a change, slower overnight.
+POLL_INTERVAL_FAST_SECONDS = int(os.getenv('POLL_INTERVAL_FAST_SECONDS', 60))
+POLL_FAST_WINDOW_SECONDS = int(os.getenv('POLL_FAST_WINDOW_SECONDS', 1800))  # how long "right after a change" lasts
+POLL_INTERVAL_OFFICE_SECONDS = int(os.getenv('POLL_INTERVAL_OFFICE_SECONDS', 300))
+POLL_INTERVAL_NIGHT_SECONDS = int(os.getenv('POLL_INTERVAL_NIGHT_SECONDS', 3600))
+OFFICE_HOURS = [int(hour) for hour in os.getenv('OFFICE_HOURS', '9,18').split(',')]  # local [start, end) hours
+NIGHT_HOURS = [int(hour) for hour in os.getenv('NIGHT_HOURS', '23,6').split(',')]  # may wrap past midnight
+# Speculative planning: during NIGHT_HOURS the daemon drafts the next PREPLAN_DAYS days (0 turns it off).
+PREPLAN_DAYS = int(os.getenv('PREPLAN_DAYS', 1))
+PREPLAN_CHECK_SECONDS = int(os.getenv('PREPLAN_CHECK_SECONDS', 600))
+FILE_WATCH_INTERVAL_SECONDS = float(os.getenv('FILE_WATCH_INTERVAL_SECONDS', 2))
+REPLAN_DEBOUNCE_SECONDS = float(os.getenv('REPLAN_DEBOUNCE_SECONDS', 5))  # quiet time before a burst is replanned
+CALENDAR_BATCH_SIZE = 50  # Google rejects batch requests with more than 50 calls
+# Client-side token bucket under Calendar's default quota of 600 requests per minute per user.
+CALENDAR_QUOTA_PER_SECOND = float(os.getenv('CALENDAR_QUOTA_PER_SECOND', 10))
+CALENDAR_QUOTA_BURST = int(os.getenv('CALENDAR_QUOTA_BURST', 20))
+# Retryable errors (429, rate-limit 403s, 5xx, dropped connections) back off exponentially with jitter.
+CALENDAR_MAX_RETRIES = int(os.getenv('CALENDAR_MAX_RETRIES', 5))
+CALENDAR_BACKOFF_BASE_SECONDS = float(os.getenv('CALENDAR_BACKOFF_BASE_SECONDS', 0.5))
+CALENDAR_BACKOFF_MAX_SECONDS = float(os.getenv('CALENDAR_BACKOFF_MAX_SECONDS', 16))
+WRITE_BATCH_WINDOW_SECONDS = float(os.getenv('WRITE_BATCH_WINDOW_SECONDS', 0.05))  # server adds arriving together share a batch
+WRITE_TIMEOUT_SECONDS = float(os.getenv('WRITE_TIMEOUT_SECONDS', 30))
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', 8))
+# Calendars whose events block planning time; free slots come from one freeBusy query across all of them.
+BUSY_CALENDAR_IDS = [calendar_id.strip() for calendar_id in os.getenv('BUSY_CALENDAR_IDS', 'primary').split(',')]
+MIN_FREE_SLOT_MINUTES = int(os.getenv('MIN_FREE_SLOT_MINUTES', 10))
+MEETING_BUFFER_MINUTES = int(os.getenv('MEETING_BUFFER_MINUTES', 0))
+# LLM entries overlapping a meeting or each other may be moved this far later before they are dropped.
+REPAIR_MAX_SHIFT_MINUTES = int(os.getenv('REPAIR_MAX_SHIFT_MINUTES', 60))
+CHANGE_DETECTION = os.getenv('CHANGE_DETECTION', 'sync')  # 'sync' (syncToken deltas) or 'hash' (full-day re-read)
+# Calendar-only changes replan just the Aegis blocks within this many minutes of the changed busy time.
+REPLAN_NEIGHBORHOOD_MINUTES = int(os.getenv('REPLAN_NEIGHBORHOOD_MINUTES', 30))
+CALENDAR_API_ENDPOINT = os.getenv('CALENDAR_API_ENDPOINT')  # e.g. a local fake Calendar server for testing
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public https URL of aegis_server's /calendar_webhook route
+WEBHOOK_TOKEN = os.getenv('WEBHOOK_TOKEN', '')
+WATCH_CHANNEL_TTL_SECONDS = int(os.getenv('WATCH_CHANNEL_TTL_SECONDS', 86400))
+DAEMON_WAKE_PORT = int(os.getenv('DAEMON_WAKE_PORT', 5679))
+METRICS_DIR = os.getenv('METRICS_DIR', ".metrics")  # per-process snapshots served by aegis_server's /metrics
+METRICS_JSON_LOGS = os.getenv('METRICS_JSON_LOGS', 'true').lower() == 'true'
+PLANNER_MODE = os.getenv('PLANNER_MODE', 'llm')  # 'llm' (native planner as fallback) or 'native' (no LLM)
+STREAM_LLM_OUTPUT = os.getenv('STREAM_LLM_OUTPUT', 'true').lower() == 'true'
+TASK_CANDIDATES_PER_CATEGORY = int(os.getenv('TASK_CANDIDATES_PER_CATEGORY', 5))  # stalest tasks per category sent to the planner; 0 sends all
+PLANNER_GAP_MINUTES = int(os.getenv('PLANNER_GAP_MINUTES', 5))
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', ".llm_cache")
+LLM_CACHE_MAX_BYTES = int(os.getenv('LLM_CACHE_MAX_BYTES', 20 * 1024 * 1024))
+LLM_CACHE_MAX_AGE_SECONDS = int(os.getenv('LLM_CACHE_MAX_AGE_SECONDS', 7 * 86400))
+LLM_CACHE_TIME_QUANTUM_MINUTES = int(os.getenv('LLM_CACHE_TIME_QUANTUM_MINUTES', 15))
+# Per-category block counts for the native planner, mirroring the health rules in system_prompt.txt.
+PLANNER_CATEGORY_QUOTAS = json.loads(os.getenv('PLANNER_CATEGORY_QUOTAS', '{"health": {"min": 2}, "deep_work": {"min": 1}}'))
 try:
     # This is the new dynamic way to get the local timezone name
     LOCAL_TIMEZONE = get_localzone_name()
 except Exception:
     print("Warning: Could not automatically detect timezone. Falling back to UTC.")
     LOCAL_TIMEZONE = "UTC"
-
-print(f"--- Detected local timezone as: {LOCAL_TIMEZONE} ---")
@@ -0,0 +1,128 @@
+import datetime
+import json
+import sqlite3
+
+from default_variables import EVENT_STORE_FILE
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    start_utc TEXT NOT NULL,
+    end_utc TEXT NOT NULL,
+    all_day INTEGER NOT NULL,
+    summary TEXT,
+    body TEXT NOT NULL,
+    PRIMARY KEY (calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_utc);
+CREATE INDEX IF NOT EXISTS events_by_end ON events (calendar_id, end_utc);
+CREATE TABLE IF NOT EXISTS calendars (
+    calendar_id TEXT PRIMARY KEY,
+    summary TEXT,
+    synced_at TEXT
+);
+"""
+
+# --- Connection and Time Helper Functions ---
+
+def open_event_store(path=EVENT_STORE_FILE):
+    """
+    Opens (and creates if needed) the local SQLite event store in WAL mode.
+    The connection may move between worker threads, but callers must not use it concurrently.
+    """
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def to_store_time(dt):
+    """Formats an aware datetime as the fixed-width UTC string used for range indexes."""
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def parse_event_bound(bound):
+    """Returns (UTC datetime, is_all_day) for an event's start or end block."""
+    if bound.get("dateTime"):
+        dt = datetime.datetime.fromisoformat(bound["dateTime"].replace("Z", "+00:00"))
+        return dt.astimezone(datetime.timezone.utc), False
+    local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+    dt = datetime.datetime.fromisoformat(bound["date"]).replace(tzinfo=local_tz)
+    return dt.astimezone(datetime.timezone.utc), True
+
+# --- Write Functions ---
+
+def build_event_rows(calendar_id, events):
+    """Splits events into rows to store and (calendar_id, event_id) keys of cancelled events."""
+    rows = []
+    cancelled = []
+    for event in events:
+        if event.get("status") == "cancelled" or "start" not in event:
+            cancelled.append((calendar_id, event["id"]))
+            continue
+        start_utc, all_day = parse_event_bound(event["start"])
+        end_utc, _ = parse_event_bound(event["end"])
+        rows.append((calendar_id, event["id"], to_store_time(start_utc), to_store_time(end_utc),
+                     int(all_day), event.get("summary"), json.dumps(event)))
+    return rows, cancelled
+
+def upsert_events(conn, calendar_id, events):
+    """Stores or refreshes events; cancelled events are removed from the store."""
+    rows, cancelled = build_event_rows(calendar_id, events)
+    with conn:
+        conn.executemany("DELETE FROM events WHERE calendar_id = ? AND event_id = ?", cancelled)
+        conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+def delete_events(conn, calendar_id, event_ids):
+    """Removes the given events from the store."""
+    with conn:
+        conn.executemany("DELETE FROM events WHERE calendar_id = ? AND event_id = ?",
+                         [(calendar_id, event_id) for event_id in event_ids])
+
+def replace_calendar_events(conn, calendar_id, events):
+    """Atomically replaces everything stored for a calendar with the result of a full sync."""
+    rows, _ = build_event_rows(calendar_id, events)
+    with conn:
+        conn.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+        conn.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    mark_calendar_synced(conn, calendar_id)
+
+def mark_calendar_synced(conn, calendar_id):
+    """Records that the store holds an up-to-date copy of a calendar."""
+    with conn:
+        conn.execute(
+            "INSERT INTO calendars (calendar_id, synced_at) VALUES (?, ?) "
+            "ON CONFLICT(calendar_id) DO UPDATE SET synced_at = excluded.synced_at",
+            (calendar_id, to_store_time(datetime.datetime.now(datetime.timezone.utc)))
+        )
+
+def remember_calendar_name(conn, calendar_id, summary):
+    """Stores a calendar's display name so readers can find it without calendarList()."""
+    with conn:
+        conn.execute(
+            "INSERT INTO calendars (calendar_id, summary) VALUES (?, ?) "
+            "ON CONFLICT(calendar_id) DO UPDATE SET summary = excluded.summary",
+            (calendar_id, summary)
+        )
+
+# --- Read Functions ---
+
+def query_events(conn, calendar_id, start_utc, end_utc):
+    """Returns stored events overlapping [start_utc, end_utc), ordered by start time."""
+    rows = conn.execute(
+        "SELECT body FROM events WHERE calendar_id = ? AND start_utc < ? AND end_utc > ? ORDER BY start_utc",
+        (calendar_id, to_store_time(end_utc), to_store_time(start_utc))
+    ).fetchall()
+    return [json.loads(row["body"]) for row in rows]
+
+def get_calendar_sync_time(conn, calendar_id):
+    """Returns when a calendar was last synced into the store, or None if it never was."""
+    row = conn.execute("SELECT synced_at FROM calendars WHERE calendar_id = ?", (calendar_id,)).fetchone()
+    return row["synced_at"] if row else None
+
+def find_calendar_id_by_name(conn, summary):
+    """Looks up a synced calendar's id by its display name without calling the API."""
+    row = conn.execute("SELECT calendar_id FROM calendars WHERE summary = ?", (summary,)).fetchone()
+    return row["calendar_id"] if row else None
@@ -0,0 +1,286 @@
+import collections
+import datetime
+import itertools
+import json
+import types
+
+import httplib2
+import pytz
+from googleapiclient.errors import HttpError
+
+from default_variables import LOCAL_TIMEZONE
+
+
+# An in-memory stand-in for the Calendar API surfaces Aegis uses (events, calendarList,
+# calendars, freebusy, channels and batch requests), for benchmarks that must run
+# without a Google account. Every call is counted along with the bytes it would have
+# put on the wire, so runs can be compared by API usage as well as latency.
+
+PAGE_SIZE = 250  # Google's default maxResults for events().list
+
+
+def make_http_error(status, reason):
+    """Builds the HttpError the real client raises for an HTTP status."""
+    return HttpError(httplib2.Response({"status": status, "reason": reason}), reason.encode("utf-8"))
+
+def parse_bound(bound):
+    """Parses an event's start/end dict into an aware UTC datetime."""
+    if "dateTime" in bound:
+        dt = datetime.datetime.fromisoformat(bound["dateTime"].replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = pytz.timezone(bound.get("timeZone") or LOCAL_TIMEZONE).localize(dt)
+        return dt.astimezone(datetime.timezone.utc)
+    day = datetime.date.fromisoformat(bound["date"])
+    return pytz.timezone(LOCAL_TIMEZONE).localize(datetime.datetime.combine(day, datetime.time())).astimezone(
+        datetime.timezone.utc)
+
+def normalize_bound(bound):
+    """Returns a start/end dict the way Google echoes it: dateTime with an explicit offset."""
+    if "dateTime" not in bound:
+        return dict(bound)
+    local_tz = pytz.timezone(bound.get("timeZone") or LOCAL_TIMEZONE)
+    return {**bound, "dateTime": parse_bound(bound).astimezone(local_tz).isoformat()}
+
+def parse_query_time(value):
+    """Parses a timeMin/timeMax query parameter."""
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(datetime.timezone.utc)
+
+
+class FakeRequest:
+    """A lazily executed API call, like googleapiclient's HttpRequest."""
+
+    def __init__(self, service, method_id, body, run):
+        self.service = service
+        self.methodId = method_id
+        self.body = body
+        self.run = run
+
+    def execute(self):
+        self.service.stats["requests"] += 1
+        return self.service.perform(self)
+
+
+class FakeBatch:
+    """Collects calls and runs them as one round trip, like BatchHttpRequest."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None, callback=None):
+        if len(self.requests) >= 1000:
+            raise ValueError("Exceeded the maximum calls in a batch.")
+        self.requests.append((request_id or str(len(self.requests)), request, callback))
+
+    def execute(self):
+        self.service.stats["requests"] += 1
+        self.service.stats["batches"] += 1
+        if len(self.requests) > 50:
+            raise make_http_error(400, "Too many calls in one batch request")
+        for request_id, request, callback in self.requests:
+            try:
+                response, exception = self.service.perform(request), None
+            except HttpError as error:
+                response, exception = None, error
+            (callback or self.callback)(request_id, response, exception)
+
+
+class FakeEvents:
+    """service.events()"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, calendarId, pageToken=None, syncToken=None, timeMin=None, timeMax=None, maxResults=PAGE_SIZE,
+             orderBy=None, showDeleted=False, **_):
+        return FakeRequest(self.service, "calendar.events.list", None, lambda: self.service.list_events(
+            calendarId, pageToken, syncToken, timeMin, timeMax, maxResults, orderBy, showDeleted))
+
+    def get(self, calendarId, eventId, **_):
+        return FakeRequest(self.service, "calendar.events.get", None,
+                           lambda: dict(self.service.get_event(calendarId, eventId)))
+
+    def insert(self, calendarId, body, **_):
+        return FakeRequest(self.service, "calendar.events.insert", body,
+                           lambda: dict(self.service.insert_event(calendarId, body)))
+
+    def patch(self, calendarId, eventId, body, **_):
+        return FakeRequest(self.service, "calendar.events.patch", body,
+                           lambda: dict(self.service.patch_event(calendarId, eventId, body)))
+
+    def delete(self, calendarId, eventId, **_):
+        return FakeRequest(self.service, "calendar.events.delete", None,
+                           lambda: self.service.delete_event(calendarId, eventId) or "")
+
+    def watch(self, calendarId, body, **_):
+        return FakeRequest(self.service, "calendar.events.watch", body, lambda: {
+            "id": body["id"], "resourceId": f"resource-{calendarId}", "expiration": "0"})
+
+
+class FakeCalendarService:
+    """The fake service object; build one per simulated user."""
+
+    def __init__(self):
+        self.calendar_data = {"primary": {"summary": "primary", "events": {}}}
+        self.change_seq = itertools.count(1)
+        self.changes = {"primary": []}  # calendar id -> [(seq, event id)], for sync tokens
+        self.ids = itertools.count(1)
+        self.stats = collections.Counter()
+
+    # --- API surface ---
+
+    def events(self):
+        return FakeEvents(self)
+
+    def calendarList(self):
+        return types.SimpleNamespace(list=lambda **_: FakeRequest(
+            self, "calendar.calendarList.list", None,
+            lambda: {"items": [{"id": cal_id, "summary": cal["summary"]} for cal_id, cal in self.calendar_data.items()]}))
+
+    def calendars(self):
+        return types.SimpleNamespace(insert=lambda body, **_: FakeRequest(
+            self, "calendar.calendars.insert", body, lambda: self.create_calendar(body["summary"])))
+
+    def freebusy(self):
+        return types.SimpleNamespace(query=lambda body, **_: FakeRequest(
+            self, "calendar.freebusy.query", body, lambda: self.query_freebusy(body)))
+
+    def channels(self):
+        return types.SimpleNamespace(stop=lambda body, **_: FakeRequest(
+            self, "calendar.channels.stop", body, lambda: ""))
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def perform(self, request):
+        """Runs one call, counting it and the JSON bytes it would send and receive."""
+        self.stats[request.methodId] += 1
+        self.stats["calls"] += 1
+        if request.body is not None:
+            self.stats["bytes_sent"] += len(json.dumps(request.body))
+        try:
+            response = request.run()
+        except HttpError:
+            self.stats["failures"] += 1
+            raise
+        self.stats["bytes_received"] += len(json.dumps(response))
+        return response
+
+    # --- Backing store ---
+
+    def get_calendar(self, calendar_id):
+        if calendar_id not in self.calendar_data:
+            raise make_http_error(404, "Not Found")
+        return self.calendar_data[calendar_id]
+
+    def create_calendar(self, summary):
+        calendar_id = f"cal{next(self.ids)}@group.calendar.google.com"
+        self.calendar_data[calendar_id] = {"summary": summary, "events": {}}
+        self.changes[calendar_id] = []
+        return {"id": calendar_id, "summary": summary}
+
+    def record_change(self, calendar_id, event):
+        seq = next(self.change_seq)
+        event["etag"] = f'"{seq}"'
+        event["updated"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self.changes[calendar_id].append((seq, event["id"]))
+
+    def list_events(self, calendar_id, page_token, sync_token, time_min, time_max, max_results, order_by, show_deleted):
+        events = self.get_calendar(calendar_id)["events"]
+        if sync_token is not None:
+            since = int(sync_token)
+            if since < 0:
+                raise make_http_error(410, "Sync token is no longer valid")
+            changed_ids = dict.fromkeys(event_id for seq, event_id in self.changes[calendar_id] if seq > since)
+            items = [events[event_id] for event_id in changed_ids]
+        else:
+            items = [event for event in events.values() if show_deleted or event.get("status") != "cancelled"]
+            if time_min is not None:
+                items = [e for e in items if e.get("status") == "cancelled" or parse_bound(e["end"]) > parse_query_time(time_min)]
+            if time_max is not None:
+                items = [e for e in items if e.get("status") == "cancelled" or parse_bound(e["start"]) < parse_query_time(time_max)]
+        if order_by == "startTime":
+            items.sort(key=lambda event: parse_bound(event["start"]))
+        offset = int(page_token or 0)
+        page = [dict(event) for event in items[offset:offset + max_results]]
+        result = {"kind": "calendar#events", "items": page}
+        if offset + max_results < len(items):
+            result["nextPageToken"] = str(offset + max_results)
+        else:
+            result["nextSyncToken"] = str(self.changes[calendar_id][-1][0] if self.changes[calendar_id] else 0)
+        return result
+
+    def get_event(self, calendar_id, event_id):
+        event = self.get_calendar(calendar_id)["events"].get(event_id)
+        if event is None:
+            raise make_http_error(404, "Not Found")
+        return event
+
+    def insert_event(self, calendar_id, body):
+        events = self.get_calendar(calendar_id)["events"]
+        event_id = body.get("id") or f"evt{next(self.ids)}"
+        if event_id in events:
+            raise make_http_error(409, "The requested identifier already exists.")
+        event = {**body, "id": event_id, "status": "confirmed", "kind": "calendar#event",
+                 "start": normalize_bound(body["start"]), "end": normalize_bound(body["end"]),
+                 "htmlLink": f"https://calendar.example/event?eid={event_id}"}
+        events[event_id] = event
+        self.record_change(calendar_id, event)
+        return event
+
+    def patch_event(self, calendar_id, event_id, body):
+        event = self.get_event(calendar_id, event_id)
+        event.update({key: normalize_bound(value) if key in ("start", "end") else value for key, value in body.items()})
+        self.record_change(calendar_id, event)
+        return event
+
+    def delete_event(self, calendar_id, event_id):
+        event = self.get_event(calendar_id, event_id)
+        if event.get("status") == "cancelled":
+            raise make_http_error(410, "Resource has been deleted")
+        event.clear()
+        event.update({"id": event_id, "status": "cancelled"})
+        self.record_change(calendar_id, event)
+
+    def query_freebusy(self, body):
+        window_start, window_end = parse_query_time(body["timeMin"]), parse_query_time(body["timeMax"])
+        calendars = {}
+        for item in body["items"]:
+            if item["id"] not in self.calendar_data:
+                calendars[item["id"]] = {"errors": [{"domain": "global", "reason": "notFound"}], "busy": []}
+                continue
+            busy = []
+            for event in self.calendar_data[item["id"]]["events"].values():
+                if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+                    continue
+                start, end = max(parse_bound(event["start"]), window_start), min(parse_bound(event["end"]), window_end)
+                if start < end:
+                    busy.append({"start": start.isoformat().replace("+00:00", "Z"),
+                                 "end": end.isoformat().replace("+00:00", "Z")})
+            calendars[item["id"]] = {"busy": sorted(busy, key=lambda block: block["start"])}
+        return {"kind": "calendar#freeBusy", "timeMin": body["timeMin"], "timeMax": body["timeMax"],
+                "calendars": calendars}
+
+    # --- Direct edits, as another client would make them (not counted as API calls) ---
+
+    def add_meeting(self, start, end, summary="Meeting", calendar_id="primary"):
+        """Adds a meeting between two aware datetimes and returns its id."""
+        return self.insert_event(calendar_id, {
+            "summary": summary,
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": end.isoformat()},
+        })["id"]
+
+    def move_meeting(self, event_id, start, end, calendar_id="primary"):
+        """Moves a meeting to new aware start and end datetimes."""
+        self.patch_event(calendar_id, event_id, {"start": {"dateTime": start.isoformat()},
+                                                 "end": {"dateTime": end.isoformat()}})
+
+    def cancel_meeting(self, event_id, calendar_id="primary"):
+        """Deletes a meeting."""
+        self.delete_event(calendar_id, event_id)
+
+    def list_live_events(self, calendar_id="primary"):
+        """Returns the calendar's events that aren't cancelled."""
+        return [event for event in self.calendar_data[calendar_id]["events"].values() if event.get("status") != "cancelled"]
@@ -0,0 +1,97 @@
+import datetime
+
+from default_variables import BUSY_CALENDAR_IDS, MIN_FREE_SLOT_MINUTES, MEETING_BUFFER_MINUTES
+from event_store import query_events, get_calendar_sync_time, parse_event_bound
+
+
+# --- Interval Functions ---
+
+def parse_utc(value):
+    """Parses an RFC3339 timestamp into an aware UTC datetime."""
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(datetime.timezone.utc)
+
+def merge_intervals(intervals):
+    """Merges overlapping or touching (start, end) intervals; input order doesn't matter."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+def compute_free_slots(busy_intervals, window_start, window_end,
+                       min_slot_minutes=MIN_FREE_SLOT_MINUTES, buffer_minutes=MEETING_BUFFER_MINUTES):
+    """
+    Returns the free (start, end) gaps of the window around the busy intervals.
+    Each busy interval is widened by buffer_minutes on both sides, and gaps shorter
+    than min_slot_minutes are dropped.
+    """
+    buffer = datetime.timedelta(minutes=buffer_minutes)
+    min_slot = datetime.timedelta(minutes=min_slot_minutes)
+    busy = merge_intervals(
+        (start - buffer, end + buffer) for start, end in busy_intervals
+        if end + buffer > window_start and start - buffer < window_end
+    )
+    slots = []
+    cursor = window_start
+    for start, end in busy:
+        if start - cursor >= min_slot:
+            slots.append((cursor, start))
+        cursor = max(cursor, end)
+    if window_end - cursor >= min_slot:
+        slots.append((cursor, window_end))
+    return slots
+
+# --- Busy Time Sources ---
+
+def query_freebusy(service, calendar_ids, start_utc, end_utc):
+    """Fetches busy intervals for every calendar with a single freeBusy.query request."""
+    result = service.freebusy().query(body={
+        "timeMin": start_utc.isoformat(),
+        "timeMax": end_utc.isoformat(),
+        "timeZone": "UTC",
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids],
+    }).execute()
+    busy = []
+    for calendar_id, calendar in result.get("calendars", {}).items():
+        for error in calendar.get("errors", []):
+            print(f"  [WARN] freeBusy could not read calendar '{calendar_id}': {error.get('reason')}")
+        busy.extend((parse_utc(block["start"]), parse_utc(block["end"])) for block in calendar.get("busy", []))
+    return busy
+
+def busy_from_store(store, calendar_ids, start_utc, end_utc):
+    """Derives busy intervals from the local event store, following freeBusy's rules."""
+    busy = []
+    for calendar_id in calendar_ids:
+        for event in query_events(store, calendar_id, start_utc, end_utc):
+            if event.get("transparency") == "transparent" or event.get("status") == "cancelled":
+                continue
+            busy.append((parse_event_bound(event["start"])[0], parse_event_bound(event["end"])[0]))
+    return busy
+
+def store_covers(store, calendar_ids):
+    """Checks whether the local event store holds a synced copy of every calendar."""
+    return store is not None and all(get_calendar_sync_time(store, calendar_id) for calendar_id in calendar_ids)
+
+def get_free_slots(service, start_utc, end_utc, store=None, calendar_ids=None):
+    """
+    Returns the free slots across all busy calendars as [{"start", "end"}] UTC ISO strings.
+    Reads the local event store when it covers every calendar (no API call at all);
+    otherwise asks freeBusy, falling back to whatever the store has if that fails.
+    """
+    calendar_ids = calendar_ids or BUSY_CALENDAR_IDS
+    if store_covers(store, calendar_ids):
+        busy = busy_from_store(store, calendar_ids, start_utc, end_utc)
+    else:
+        try:
+            busy = query_freebusy(service, calendar_ids, start_utc, end_utc)
+        except Exception as e:
+            if store is None:
+                raise
+            print(f"  [WARN] freeBusy query failed ({e}). Using the local event store instead.")
+            busy = busy_from_store(store, calendar_ids, start_utc, end_utc)
+    return [
+        {"start": start.isoformat(), "end": end.isoformat()}
+        for start, end in compute_free_slots(busy, start_utc, end_utc)
+    ]
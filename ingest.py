@@ -1,59 +1,447 @@
-import whisper
-import requests
-import json
+import collections
+import concurrent.futures
+import datetime
+import os
+import re
 import sys
-from default_variables import OLLAMA_API_URL, OLLAMA_MODEL, WHISPER_MODEL
+import time
 
+import numpy
+import whisper
+from default_variables import WHISPER_MODEL, INGEST_DROP_DIR, INGEST_WORKERS, INGEST_POLL_SECONDS, \
+    TRANSCRIBE_WINDOW_SECONDS, SUMMARY_CHUNK_CHARS, SUMMARY_CHUNK_OVERLAP_SEGMENTS, SUMMARY_CONCURRENCY, \
+    VAD_ENABLED, VAD_MIN_SILENCE_SECONDS, VAD_PAD_SECONDS, VAD_MARGIN_DB
+from llm_client import ollama_generate
+from ingest_jobs import load_jobs, save_jobs, is_audio_file
+from metrics import span, take_snapshot, merge_snapshot, write_snapshot
 
-def transcribe_audio(file_path):
-    """Transcribes the given audio file using Whisper."""
-    print(f"Loading Whisper model '{WHISPER_MODEL}'...")
-    model = whisper.load_model(WHISPER_MODEL)
-    print("Model loaded. Starting transcription...")
-    result = model.transcribe(file_path)
+
+VAD_FRAME_SECONDS = 0.03
+VAD_MIN_DBFS = -60  # frames quieter than this are silence, however quiet the whole recording is
+
+def transcribe_audio(file_path, model=None):
+    """Transcribes the given audio file using Whisper, loading the model unless one is given."""
+    if model is None:
+        print(f"Loading Whisper model '{WHISPER_MODEL}'...")
+        with span("whisper_load", model=WHISPER_MODEL):
+            model = whisper.load_model(WHISPER_MODEL)
+        print("Model loaded. Starting transcription...")
+    text = " ".join(segment["text"] for segment in iter_transcript_segments(file_path, model))
     print("Transcription complete.")
-    return result["text"]
+    return text
 
-def summarize_text(text):
-    """Sends text to Ollama for summarization."""
-    print("Sending transcript to LLM for summarization...")
-    system_prompt = """
+SUMMARY_SYSTEM_PROMPT = """
     You are a world-class meeting summarization AI. You will be given a
     raw transcript of a technical meeting. Your task is to provide a
     concise summary of the key discussion points and a bulleted list
     of any explicit or implicit action items for the user.
     Format your response clearly with "Summary" and "Action Items" sections.
     """
-    payload = {
-        "model": OLLAMA_MODEL,
-        "system": system_prompt,
-        "prompt": f"Here is the meeting transcript:\n\n{text}",
-        "stream": False,
-    }
-    response = requests.post(OLLAMA_API_URL, json=payload)
-    response.raise_for_status()
-    response_json = json.loads(response.text)
-    return response_json["response"]
+
+CHUNK_SYSTEM_PROMPT = """
+    You are a meeting note-taker. You will be given one consecutive part of a
+    longer meeting transcript, with timestamps. Write terse bullet points of the
+    key discussion points, decisions and any explicit or implicit action items
+    in this part only. Do not add an introduction or a conclusion.
+    """
+
+REDUCE_SYSTEM_PROMPT = """
+    You are a world-class meeting summarization AI. You will be given notes taken
+    from consecutive parts of one technical meeting. Merge them into a single
+    concise summary of the key discussion points and a de-duplicated bulleted
+    list of all action items for the user.
+    Format your response clearly with "Summary" and "Action Items" sections.
+    """
+
+# --- Voice Activity Detection Functions ---
+
+def detect_speech_regions(audio, sample_rate=whisper.audio.SAMPLE_RATE):
+    """
+    Energy-based voice activity detection. Returns the (start, end) sample ranges
+    louder than the recording's noise floor by VAD_MARGIN_DB. Silences shorter than
+    VAD_MIN_SILENCE_SECONDS stay inside a region, and regions get VAD_PAD_SECONDS of padding.
+    """
+    frame = int(VAD_FRAME_SECONDS * sample_rate)
+    frame_count = len(audio) // frame
+    if frame_count == 0:
+        return [(0, len(audio))] if len(audio) else []
+    frames = audio[:frame_count * frame].reshape(frame_count, frame)
+    levels_db = 10 * numpy.log10(numpy.mean(frames ** 2, axis=1) + 1e-10)
+    threshold_db = max(numpy.percentile(levels_db, 10) + VAD_MARGIN_DB, VAD_MIN_DBFS)
+    voiced = numpy.flatnonzero(levels_db > threshold_db)
+    if len(voiced) == 0:
+        return []
+    # A region ends where the silence up to the next voiced frame is long enough to drop.
+    breaks = numpy.flatnonzero(numpy.diff(voiced) - 1 >= VAD_MIN_SILENCE_SECONDS / VAD_FRAME_SECONDS)
+    starts = voiced[numpy.concatenate(([0], breaks + 1))]
+    ends = voiced[numpy.concatenate((breaks, [len(voiced) - 1]))] + 1
+    pad = int(VAD_PAD_SECONDS * sample_rate)
+    return [(max(0, int(start) * frame - pad), min(len(audio), int(end) * frame + pad))
+            for start, end in zip(starts, ends)]
+
+def pack_speech_regions(regions, max_samples):
+    """
+    Packs consecutive speech regions into chunks of at most max_samples of audio, so
+    Whisper sees full windows of speech. A region longer than that is split.
+    Returns a list of chunks, each a list of (start, end) sample ranges.
+    """
+    chunks = []
+    current, size = [], 0
+    for start, end in regions:
+        while end > start:
+            take = min(end - start, max_samples - size)
+            current.append((start, start + take))
+            size += take
+            start += take
+            if size >= max_samples:
+                chunks.append(current)
+                current, size = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+def get_speech_chunks(audio):
+    """Splits a recording into the speech chunks to transcribe, dropping long silences if VAD_ENABLED."""
+    sample_rate = whisper.audio.SAMPLE_RATE
+    regions = detect_speech_regions(audio) if VAD_ENABLED else [(0, len(audio))]
+    chunks = pack_speech_regions(regions, int(TRANSCRIBE_WINDOW_SECONDS * sample_rate))
+    speech_seconds = sum(end - start for start, end in regions) / sample_rate
+    total_seconds = len(audio) / sample_rate
+    print(f"Voice activity: {speech_seconds:.0f}s of speech in {total_seconds:.0f}s of audio "
+          f"({speech_seconds / total_seconds if total_seconds else 0:.0%}), {len(chunks)} chunk(s).")
+    return chunks
+
+def get_chunk_audio(audio, pieces):
+    """Joins a chunk's speech pieces into one array for Whisper."""
+    return numpy.concatenate([audio[start:end] for start, end in pieces])
+
+def to_recording_seconds(chunk_seconds, pieces, sample_rate=whisper.audio.SAMPLE_RATE):
+    """Maps a time within a joined chunk back to the time in the original recording."""
+    chunk_sample = int(chunk_seconds * sample_rate)
+    for start, end in pieces:
+        if chunk_sample <= end - start:
+            return (start + chunk_sample) / sample_rate
+        chunk_sample -= end - start
+    return pieces[-1][1] / sample_rate
+
+def stitch_segments(segments, pieces):
+    """Yields a chunk's Whisper segments with timestamps in the original recording."""
+    for segment in segments:
+        yield {
+            "start": to_recording_seconds(segment["start"], pieces),
+            "end": to_recording_seconds(segment["end"], pieces),
+            "text": segment["text"].strip(),
+        }
+
+# --- Chunked Transcription and Summarization Functions ---
+
+def iter_transcript_segments(file_path, model):
+    """
+    Transcribes a recording's speech chunk by chunk and yields its segments with
+    recording timestamps, so earlier parts can be summarized while later ones are transcribed.
+    """
+    audio = whisper.load_audio(file_path)
+    previous_text = ""
+    for pieces in get_speech_chunks(audio):
+        # Carry the tail of the previous chunk as context across the cut.
+        with span("whisper_transcribe", model=WHISPER_MODEL):
+            result = model.transcribe(get_chunk_audio(audio, pieces), initial_prompt=previous_text[-200:] or None)
+        yield from stitch_segments(result["segments"], pieces)
+        previous_text = result["text"]
+
+def iter_transcript_segments_parallel(file_path, pool, workers):
+    """
+    Like iter_transcript_segments, but the speech chunks are transcribed concurrently by
+    the pool's resident Whisper workers. Segments still come out in recording order,
+    and at most two chunks per worker are queued at a time to bound memory. Each chunk
+    is primed with the tail of the latest text transcribed before it was queued.
+    """
+    audio = whisper.load_audio(file_path)
+    chunks = collections.deque(get_speech_chunks(audio))
+    in_flight = collections.deque()
+    previous_text = ""
+    while chunks or in_flight:
+        while chunks and len(in_flight) < workers * 2:
+            pieces = chunks.popleft()
+            in_flight.append((pieces, pool.submit(transcribe_in_worker, get_chunk_audio(audio, pieces),
+                                                  previous_text[-200:] or None)))
+        pieces, future = in_flight.popleft()
+        segments, worker_metrics = future.result()
+        merge_snapshot(worker_metrics)
+        previous_text = "".join(segment["text"] for segment in segments)
+        yield from stitch_segments(segments, pieces)
+
+def iter_transcript_chunks(segments, max_chars=SUMMARY_CHUNK_CHARS, overlap_segments=SUMMARY_CHUNK_OVERLAP_SEGMENTS):
+    """Groups segments into chunks of about max_chars on segment boundaries, repeating a few segments as overlap."""
+    chunk = []
+    chunk_chars = 0
+    new_segments = 0
+    for segment in segments:
+        chunk.append(segment)
+        chunk_chars += len(segment["text"]) + 1
+        new_segments += 1
+        if chunk_chars >= max_chars:
+            yield chunk
+            chunk = chunk[-overlap_segments:] if overlap_segments else []
+            chunk_chars = sum(len(item["text"]) + 1 for item in chunk)
+            new_segments = 0
+    if new_segments:
+        yield chunk
+
+def format_chunk(chunk):
+    """Renders a chunk of segments as timestamped transcript lines."""
+    lines = []
+    for segment in chunk:
+        if segment.get("start") is None:
+            lines.append(segment["text"])
+        else:
+            minutes, seconds = divmod(int(segment["start"]), 60)
+            lines.append(f"[{minutes:02d}:{seconds:02d}] {segment['text']}")
+    return "\n".join(lines)
+
+def summarize_chunk(chunk_text, index):
+    """Map step: turns one transcript chunk into notes."""
+    print(f"Summarizing transcript chunk {index}...")
+    with span("summarize_chunk"):
+        return ollama_generate(CHUNK_SYSTEM_PROMPT, f"Here is part {index} of the meeting transcript:\n\n{chunk_text}")
+
+def reduce_summaries(partial_notes):
+    """Reduce step: merges the per-chunk notes, condensing in rounds if they don't fit one prompt."""
+    while len(partial_notes) > 1 and sum(len(notes) for notes in partial_notes) > SUMMARY_CHUNK_CHARS:
+        groups = [[]]
+        for notes in partial_notes:
+            if groups[-1] and sum(len(item) for item in groups[-1]) + len(notes) > SUMMARY_CHUNK_CHARS:
+                groups.append([])
+            groups[-1].append(notes)
+        if len(groups) == len(partial_notes):
+            break  # Every note is already too long to pair up; let the final prompt take them all.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+            partial_notes = list(pool.map(
+                lambda group: ollama_generate(CHUNK_SYSTEM_PROMPT, "Condense these meeting notes:\n\n" + "\n\n".join(group)),
+                groups
+            ))
+    print("Merging chunk notes into the final summary...")
+    numbered = "\n\n".join(f"--- Part {i} ---\n{notes}" for i, notes in enumerate(partial_notes, 1))
+    with span("summarize_reduce"):
+        return ollama_generate(REDUCE_SYSTEM_PROMPT, f"Here are the notes from each part of the meeting:\n\n{numbered}")
+
+def summarize_segments(segments):
+    """
+    Map-reduce summarization: chunks are summarized concurrently as soon as they are
+    complete, then the notes are merged. A meeting that fits one chunk takes one call.
+    """
+    futures = []
+    first_chunk = None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        for chunk in iter_transcript_chunks(segments):
+            if first_chunk is None and not futures:
+                first_chunk = chunk  # Held back until we know the meeting needs more than one chunk.
+                continue
+            if first_chunk is not None:
+                futures.append(pool.submit(summarize_chunk, format_chunk(first_chunk), 1))
+                first_chunk = None
+            futures.append(pool.submit(summarize_chunk, format_chunk(chunk), len(futures) + 1))
+        if not futures:
+            transcript = format_chunk(first_chunk) if first_chunk else ""
+            return ollama_generate(SUMMARY_SYSTEM_PROMPT, f"Here is the meeting transcript:\n\n{transcript}")
+        partial_notes = [future.result() for future in futures]
+    return reduce_summaries(partial_notes)
+
+def summarize_text(text):
+    """Sends text to Ollama for summarization, chunking it on sentence boundaries if it is long."""
+    print("Sending transcript to LLM for summarization...")
+    sentences = [sentence for sentence in re.split(r"(?<=[.!?])\s+", text.strip()) if sentence]
+    return summarize_segments({"start": None, "text": sentence} for sentence in sentences)
+
+def summarize_recording(file_path, model=None):
+    """
+    Transcribes a recording and summarizes it, overlapping both stages chunk by chunk.
+    Without a model, the speech chunks are transcribed in parallel by a pool of
+    resident Whisper workers sized to the CPU cores.
+    """
+    if model is not None:
+        return summarize_segments(iter_transcript_segments(file_path, model))
+    workers, torch_threads = get_pool_size()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(torch_threads,)
+    ) as pool:
+        return summarize_segments(iter_transcript_segments_parallel(file_path, pool, workers))
+
+def append_summary_log(audio_file, summary):
+    """Appends a meeting summary to the summaries log file."""
+    with open("meeting_summaries.log", "a") as f:
+        f.write(f"--- Summary for {audio_file} at {datetime.datetime.now()} ---\n")
+        f.write(summary)
+        f.write("\n\n")
+
+# --- Resident Worker Functions ---
+
+# Each worker process loads Whisper once and keeps it for every job it runs.
+worker_model = None
+
+def init_worker(torch_threads):
+    """Process pool initializer: pins the thread count and loads the Whisper model once."""
+    global worker_model
+    import torch
+    torch.set_num_threads(torch_threads)
+    print(f"[worker {os.getpid()}] Loading Whisper model '{WHISPER_MODEL}'...")
+    with span("whisper_load", model=WHISPER_MODEL):
+        worker_model = whisper.load_model(WHISPER_MODEL)
+
+def transcribe_in_worker(chunk_audio, initial_prompt=None):
+    """Transcribes one speech chunk with the worker's model. Returns (segments, metrics)."""
+    with span("whisper_transcribe", model=WHISPER_MODEL):
+        result = worker_model.transcribe(chunk_audio, initial_prompt=initial_prompt)
+    segments = [{"start": segment["start"], "end": segment["end"], "text": segment["text"]}
+                for segment in result["segments"]]
+    return segments, take_snapshot(reset=True)
+
+def warm_worker(seconds):
+    """Holds a worker busy briefly, so a batch of these starts (and loads) every pool process."""
+    time.sleep(seconds)
+    return os.getpid()
+
+def process_recording(file_path):
+    """
+    Transcribes and summarizes one recording inside a worker process. Returns
+    (summary, error, metrics), the metrics covering the worker's time since its last
+    job, so the daemon can merge them even when the job failed.
+    """
+    summary, error = None, None
+    try:
+        with span("process_recording"):
+            summary = summarize_recording(file_path, worker_model)
+    except Exception as e:
+        error = str(e)
+    return summary, error, take_snapshot(reset=True)
+
+def get_pool_size():
+    """Returns (workers, torch threads per worker) for the machine's CPU cores."""
+    cores = os.cpu_count() or 1
+    workers = min(INGEST_WORKERS, cores) if INGEST_WORKERS else max(1, cores // 4)
+    return workers, max(1, cores // workers)
+
+def run_ingest_daemon(drop_dir=INGEST_DROP_DIR):
+    """
+    Watches the drop directory and feeds new recordings to a bounded pool of resident
+    Whisper workers. Job status is persisted, so finished files are skipped after a restart.
+    """
+    os.makedirs(drop_dir, exist_ok=True)
+    workers, torch_threads = get_pool_size()
+    jobs = load_jobs()
+    last_sizes = {}
+    pending = {}
+    print(f"--- Aegis ingest daemon watching '{drop_dir}' with {workers} workers x {torch_threads} threads ---")
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(torch_threads,)
+    ) as pool:
+        while True:
+            for file_name in sorted(os.listdir(drop_dir)):
+                if len(pending) >= workers * 2:
+                    break  # Keep the queue bounded; the rest is picked up on a later pass.
+                file_path = os.path.join(drop_dir, file_name)
+                if not is_audio_file(file_name) or file_name in pending.values():
+                    continue
+                size = os.path.getsize(file_path)
+                job = jobs.get(file_name)
+                if job and job["status"] in ("done", "failed") and job["size"] == size:
+                    continue
+                # Only pick up a file once its size stopped changing, i.e. the upload finished.
+                if last_sizes.get(file_name) != size:
+                    last_sizes[file_name] = size
+                    continue
+                jobs[file_name] = {"status": "queued", "size": size, "queued_at": datetime.datetime.now().isoformat()}
+                pending[pool.submit(process_recording, file_path)] = file_name
+                print(f"Queued '{file_name}'.")
+            save_jobs(jobs)
+
+            if not pending:
+                time.sleep(INGEST_POLL_SECONDS)
+                continue
+            finished, _ = concurrent.futures.wait(
+                pending, timeout=INGEST_POLL_SECONDS, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                file_name = pending.pop(future)
+                try:
+                    summary, error, worker_metrics = future.result()
+                    merge_snapshot(worker_metrics)
+                    if error is not None:
+                        raise RuntimeError(error)
+                    append_summary_log(os.path.join(drop_dir, file_name), summary)
+                    jobs[file_name].update(status="done", summary=summary)
+                    print(f"Finished '{file_name}'.")
+                except Exception as e:
+                    jobs[file_name].update(status="failed", error=str(e))
+                    print(f"Failed to process '{file_name}': {e}")
+                jobs[file_name]["finished_at"] = datetime.datetime.now().isoformat()
+            save_jobs(jobs)
+            if finished:
+                write_snapshot("ingest")
+
+# --- Benchmark Functions ---
+
+def run_transcription_benchmark(file_path):
+    """
+    Reports the real-time factor (seconds of transcription per second of audio) of a
+    whole-file transcription, of VAD alone and of VAD with parallel chunks. Model
+    loading is left out of every timing; audio decoding is included in all of them.
+    """
+    audio_seconds = len(whisper.load_audio(file_path)) / whisper.audio.SAMPLE_RATE
+    print(f"Loading Whisper model '{WHISPER_MODEL}'...")
+    model = whisper.load_model(WHISPER_MODEL)
+    timings = []
+
+    started = time.perf_counter()
+    model.transcribe(file_path)
+    timings.append(("whole file", time.perf_counter() - started))
+
+    started = time.perf_counter()
+    for _ in iter_transcript_segments(file_path, model):
+        pass
+    timings.append(("VAD", time.perf_counter() - started))
+    del model
+
+    workers, torch_threads = get_pool_size()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(torch_threads,)
+    ) as pool:
+        list(pool.map(warm_worker, [1] * workers))
+        started = time.perf_counter()
+        for _ in iter_transcript_segments_parallel(file_path, pool, workers):
+            pass
+        timings.append((f"VAD + {workers} workers x {torch_threads} threads", time.perf_counter() - started))
+
+    print(f"\n--- Transcription benchmark: {file_path} ({audio_seconds:.0f}s of audio, model '{WHISPER_MODEL}') ---")
+    baseline = timings[0][1]
+    for label, seconds in timings:
+        print(f"  {label:<32} {seconds:8.1f}s  RTF {seconds / audio_seconds:.3f}  speedup {baseline / seconds:.2f}x")
 
 def main():
     if len(sys.argv) < 2:
         print("Usage: python ingest.py <path_to_audio_file>")
+        print("       python ingest.py --watch [drop_directory]")
+        print("       python ingest.py --benchmark <path_to_audio_file>")
+        return
+
+    if sys.argv[1] == "--watch":
+        run_ingest_daemon(sys.argv[2] if len(sys.argv) > 2 else INGEST_DROP_DIR)
+        return
+
+    if sys.argv[1] == "--benchmark" and len(sys.argv) > 2:
+        run_transcription_benchmark(sys.argv[2])
         return
 
     audio_file = sys.argv[1]
-    transcript = transcribe_audio(audio_file)
-    summary = summarize_text(transcript)
+    summary = summarize_recording(audio_file)
 
     print("\n\n--- MEETING SUMMARY ---")
     print(summary)
     print("-----------------------")
 
     # Save the summary to a log file
-    with open("meeting_summaries.log", "a") as f:
-        f.write(f"--- Summary for {audio_file} at {datetime.datetime.now()} ---\n")
-        f.write(summary)
-        f.write("\n\n")
+    append_summary_log(audio_file, summary)
 
 if __name__ == "__main__":
-    import datetime
     main()
@@ -0,0 +1,26 @@
+import json
+import os
+
+from default_variables import INGEST_JOBS_FILE
+
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".ogg", ".flac", ".webm", ".mp4")
+
+
+def load_jobs():
+    """Loads the persisted ingest job table, keyed by file name in the drop directory."""
+    if not os.path.exists(INGEST_JOBS_FILE):
+        return {}
+    with open(INGEST_JOBS_FILE, "r") as f:
+        return json.load(f)
+
+def save_jobs(jobs):
+    """Atomically writes the ingest job table so readers never see a half-written file."""
+    temp_path = f"{INGEST_JOBS_FILE}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(jobs, f, indent=2)
+    os.replace(temp_path, INGEST_JOBS_FILE)
+
+def is_audio_file(file_name):
+    """Checks whether a file in the drop directory looks like a recording."""
+    return file_name.lower().endswith(AUDIO_EXTENSIONS)
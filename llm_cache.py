@@ -0,0 +1,164 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl  # POSIX only; elsewhere the stats are serialized within the process alone
+except ImportError:
+    fcntl = None
+
+from default_variables import LLM_CACHE_DIR, LLM_CACHE_MAX_BYTES, LLM_CACHE_MAX_AGE_SECONDS, \
+    LLM_CACHE_TIME_QUANTUM_MINUTES
+
+
+STATS_FILE_NAME = "stats.json"
+EMPTY_STATS = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+# Hedged requests and the multi-user daemon look entries up concurrently, so the
+# stats file is updated under this lock plus a file lock shared with other processes.
+_stats_lock = threading.Lock()
+
+# --- Key Normalization Functions ---
+
+def quantize_time(value, minutes=LLM_CACHE_TIME_QUANTUM_MINUTES):
+    """Floors an ISO timestamp to the cache quantum so the rolling 'now' doesn't change the key."""
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(datetime.timezone.utc)
+    dt = dt.replace(second=0, microsecond=0) - datetime.timedelta(minutes=dt.minute % minutes)
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def normalize_prompt_inputs(prompt_data, feedback_text):
+    """
+    Reduces prompt inputs to what actually influences the plan: past events keep only
+    their task, times and title (no etags or links), slot bounds are quantized, and the
+    current time and task completion times (rewritten by every replan) are left out.
+    """
+    past_events = []
+    for event in prompt_data.get("past_events", []):
+        past_events.append([
+            event.get("extendedProperties", {}).get("private", {}).get("aegis_task_id", ""),
+            event.get("start", {}).get("dateTime") or event.get("start", {}).get("date"),
+            event.get("end", {}).get("dateTime") or event.get("end", {}).get("date"),
+            event.get("summary", ""),
+        ])
+    slots = prompt_data.get("future_free_slots", prompt_data.get("free_slots", []))
+    inputs = {
+        "tasks": sorted(
+            ({key: value for key, value in task.items() if key != "last_completed_utc"}
+             for task in prompt_data.get("tasks", [])),
+            key=lambda task: task.get("id", "")
+        ),
+        "past_events": sorted(past_events, key=lambda event: event[1] or ""),
+        "free_slots": [[quantize_time(slot["start"]), quantize_time(slot["end"])] for slot in slots],
+        "feedback": feedback_text.strip(),
+    }
+    if prompt_data.get("corrections"):
+        inputs["corrections"] = prompt_data["corrections"]
+    return inputs
+
+def make_cache_key(model_name, system_prompt, prompt_data, feedback_text):
+    """Returns the content hash identifying one LLM request."""
+    canonical = json.dumps(
+        {"model": model_name, "system": system_prompt, "inputs": normalize_prompt_inputs(prompt_data, feedback_text)},
+        sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+# --- Cache Storage Functions ---
+
+def load_cache_stats():
+    """Returns the persisted hit/miss/eviction counters; a missing or unreadable file counts as empty."""
+    try:
+        with open(os.path.join(LLM_CACHE_DIR, STATS_FILE_NAME), "r") as f:
+            return {**EMPTY_STATS, **json.load(f)}
+    except (OSError, ValueError, TypeError):
+        return dict(EMPTY_STATS)
+
+def record_cache_stat(name, count=1):
+    """Increments one persisted cache counter, locked and written atomically."""
+    os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+    stats_path = os.path.join(LLM_CACHE_DIR, STATS_FILE_NAME)
+    with _stats_lock, open(f"{stats_path}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        stats = load_cache_stats()
+        stats[name] = stats.get(name, 0) + count
+        fd, temp_path = tempfile.mkstemp(prefix=f".{STATS_FILE_NAME}.", suffix=".tmp", dir=LLM_CACHE_DIR)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(stats, f, indent=2)
+            os.replace(temp_path, stats_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+def get_cached_response(cache_key):
+    """Returns the cached LLM response for a key, or None if missing or too old."""
+    entry_path = os.path.join(LLM_CACHE_DIR, f"{cache_key}.json")
+    try:
+        with open(entry_path, "r") as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        record_cache_stat("misses")
+        return None
+    if time.time() - entry["created"] > LLM_CACHE_MAX_AGE_SECONDS:
+        record_cache_stat("misses")
+        return None
+    os.utime(entry_path)  # The mtime doubles as the last-used time for LRU eviction.
+    record_cache_stat("hits")
+    return entry["response"]
+
+def store_response(cache_key, model_name, response_text):
+    """Stores an LLM response under its key and evicts old entries if the cache is over budget."""
+    os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+    entry_path = os.path.join(LLM_CACHE_DIR, f"{cache_key}.json")
+    temp_path = f"{entry_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"created": time.time(), "model": model_name, "response": response_text}, f)
+    os.replace(temp_path, entry_path)
+    record_cache_stat("stores")
+    evict_cache_entries()
+
+def evict_cache_entries():
+    """Drops entries older than the max age, then the least recently used until under the size cap."""
+    now = time.time()
+    entries = []
+    evicted = 0
+    for name in os.listdir(LLM_CACHE_DIR):
+        if not name.endswith(".json") or name == STATS_FILE_NAME:
+            continue
+        path = os.path.join(LLM_CACHE_DIR, name)
+        stat = os.stat(path)
+        if now - stat.st_mtime > LLM_CACHE_MAX_AGE_SECONDS:
+            os.remove(path)
+            evicted += 1
+        else:
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_bytes <= LLM_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total_bytes -= size
+        evicted += 1
+    if evicted:
+        record_cache_stat("evictions", evicted)
+
+def get_cache_stats():
+    """Returns the counters plus the current entry count, size and hit rate."""
+    stats = load_cache_stats()
+    entry_sizes = []
+    if os.path.isdir(LLM_CACHE_DIR):
+        entry_sizes = [
+            os.path.getsize(os.path.join(LLM_CACHE_DIR, name)) for name in os.listdir(LLM_CACHE_DIR)
+            if name.endswith(".json") and name != STATS_FILE_NAME
+        ]
+    lookups = stats["hits"] + stats["misses"]
+    stats["entries"] = len(entry_sizes)
+    stats["bytes"] = sum(entry_sizes)
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
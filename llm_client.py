@@ -0,0 +1,174 @@
+import concurrent.futures
+import json
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from default_variables import OLLAMA_API_URL, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, GEMINI_API_KEY, GEMINI_MODEL, \
+    LLM_CONNECT_TIMEOUT_SECONDS, LLM_READ_TIMEOUT_SECONDS
+from metrics import increment, log_json
+
+
+_session = None
+_gemini_models = {}
+_client_lock = threading.Lock()
+# Running totals per backend, filled from the token counts the backends report.
+token_usage = {}
+
+# --- Client Setup Functions ---
+
+def get_http_session():
+    """Returns the shared, connection-pooling HTTP session used for every Ollama call."""
+    global _session
+    with _client_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def get_gemini_model(model_name=GEMINI_MODEL):
+    """Returns a cached GenerativeModel, configuring the API key only once per process."""
+    import google.generativeai as genai  # slow to import, so only processes that call Gemini pay for it
+    with _client_lock:
+        if model_name not in _gemini_models:
+            if not _gemini_models:
+                genai.configure(api_key=GEMINI_API_KEY)
+            _gemini_models[model_name] = genai.GenerativeModel(model_name)
+        return _gemini_models[model_name]
+
+def record_token_usage(backend, prompt_tokens, completion_tokens):
+    """Logs and accumulates the prompt/completion token counts reported by a backend."""
+    prompt_tokens = prompt_tokens or 0
+    completion_tokens = completion_tokens or 0
+    with _client_lock:
+        totals = token_usage.setdefault(backend, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+    print(f"  [TOKENS] {backend}: {prompt_tokens} prompt + {completion_tokens} completion tokens.")
+    increment("aegis_llm_calls_total", backend=backend)
+    increment("aegis_llm_tokens_total", prompt_tokens, backend=backend, kind="prompt")
+    increment("aegis_llm_tokens_total", completion_tokens, backend=backend, kind="completion")
+    log_json({"metric": "llm_tokens", "backend": backend,
+              "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens})
+
+def get_timeout():
+    """Returns the (connect, read) timeout pair for LLM requests."""
+    return (LLM_CONNECT_TIMEOUT_SECONDS, LLM_READ_TIMEOUT_SECONDS)
+
+# --- Ollama Functions ---
+
+def build_ollama_payload(system_prompt, prompt, json_format, stream):
+    """Builds an /api/generate payload that keeps the model resident between calls."""
+    payload = {
+        "model": OLLAMA_MODEL,
+        "system": system_prompt,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+    if json_format:
+        payload["format"] = "json"
+    return payload
+
+def ollama_generate(system_prompt, prompt, json_format=False):
+    """Runs one non-streaming Ollama generation and returns the response text."""
+    response = get_http_session().post(
+        OLLAMA_API_URL, json=build_ollama_payload(system_prompt, prompt, json_format, False), timeout=get_timeout()
+    )
+    response.raise_for_status()
+    response_json = response.json()
+    record_token_usage("ollama", response_json.get("prompt_eval_count"), response_json.get("eval_count"))
+    return response_json["response"]
+
+def ollama_stream(system_prompt, prompt, json_format=False):
+    """Yields Ollama's response text piece by piece while it is generated."""
+    payload = build_ollama_payload(system_prompt, prompt, json_format, True)
+    with get_http_session().post(OLLAMA_API_URL, json=payload, stream=True, timeout=get_timeout()) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            message = json.loads(line)
+            if message.get("done"):
+                record_token_usage("ollama", message.get("prompt_eval_count"), message.get("eval_count"))
+            yield message.get("response", "")
+
+def warm_ollama():
+    """Loads the Ollama model into memory ahead of time; an empty prompt only loads it."""
+    try:
+        get_http_session().post(
+            OLLAMA_API_URL, json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=get_timeout()
+        ).raise_for_status()
+        print(f"Ollama model '{OLLAMA_MODEL}' is warm (keep_alive {OLLAMA_KEEP_ALIVE}).")
+        return True
+    except requests.RequestException as e:
+        print(f"Could not warm Ollama model '{OLLAMA_MODEL}': {e}")
+        return False
+
+# --- Gemini Functions ---
+
+def make_gemini_generation_config(json_format):
+    """Returns the generation config that asks Gemini for JSON, or None for plain text."""
+    if not json_format:
+        return None
+    import google.generativeai as genai
+    return genai.types.GenerationConfig(response_mime_type="application/json")
+
+def gemini_generate(prompt, json_format=False):
+    """Runs one non-streaming Gemini generation and returns the response text."""
+    generation_config = make_gemini_generation_config(json_format)
+    response = get_gemini_model().generate_content(
+        prompt, generation_config=generation_config, request_options={"timeout": LLM_READ_TIMEOUT_SECONDS}
+    )
+    record_gemini_usage(response)
+    return response.text
+
+def gemini_stream(prompt, json_format=False):
+    """Yields Gemini's response text chunk by chunk while it is generated."""
+    generation_config = make_gemini_generation_config(json_format)
+    response = get_gemini_model().generate_content(
+        prompt, generation_config=generation_config, stream=True,
+        request_options={"timeout": LLM_READ_TIMEOUT_SECONDS}
+    )
+    for chunk in response:
+        try:
+            yield chunk.text
+        except ValueError:
+            continue  # Chunks that only carry finish metadata have no text.
+    record_gemini_usage(response)
+
+def record_gemini_usage(response):
+    """Records the token counts Gemini attaches to a (finished) response."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        record_token_usage("gemini", usage.prompt_token_count, usage.candidates_token_count)
+
+# --- Hedged Requests ---
+
+def hedged_generate(backends, is_valid):
+    """
+    Races several backends and returns (name, result) for the first result that
+    passes is_valid, or (None, None) if none does. backends maps a name to a
+    zero-argument callable. Slower backends are left to finish in the background.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(backends))
+    futures = {executor.submit(call): name for name, call in backends.items()}
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  [HEDGE] {name} failed: {e}")
+                continue
+            if is_valid(result):
+                print(f"  [HEDGE] Using the {name} response, which arrived first.")
+                return name, result
+            print(f"  [HEDGE] {name} returned an unusable response.")
+        return None, None
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,155 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+from default_variables import METRICS_DIR, METRICS_JSON_LOGS
+
+
+# Upper bounds (seconds) of the span duration histogram buckets.
+SPAN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> {"buckets": [...], "sum": float, "count": int}
+_metrics_lock = threading.Lock()
+
+# --- Recording Functions ---
+
+def label_key(labels):
+    """Turns a labels dict into a hashable, ordered key."""
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def log_json(record):
+    """Prints a metric as one JSON log line, unless METRICS_JSON_LOGS is off."""
+    if METRICS_JSON_LOGS:
+        print(json.dumps({"ts": round(time.time(), 3), **record}))
+
+def increment(name, value=1, **labels):
+    """Adds value to a counter."""
+    key = (name, label_key(labels))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """Records one observation in a histogram with SPAN_BUCKETS."""
+    key = (name, label_key(labels))
+    with _metrics_lock:
+        histogram = _histograms.setdefault(key, {"buckets": [0] * len(SPAN_BUCKETS), "sum": 0.0, "count": 0})
+        for index, bound in enumerate(SPAN_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """
+    Times a block as aegis_span_seconds{span=name} and logs it as a JSON line.
+    Blocks that raise are recorded with status="error".
+    """
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        observe("aegis_span_seconds", seconds, span=name, status=status, **labels)
+        log_json({"metric": "span", "span": name, "seconds": round(seconds, 4), "status": status, **labels})
+
+def record_api_call(method, ok):
+    """Counts one Google API call and, if it failed, one failure."""
+    increment("aegis_api_calls_total", method=method)
+    if not ok:
+        increment("aegis_api_failures_total", method=method)
+
+# --- Snapshot Functions ---
+
+def take_snapshot(reset=False):
+    """Returns the current metrics as a JSON-friendly dict, optionally clearing them."""
+    with _metrics_lock:
+        snapshot = {
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in _counters.items()],
+            "histograms": [{"name": name, "labels": dict(labels), "buckets": list(histogram["buckets"]),
+                            "sum": histogram["sum"], "count": histogram["count"]}
+                           for (name, labels), histogram in _histograms.items()],
+        }
+        if reset:
+            _counters.clear()
+            _histograms.clear()
+    return snapshot
+
+def merge_snapshot(snapshot):
+    """Adds another process's snapshot (e.g. an ingest worker's) into this process's metrics."""
+    with _metrics_lock:
+        for counter in snapshot["counters"]:
+            key = (counter["name"], label_key(counter["labels"]))
+            _counters[key] = _counters.get(key, 0) + counter["value"]
+        for item in snapshot["histograms"]:
+            key = (item["name"], label_key(item["labels"]))
+            histogram = _histograms.setdefault(key, {"buckets": [0] * len(SPAN_BUCKETS), "sum": 0.0, "count": 0})
+            histogram["buckets"] = [a + b for a, b in zip(histogram["buckets"], item["buckets"])]
+            histogram["sum"] += item["sum"]
+            histogram["count"] += item["count"]
+
+def write_snapshot(process_name):
+    """Atomically writes this process's metrics to METRICS_DIR for the server's /metrics endpoint."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{process_name}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(take_snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+def load_snapshots():
+    """Loads the snapshots other processes wrote to METRICS_DIR, keyed by process name."""
+    snapshots = {}
+    if not os.path.isdir(METRICS_DIR):
+        return snapshots
+    for file_name in sorted(os.listdir(METRICS_DIR)):
+        if file_name.endswith(".json"):
+            try:
+                with open(os.path.join(METRICS_DIR, file_name), "r") as f:
+                    snapshots[file_name[:-len(".json")]] = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Could not read metrics snapshot '{file_name}': {e}")
+    return snapshots
+
+# --- Prometheus Exposition ---
+
+def format_labels(labels):
+    """Formats labels as a Prometheus {name="value"} block."""
+    if not labels:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus(snapshots):
+    """Renders {process name: snapshot} in the Prometheus text format, labelling every series by process."""
+    series = {}  # metric name -> (type, lines)
+    for process_name, snapshot in snapshots.items():
+        for counter in snapshot["counters"]:
+            labels = {"process": process_name, **counter["labels"]}
+            series.setdefault(counter["name"], ("counter", []))[1].append(
+                f"{counter['name']}{format_labels(labels)} {counter['value']}"
+            )
+        for histogram in snapshot["histograms"]:
+            name = histogram["name"]
+            labels = {"process": process_name, **histogram["labels"]}
+            lines = series.setdefault(name, ("histogram", []))[1]
+            for bound, count in zip(SPAN_BUCKETS, histogram["buckets"]):
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {histogram['count']}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+    output = []
+    for name, (metric_type, lines) in series.items():
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(lines)
+    return "\n".join(output) + "\n"
@@ -0,0 +1,116 @@
+import datetime
+
+import pytz
+
+from default_variables import LOCAL_TIMEZONE, PLANNER_CATEGORY_QUOTAS, PLANNER_GAP_MINUTES
+
+
+SLOT_GRANULARITY_MINUTES = 5
+
+# --- Time Helper Functions ---
+
+def parse_utc(value):
+    """Parses an ISO timestamp (with offset or 'Z') into an aware UTC datetime."""
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(datetime.timezone.utc)
+
+def round_up(dt, minutes=SLOT_GRANULARITY_MINUTES):
+    """Rounds a datetime up to the next multiple of the given minutes."""
+    floored = dt.replace(second=0, microsecond=0) - datetime.timedelta(minutes=dt.minute % minutes)
+    return floored if floored == dt else floored + datetime.timedelta(minutes=minutes)
+
+def staleness_key(task):
+    """Sort key that puts never-completed tasks first, then the least recently completed."""
+    last_completed = task.get("last_completed_utc")
+    if not last_completed:
+        return (0, datetime.datetime.min.replace(tzinfo=datetime.timezone.utc))
+    try:
+        return (1, parse_utc(last_completed))
+    except ValueError:
+        return (0, datetime.datetime.min.replace(tzinfo=datetime.timezone.utc))
+
+# --- Planning Functions ---
+
+def get_done_task_ids(past_events):
+    """Returns the task ids of Aegis events that already happened or are in progress today."""
+    return {
+        event.get("extendedProperties", {}).get("private", {}).get("aegis_task_id")
+        for event in past_events
+    } - {None, ""}
+
+def plan_schedule(tasks, future_free_slots, past_events, quotas=None):
+    """
+    Packs tasks into the free slots without an LLM, in milliseconds.
+    Tasks are ranked by staleness of last_completed_utc, each gets at most one block
+    sized between its min and max duration, and per-category quotas decide which
+    categories must appear ("min") or may appear at most so often ("max").
+    Returns the same {"events": [...]} schema the LLM produces.
+    """
+    quotas = PLANNER_CATEGORY_QUOTAS if quotas is None else quotas
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    gap = datetime.timedelta(minutes=PLANNER_GAP_MINUTES)
+
+    # Each slot is a mutable [cursor, end] pair; blocks are carved from the cursor onwards.
+    slots = []
+    for slot in future_free_slots:
+        start, end = round_up(parse_utc(slot["start"])), parse_utc(slot["end"])
+        if end > start:
+            slots.append([start, end])
+    slots.sort()
+
+    done_ids = get_done_task_ids(past_events)
+    category_counts = {}
+    for task in tasks:
+        if task["id"] in done_ids:
+            category_counts[task.get("category")] = category_counts.get(task.get("category"), 0) + 1
+    candidates = sorted((task for task in tasks if task["id"] not in done_ids), key=staleness_key)
+
+    planned = []
+
+    def place(task, slot):
+        room_minutes = int((slot[1] - slot[0]).total_seconds() // 60)
+        duration = min(task["max_duration_minutes"], room_minutes)
+        duration -= duration % SLOT_GRANULARITY_MINUTES
+        if duration < task["min_duration_minutes"]:
+            return False
+        start = slot[0]
+        end = start + datetime.timedelta(minutes=duration)
+        slot[0] = end + gap
+        planned.append((start, end, task))
+        category_counts[task.get("category")] = category_counts.get(task.get("category"), 0) + 1
+        candidates.remove(task)
+        return True
+
+    def under_max(task):
+        limit = quotas.get(task.get("category"), {}).get("max")
+        return limit is None or category_counts.get(task.get("category"), 0) < limit
+
+    # 1. Required categories first (e.g. the daily health blocks), in the earliest slot that fits.
+    for category, quota in quotas.items():
+        for task in [task for task in candidates if task.get("category") == category]:
+            if category_counts.get(category, 0) >= quota.get("min", 0):
+                break
+            for slot in slots:
+                if place(task, slot):
+                    break
+
+    # 2. Fill the remaining time with the stalest tasks that fit.
+    for slot in slots:
+        placed = True
+        while placed:
+            placed = False
+            for task in candidates:
+                if under_max(task) and place(task, slot):
+                    placed = True
+                    break
+
+    events = []
+    for start, end, task in sorted(planned, key=lambda block: block[0]):
+        last_completed = task.get("last_completed_utc") or "never"
+        events.append({
+            "task_id": task["id"],
+            "summary": task.get("name", task["id"]),
+            "start_time": start.astimezone(local_tz).strftime("%Y-%m-%dT%H:%M:%S"),
+            "end_time": end.astimezone(local_tz).strftime("%Y-%m-%dT%H:%M:%S"),
+            "description": f"Planned by Aegis' native planner. Last completed: {last_completed}.",
+        })
+    return {"events": events}
@@ -0,0 +1,47 @@
+import os
+
+from default_variables import TASKS_FILE, PROMPT_FILE, FEEDBACK_FILE, STATE_FILE, EVENT_STORE_FILE, \
+    SCHEDULE_SNAPSHOT_FILE
+
+
+def make_profile(name, directory):
+    """
+    Describes one user's files. Everything lives in directory, except that the shared
+    system prompt is used unless the user has their own.
+    """
+    own_prompt_file = os.path.join(directory, os.path.basename(PROMPT_FILE))
+    return {
+        "name": name,
+        "token_file": os.path.join(directory, "token.json"),
+        "tasks_file": os.path.join(directory, os.path.basename(TASKS_FILE)),
+        "state_file": os.path.join(directory, os.path.basename(STATE_FILE)),
+        "feedback_file": os.path.join(directory, os.path.basename(FEEDBACK_FILE)),
+        "prompt_file": own_prompt_file if os.path.exists(own_prompt_file) else PROMPT_FILE,
+        "event_store_file": os.path.join(directory, os.path.basename(EVENT_STORE_FILE)),
+        "snapshot_file": os.path.join(directory, os.path.basename(SCHEDULE_SNAPSHOT_FILE)),
+    }
+
+# The single-user setup: the files in the working directory.
+DEFAULT_PROFILE = {
+    "name": "default",
+    "token_file": "token.json",
+    "tasks_file": TASKS_FILE,
+    "state_file": STATE_FILE,
+    "feedback_file": FEEDBACK_FILE,
+    "prompt_file": PROMPT_FILE,
+    "event_store_file": EVENT_STORE_FILE,
+    "snapshot_file": SCHEDULE_SNAPSHOT_FILE,
+}
+
+def load_profiles(profiles_dir):
+    """Loads a profile for every subdirectory of profiles_dir that has a task library."""
+    profiles = []
+    for name in sorted(os.listdir(profiles_dir)):
+        directory = os.path.join(profiles_dir, name)
+        if not os.path.isdir(directory):
+            continue
+        if not os.path.exists(os.path.join(directory, os.path.basename(TASKS_FILE))):
+            print(f"  [WARN] Skipping profile '{name}': no {os.path.basename(TASKS_FILE)}.")
+            continue
+        profiles.append(make_profile(name, directory))
+    return profiles
@@ -0,0 +1,119 @@
+import datetime
+import math
+
+import pytz
+
+from default_variables import LOCAL_TIMEZONE, PROMPT_TOKEN_BUDGET
+
+
+# --- Token Estimation ---
+
+def estimate_tokens(text):
+    """Estimates the token count of a prompt (about four characters per token for BPE models)."""
+    return math.ceil(len(text) / 4)
+
+# --- Compact Encoders ---
+
+def to_local(value, local_tz):
+    """Parses an ISO timestamp and converts it to the local timezone."""
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return local_tz.localize(dt)
+    return dt.astimezone(local_tz)
+
+def format_local_time(value, local_tz, today):
+    """Formats a timestamp as HH:MM, adding the date only when it isn't today."""
+    dt = to_local(value, local_tz)
+    return dt.strftime("%H:%M") if dt.date() == today else dt.strftime("%Y-%m-%d %H:%M")
+
+def encode_tasks(tasks, local_tz, today):
+    """Encodes the task library as one pipe-separated row per task."""
+    rows = ["id|name|category|min_minutes|max_minutes|last_completed"]
+    for task in tasks:
+        last_completed = task.get("last_completed_utc")
+        last_completed = format_local_time(last_completed, local_tz, today) if last_completed else "never"
+        rows.append(f"{task['id']}|{task.get('name', '')}|{task.get('category', '')}|"
+                    f"{task.get('min_duration_minutes', '')}|{task.get('max_duration_minutes', '')}|{last_completed}")
+    return "\n".join(rows)
+
+def encode_past_events(past_events, local_tz, today):
+    """Keeps only task_id, start, end and summary of today's past Aegis events."""
+    rows = ["task_id|start|end|summary"]
+    for event in past_events:
+        start = event.get("start", {}).get("dateTime")
+        end = event.get("end", {}).get("dateTime")
+        if not start or not end:
+            continue
+        task_id = event.get("extendedProperties", {}).get("private", {}).get("aegis_task_id", "")
+        rows.append(f"{task_id}|{format_local_time(start, local_tz, today)}|"
+                    f"{format_local_time(end, local_tz, today)}|{event.get('summary', '')}")
+    return "\n".join(rows) if len(rows) > 1 else "none"
+
+def encode_slots(slots, local_tz, today):
+    """Encodes free slots as start|end rows in local time."""
+    rows = ["start|end"]
+    for slot in slots:
+        rows.append(f"{format_local_time(slot['start'], local_tz, today)}|{format_local_time(slot['end'], local_tz, today)}")
+    return "\n".join(rows) if len(rows) > 1 else "none"
+
+# --- Prompt Assembly ---
+
+def render_prompt(now_local, tasks_text, past_text, slots_text, feedback_text, corrections=None):
+    """Lays out the compact planner prompt, with the problems of a previous answer if given."""
+    corrections_text = ""
+    if corrections:
+        problems_text = "\n".join(f"- {problem}" for problem in corrections)
+        corrections_text = f"Fix These Problems From Your Previous Schedule:\n{problems_text}\n"
+    return f"""Current Time: {now_local.strftime('%Y-%m-%d %H:%M')} ({LOCAL_TIMEZONE})
+Available Tasks:
+{tasks_text}
+Completed or In-Progress Tasks Today:
+{past_text}
+Future Free Time Slots (local time):
+{slots_text}
+Recent User Feedback:
+{feedback_text}
+{corrections_text}Generate the JSON schedule for ONLY the future free slots, using full YYYY-MM-DDTHH:MM:SS local timestamps."""
+
+def build_planner_prompt(prompt_data, feedback_text, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Builds a compact, tabular planner prompt and trims the lowest-value context until
+    it fits token_budget: first the oldest feedback, then the oldest past events, then
+    the most recently completed tasks. Free slots are never trimmed.
+    Returns (prompt, report) where report has the estimated tokens and what was trimmed.
+    """
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    now_local = datetime.datetime.now(local_tz)
+    today = now_local.date()
+    tasks = list(prompt_data["tasks"])
+    past_events = sorted(prompt_data.get("past_events", []), key=lambda event: event.get("start", {}).get("dateTime", ""))
+    slots_text = encode_slots(prompt_data.get("future_free_slots", []), local_tz, today)
+    feedback_blocks = [block.strip() for block in feedback_text.strip().split("\n\n") if block.strip()]
+    trimmed = {"feedback_blocks": 0, "past_events": 0, "tasks": 0}
+
+    def render():
+        return render_prompt(now_local, encode_tasks(tasks, local_tz, today),
+                             encode_past_events(past_events, local_tz, today),
+                             slots_text, "\n\n".join(feedback_blocks) or "none", prompt_data.get("corrections"))
+
+    prompt = render()
+    # Stalest tasks matter most to the planner, so recently completed ones are trimmed first.
+    task_trim_order = sorted(tasks, key=lambda task: task.get("last_completed_utc") or "", reverse=True)
+    while estimate_tokens(prompt) > token_budget:
+        if feedback_blocks:
+            feedback_blocks.pop(0)
+            trimmed["feedback_blocks"] += 1
+        elif past_events:
+            past_events.pop(0)
+            trimmed["past_events"] += 1
+        elif len(tasks) > 1:
+            tasks.remove(task_trim_order.pop(0))
+            trimmed["tasks"] += 1
+        else:
+            break
+        prompt = render()
+
+    report = {"tokens": estimate_tokens(prompt), "budget": token_budget,
+              "trimmed": {name: count for name, count in trimmed.items() if count}}
+    print(f"  [PROMPT] ~{report['tokens']} tokens (budget {token_budget}), trimmed: {report['trimmed'] or 'nothing'}")
+    return prompt, report
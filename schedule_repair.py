@@ -0,0 +1,146 @@
+import bisect
+import datetime
+
+import pytz
+
+from default_variables import LOCAL_TIMEZONE, REPAIR_MAX_SHIFT_MINUTES, MIN_FREE_SLOT_MINUTES
+from metrics import increment
+
+
+# Checks an LLM schedule against the free slots and the task library and repairs small
+# violations locally (clipping, shifting or dropping entries), so imperfect output from
+# a small model is usable without another full LLM round trip.
+
+# --- Interval Index Functions ---
+
+def parse_local_time(value):
+    """Parses an ISO timestamp into an aware UTC datetime, assuming local time when naive."""
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = pytz.timezone(LOCAL_TIMEZONE).localize(dt)
+    return dt.astimezone(datetime.timezone.utc)
+
+def build_slot_index(free_slots):
+    """
+    Builds the interval index: the free slots as sorted, disjoint [start, end] UTC pairs
+    plus a parallel list of their starts for bisect lookups.
+    """
+    slots = sorted([parse_local_time(slot["start"]), parse_local_time(slot["end"])] for slot in free_slots)
+    return {"starts": [slot[0] for slot in slots], "slots": slots}
+
+def find_placement(index, start, duration, min_duration):
+    """
+    Returns (slot position, start, end) for the earliest placement at or after start
+    (shifted by at most REPAIR_MAX_SHIFT_MINUTES) that holds duration, clipped to the slot
+    end but never below min_duration; None if there is none.
+    """
+    latest_start = start + datetime.timedelta(minutes=REPAIR_MAX_SHIFT_MINUTES)
+    position = max(bisect.bisect_right(index["starts"], start) - 1, 0)
+    for position in range(position, len(index["slots"])):
+        slot_start, slot_end = index["slots"][position]
+        placed_start = max(start, slot_start)
+        if placed_start > latest_start:
+            return None
+        if slot_end - placed_start >= min_duration:
+            return position, placed_start, min(placed_start + duration, slot_end)
+    return None
+
+def take_interval(index, position, start, end):
+    """Removes [start, end) from the slot at position, so later entries can't overlap it."""
+    slot_start, slot_end = index["slots"][position]
+    remainder = [[bound_start, bound_end] for bound_start, bound_end in ((slot_start, start), (end, slot_end))
+                 if bound_end > bound_start]
+    index["slots"][position:position + 1] = remainder
+    index["starts"][position:position + 1] = [slot[0] for slot in remainder]
+
+# --- Validation and Repair Functions ---
+
+def iter_repaired_events(schedule_items, tasks, free_slots, problems):
+    """
+    Validates schedule entries in arrival order and yields each one repaired: unknown
+    task ids are matched to a task by title, durations are clamped to the task's limits,
+    entries overlapping a meeting or an earlier entry are shifted into the next free
+    time, and ones running past their slot are clipped. Repeats of a task are dropped.
+    Entries that can't be repaired are dropped and described in problems, so they can
+    be sent back to the LLM as a targeted correction.
+    """
+    local_tz = pytz.timezone(LOCAL_TIMEZONE)
+    tasks_by_id = {task["id"]: task for task in tasks}
+    tasks_by_name = {task.get("name", task["id"]).strip().lower(): task for task in tasks}
+    index = build_slot_index(free_slots)
+    scheduled_times = {}
+    for item in schedule_items:
+        task = tasks_by_id.get(item.get("task_id"))
+        if task is None and str(item.get("summary", "")).strip().lower() in tasks_by_name:
+            # A made-up task_id on an entry titled like a known task is a typo, not a new task.
+            task = tasks_by_name[str(item["summary"]).strip().lower()]
+            item = {**item, "task_id": task["id"]}
+            increment("aegis_schedule_repairs_total", action="fix_task_id")
+        if task is None:
+            problems.append(f"task_id '{item.get('task_id')}' is not in the task library")
+            increment("aegis_schedule_repairs_total", action="drop")
+            continue
+        if task["id"] in scheduled_times:
+            problems.append(f"'{task['id']}' is already scheduled at {scheduled_times[task['id']]}; "
+                            f"each task gets one block a day")
+            increment("aegis_schedule_repairs_total", action="drop_duplicate")
+            continue
+        try:
+            start, end = parse_local_time(item["start_time"]), parse_local_time(item["end_time"])
+        except (KeyError, TypeError, ValueError):
+            problems.append(f"'{task['id']}' needs start_time and end_time as YYYY-MM-DDTHH:MM:SS")
+            increment("aegis_schedule_repairs_total", action="drop")
+            continue
+
+        min_duration = datetime.timedelta(minutes=task["min_duration_minutes"])
+        max_duration = datetime.timedelta(minutes=task["max_duration_minutes"])
+        duration = min(max(end - start, min_duration), max_duration)
+        placement = find_placement(index, start, duration, min_duration)
+        if placement is None:
+            problems.append(f"'{task['id']}' at {start.astimezone(local_tz).strftime('%H:%M')} does not fit "
+                            f"a free slot for its minimum of {task['min_duration_minutes']} minutes")
+            increment("aegis_schedule_repairs_total", action="drop")
+            continue
+        position, placed_start, placed_end = placement
+        take_interval(index, position, placed_start, placed_end)
+        scheduled_times[task["id"]] = placed_start.astimezone(local_tz).strftime("%H:%M")
+
+        if placed_start != start:
+            increment("aegis_schedule_repairs_total", action="shift")
+        elif placed_end != end:
+            increment("aegis_schedule_repairs_total", action="clip")
+        else:
+            increment("aegis_schedule_repairs_total", action="none")
+        yield {
+            **item,
+            "start_time": placed_start.astimezone(local_tz).strftime("%Y-%m-%dT%H:%M:%S"),
+            "end_time": placed_end.astimezone(local_tz).strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+def repair_schedule(schedule_list, tasks, free_slots):
+    """
+    Validates and repairs a whole schedule in one pass, in start time order.
+    Returns (repaired entries, problems with the entries that had to be dropped).
+    """
+    def start_key(item):
+        try:
+            return parse_local_time(item["start_time"])
+        except (KeyError, TypeError, ValueError):
+            return datetime.datetime.max.replace(tzinfo=datetime.timezone.utc)
+
+    problems = []
+    repaired = list(iter_repaired_events(sorted(schedule_list, key=start_key), tasks, free_slots, problems))
+    print(f"  [REPAIR] {len(schedule_list)} entries checked: {len(repaired)} usable, "
+          f"{len(schedule_list) - len(repaired)} dropped.")
+    return repaired, problems
+
+def get_remaining_free_slots(free_slots, schedule_list):
+    """Returns the free slots left after the scheduled entries, as {"start", "end"} ISO dicts."""
+    index = build_slot_index(free_slots)
+    for item in schedule_list:
+        start, end = parse_local_time(item["start_time"]), parse_local_time(item["end_time"])
+        position = bisect.bisect_right(index["starts"], start) - 1
+        if position >= 0 and index["slots"][position][1] >= end:
+            take_interval(index, position, start, end)
+    min_slot = datetime.timedelta(minutes=MIN_FREE_SLOT_MINUTES)
+    return [{"start": start.isoformat(), "end": end.isoformat()} for start, end in index["slots"] if end - start >= min_slot]
@@ -0,0 +1,48 @@
+import datetime
+import json
+import os
+
+from default_variables import SCHEDULE_SNAPSHOT_FILE
+
+
+# A compact, pre-rendered copy of the planned schedule, written by the scheduler after
+# every replan, so the briefing can print it without the API, the event store or any
+# datetime parsing.
+
+def to_snapshot_row(event, local_tz):
+    """Renders one event as [local date, local HH:MM (None if all-day), summary]."""
+    start = event.get("start", {})
+    summary = event.get("summary", "")
+    if "dateTime" not in start:
+        return [start.get("date"), None, summary]
+    start_local = datetime.datetime.fromisoformat(start["dateTime"].replace("Z", "+00:00")).astimezone(local_tz)
+    return [start_local.date().isoformat(), start_local.strftime("%H:%M"), summary]
+
+def save_schedule_snapshot(calendar_id, events, start_utc, end_utc, snapshot_file=SCHEDULE_SNAPSHOT_FILE):
+    """Atomically writes the events covering [start_utc, end_utc] as a schedule snapshot."""
+    local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+    rows = [to_snapshot_row(event, local_tz) for event in events if event.get("status") != "cancelled"]
+    rows.sort(key=lambda row: (row[0], row[1] or ""))
+    snapshot = {
+        "calendar_id": calendar_id,
+        "generated_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "start_utc": start_utc.isoformat(),
+        "end_utc": end_utc.isoformat(),
+        "rows": rows,
+    }
+    with open(f"{snapshot_file}.tmp", "w") as f:
+        json.dump(snapshot, f)
+    os.replace(f"{snapshot_file}.tmp", snapshot_file)
+
+def load_schedule_snapshot(start_utc, end_utc, snapshot_file=SCHEDULE_SNAPSHOT_FILE):
+    """Returns the snapshot if it covers [start_utc, end_utc], else None."""
+    try:
+        with open(snapshot_file, "r") as f:
+            snapshot = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    covered_start = datetime.datetime.fromisoformat(snapshot["start_utc"])
+    covered_end = datetime.datetime.fromisoformat(snapshot["end_utc"])
+    if covered_start <= start_utc and end_utc <= covered_end:
+        return snapshot
+    return None
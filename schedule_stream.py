@@ -0,0 +1,67 @@
+import json
+
+
+def iter_schedule_events(text_chunks, array_key="events"):
+    """
+    Incrementally parses streamed LLM output and yields every object of the top-level
+    `array_key` array as soon as its closing brace arrives, without waiting for the
+    rest of the document. Malformed entries are skipped.
+    """
+    buffer = ""
+    position = 0
+    depth = 0
+    in_string = False
+    escaped = False
+    string_start = None
+    last_key = None
+    array_depth = None  # Depth inside the target array, once it has been entered.
+    object_start = None
+
+    for chunk in text_chunks:
+        if not chunk:
+            continue
+        buffer += chunk
+        while position < len(buffer):
+            char = buffer[position]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                    if depth == 1 and array_depth is None:
+                        last_key = buffer[string_start + 1:position]
+            elif char == '"':
+                in_string = True
+                string_start = position
+            elif char in "{[":
+                if char == "[" and depth == 1 and last_key == array_key and array_depth is None:
+                    array_depth = depth + 1
+                elif char == "{" and array_depth is not None and depth == array_depth:
+                    object_start = position
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if char == "}" and object_start is not None and depth == array_depth:
+                    raw_object = buffer[object_start:position + 1]
+                    object_start = None
+                    try:
+                        yield json.loads(raw_object)
+                    except json.JSONDecodeError:
+                        print(f"  [STREAM] Skipping malformed event: {raw_object[:80]}")
+                elif char == "]" and array_depth is not None and depth == array_depth - 1:
+                    return
+            position += 1
+
+        # Drop text that can no longer be part of a pending object to keep the buffer small.
+        keep_from = object_start if object_start is not None else position
+        if in_string and string_start is not None:
+            keep_from = min(keep_from, string_start)
+        if keep_from > 0:
+            buffer = buffer[keep_from:]
+            position -= keep_from
+            if object_start is not None:
+                object_start -= keep_from
+            if string_start is not None:
+                string_start -= keep_from
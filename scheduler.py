@@ -1,50 +1,35 @@
+import asyncio
 import datetime
 import os.path
 import json
-import time
 import hashlib
+import queue
+import threading
+
+import pytz
+
+from default_variables import OLLAMA_MODEL, TASKS_FILE, PROMPT_FILE, \
+    AEGIS_CALENDAR_NAME, STATE_FILE, FEEDBACK_FILE, LOCAL_TIMEZONE, \
+    CHANGE_DETECTION, PLANNER_MODE, GEMINI_MODEL, LLM_CACHE_ENABLED, \
+    STREAM_LLM_OUTPUT, LLM_BACKEND, BUSY_CALENDAR_IDS, PREPLAN_DAYS, REPLAN_NEIGHBORHOOD_MINUTES, \
+    SCHEDULE_SNAPSHOT_DAYS
+from calendar_client import execute_batched, iter_events
+from calendar_sync import sync_calendar_changes, ensure_watch_channel, get_busy_interval, get_changed_intervals
+from planner import plan_schedule
+from free_slots import get_free_slots, compute_free_slots, merge_intervals
+from task_store import load_task_index, build_task_index, select_candidates, mark_tasks_completed, \
+    save_task_completions
+from schedule_repair import repair_schedule, iter_repaired_events, get_remaining_free_slots
+from schedule_stream import iter_schedule_events
+from prompt_builder import build_planner_prompt
+from llm_client import ollama_generate, ollama_stream, gemini_generate, gemini_stream, hedged_generate
+from llm_cache import make_cache_key, get_cached_response, store_response, get_cache_stats
+from event_store import query_events, upsert_events, delete_events
+from config_files import load_text
+from profiles import DEFAULT_PROFILE
+from schedule_snapshot import save_schedule_snapshot
+from metrics import span
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import google.generativeai as genai
-
-from default_variables import SCOPES, OLLAMA_API_URL, OLLAMA_MODEL, TASKS_FILE, PROMPT_FILE, \
-    AEGIS_CALENDAR_NAME, STATE_FILE, CHECK_INTERVAL_SECONDS, FEEDBACK_FILE, LOCAL_TIMEZONE, GEMINI_API_KEY
-
-
-# --- Core Google API and Calendar Functions ---
-
-def setup_google_calendar_api():
-    """Initializes and returns the Google Calendar API service object."""
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    return build("calendar", "v3", credentials=creds)
-
-def find_or_create_aegis_calendar(service):
-    """Finds the Aegis_Shasanam calendar or creates it if it doesn't exist."""
-    print(f"Looking for '{AEGIS_CALENDAR_NAME}' calendar...")
-    calendar_list = service.calendarList().list().execute()
-    for calendar_list_entry in calendar_list["items"]:
-        if calendar_list_entry["summary"] == AEGIS_CALENDAR_NAME:
-            print("Found calendar.")
-            return calendar_list_entry["id"]
-    print("Calendar not found. Creating it...")
-    new_calendar = {"summary": AEGIS_CALENDAR_NAME}
-    created_calendar = service.calendars().insert(body=new_calendar).execute()
-    print("Calendar created.")
-    return created_calendar["id"]
 
 # --- State and Time Helper Functions ---
 
@@ -56,34 +41,56 @@ def get_local_day_boundaries():
     end_of_local_day = now_local.replace(hour=23, minute=59, second=59, microsecond=0)
     return start_of_local_day.astimezone(datetime.timezone.utc), end_of_local_day.astimezone(datetime.timezone.utc)
 
-def load_state():
+def load_state(state_file=STATE_FILE):
     """Loads the last known state from the state file."""
-    if not os.path.exists(STATE_FILE):
-        return {"last_known_hash": None}
-    with open(STATE_FILE, "r") as f:
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r") as f:
         return json.load(f)
 
-def save_state(state):
+def save_state(state, state_file=STATE_FILE):
     """Saves the current state to the state file."""
-    with open(STATE_FILE, "w") as f:
+    with open(state_file, "w") as f:
         json.dump(state, f, indent=2)
 
-def get_primary_calendar_state_hash(service):
-    """Fetches today's primary calendar events and returns a hash."""
+def get_primary_busy_intervals(service):
+    """Fetches today's primary calendar events and returns the time they block, as {event id: [start, end]}."""
     start_utc, end_utc = get_local_day_boundaries()
-    events_result = service.events().list(
-        calendarId="primary", timeMin=start_utc.isoformat(), timeMax=end_utc.isoformat(),
+    events = iter_events(
+        service, calendarId="primary", timeMin=start_utc.isoformat(), timeMax=end_utc.isoformat(),
         timeZone=LOCAL_TIMEZONE, singleEvents=True, orderBy="startTime"
-    ).execute()
-    events = events_result.get("items", [])
-    events_str = json.dumps(events, sort_keys=True)
-    return hashlib.sha256(events_str.encode("utf-8")).hexdigest()
+    )
+    busy = {event["id"]: get_busy_interval(event) for event in events}
+    return {event_id: interval for event_id, interval in busy.items() if interval}
+
+def check_busy_calendar_changes(service, state, store=None):
+    """
+    Uses syncToken deltas to decide whether today's busy time changed on any of the
+    BUSY_CALENDAR_IDS calendars. Returns (changed, sync states keyed by calendar id).
+    """
+    start_utc, end_utc = get_local_day_boundaries()
+    previous_syncs = state.get("busy_sync", {})
+    if "primary_sync" in state and "primary" not in previous_syncs:
+        previous_syncs["primary"] = state.pop("primary_sync")  # State files written before multi-calendar support.
+    changed = state.get("last_planned_day") != datetime.date.today().isoformat()
+    sync_states = {}
+    for calendar_id in BUSY_CALENDAR_IDS:
+        calendar_changed, sync_states[calendar_id], _ = sync_calendar_changes(
+            service, calendar_id, previous_syncs.get(calendar_id, {}), start_utc, end_utc, store
+        )
+        changed = changed or calendar_changed
+    return changed, sync_states
+
+def sync_aegis_calendar(service, calendar_id, state, store):
+    """Pulls the Aegis calendar's deltas into the local event store and returns the new sync state."""
+    start_utc, end_utc = get_local_day_boundaries()
+    _, sync_state, _ = sync_calendar_changes(service, calendar_id, state.get("aegis_sync", {}), start_utc, end_utc, store)
+    return sync_state
 
 # --- Adaptive Scheduling Core Functions ---
 
-def clear_future_aegis_events(service, calendar_id):
-    """Deletes Aegis events from now until the end of the day."""
-    print(f"Clearing future Aegis events from '{AEGIS_CALENDAR_NAME}'...")
+def list_future_aegis_events(service, calendar_id, store=None):
+    """Returns the Aegis events from now until the end of the day."""
     local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
     now_local = datetime.datetime.now(local_tz)
     end_of_day_local = now_local.replace(hour=23, minute=59, second=59, microsecond=0)
@@ -91,244 +98,720 @@ def clear_future_aegis_events(service, calendar_id):
     start_utc = now_local.astimezone(datetime.timezone.utc)
     end_utc = end_of_day_local.astimezone(datetime.timezone.utc)
 
-    events_result = service.events().list(
-        calendarId=calendar_id, timeMin=start_utc.isoformat(), timeMax=end_utc.isoformat(),
+    if store is not None:
+        return query_events(store, calendar_id, start_utc, end_utc)
+    return list(iter_events(
+        service, calendarId=calendar_id, timeMin=start_utc.isoformat(), timeMax=end_utc.isoformat(),
         timeZone=LOCAL_TIMEZONE, singleEvents=True
-    ).execute()
-    events = events_result.get("items", [])
-    
-    if not events:
-        print("No future events to clear.")
-        return
-
-    print(f"  [DEBUG] Found {len(events)} future events to delete.")
-    for event in events:
-        service.events().delete(calendarId=calendar_id, eventId=event['id']).execute()
-    print(f"Successfully cleared {len(events)} future events.")
+    ))
 
-def get_daily_context(service, aegis_calendar_id):
-    """Gets past Aegis events and future free slots for adaptive planning."""
+def get_planning_window(day):
+    """Returns the structured part of a local day (07:00-23:00), the span plans fill, as UTC datetimes."""
+    local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
+    start_local = datetime.datetime.combine(day, datetime.time(7, 0), tzinfo=local_tz)
+    end_local = datetime.datetime.combine(day, datetime.time(23, 0), tzinfo=local_tz)
+    return start_local.astimezone(datetime.timezone.utc), end_local.astimezone(datetime.timezone.utc)
+
+def get_daily_context(service, aegis_calendar_id, store=None):
+    """
+    Gets past Aegis events and future free slots across all busy calendars for
+    adaptive planning. Reads from the local event store instead of the API when one is given.
+    """
     local_tz = datetime.datetime.now(datetime.timezone.utc).astimezone().tzinfo
     now_local = datetime.datetime.now(local_tz)
 
     # Get Past/In-Progress Aegis Events
     day_start_utc, _ = get_local_day_boundaries()
     now_utc = now_local.astimezone(datetime.timezone.utc)
-    past_events_result = service.events().list(
-        calendarId=aegis_calendar_id, timeMin=day_start_utc.isoformat(),
-        timeMax=now_utc.isoformat(), singleEvents=True
-    ).execute()
-    past_aegis_events = past_events_result.get("items", [])
+    if store is not None:
+        past_aegis_events = query_events(store, aegis_calendar_id, day_start_utc, now_utc)
+    else:
+        past_aegis_events = list(iter_events(
+            service, calendarId=aegis_calendar_id, timeMin=day_start_utc.isoformat(),
+            timeMax=now_utc.isoformat(), singleEvents=True
+        ))
 
     # Calculate Future Free Slots
-    structured_day_start = now_local.replace(hour=7, minute=0, second=0, microsecond=0)
-    structured_day_end = now_local.replace(hour=23, minute=0, second=0, microsecond=0)
-    planning_start_local = max(now_local, structured_day_start)
-    planning_end_local = structured_day_end
-    planning_start_utc = planning_start_local.astimezone(datetime.timezone.utc)
-    planning_end_utc = planning_end_local.astimezone(datetime.timezone.utc)
-
-    future_events_result = service.events().list(
-        calendarId="primary", timeMin=planning_start_utc.isoformat(),
-        timeMax=planning_end_utc.isoformat(), timeZone=LOCAL_TIMEZONE,
-        singleEvents=True, orderBy="startTime"
-    ).execute()
-    future_busy_events = future_events_result.get("items", [])
-
-    future_free_slots = []
-    last_end_time_utc = planning_start_utc
-    for busy in future_busy_events:
-        start_str = busy["start"].get("dateTime")
-        end_str = busy["end"].get("dateTime")
-        if not start_str or not end_str:
-            print(f"  [WARN] Skipping all-day event '{busy.get('summary')}' in free slot calculation.")
-            continue
-        
-        busy_start_utc = datetime.datetime.fromisoformat(start_str)
-        if busy_start_utc > last_end_time_utc:
-            future_free_slots.append({"start": last_end_time_utc.isoformat(), "end": busy_start_utc.isoformat()})
-        last_end_time_utc = max(last_end_time_utc, datetime.datetime.fromisoformat(end_str))
-    
-    if last_end_time_utc < planning_end_utc:
-        future_free_slots.append({"start": last_end_time_utc.isoformat(), "end": planning_end_utc.isoformat()})
+    structured_day_start_utc, planning_end_utc = get_planning_window(now_local.date())
+    planning_start_utc = max(now_utc, structured_day_start_utc)
+
+    future_free_slots = get_free_slots(service, planning_start_utc, planning_end_utc, store)
 
     return {"past_events": past_aegis_events, "future_free_slots": future_free_slots}
 
+def write_schedule_snapshot(service, aegis_calendar_id, store=None, snapshot_file=DEFAULT_PROFILE["snapshot_file"],
+                            days=SCHEDULE_SNAPSHOT_DAYS):
+    """
+    Writes the Aegis events of today and the following days (days in all, enough for
+    the week and month briefings) to the pre-rendered snapshot the briefing prints from.
+    """
+    start_utc, end_of_today_utc = get_local_day_boundaries()
+    end_utc = end_of_today_utc + datetime.timedelta(days=days - 1)
+    if store is not None:
+        events = query_events(store, aegis_calendar_id, start_utc, end_utc)
+    else:
+        events = iter_events(
+            service, calendarId=aegis_calendar_id, timeMin=start_utc.isoformat(), timeMax=end_utc.isoformat(),
+            singleEvents=True
+        )
+    save_schedule_snapshot(aegis_calendar_id, events, start_utc, end_utc, snapshot_file)
+
 # --- LLM and Event Creation Functions ---
-def query_ollama(prompt_data, feedback_text):
+def lookup_llm_cache(cache_key):
+    """Returns a cached LLM response for identical inputs, or None on a miss or when disabled."""
+    if not LLM_CACHE_ENABLED:
+        return None
+    cached_response = get_cached_response(cache_key)
+    stats = get_cache_stats()
+    print(f"  [CACHE] {'Hit' if cached_response is not None else 'Miss'} "
+          f"(hit rate {stats['hit_rate']:.0%}, {stats['entries']} entries).")
+    return cached_response
+
+def save_to_llm_cache(cache_key, model_name, response_text):
+    """Caches an LLM response, but only if it is a usable schedule."""
+    if LLM_CACHE_ENABLED and is_schedule_json(response_text):
+        store_response(cache_key, model_name, response_text)
+
+def build_ollama_prompt(prompt_data, feedback_text):
+    """Builds the compact user prompt for Ollama; the system prompt is sent separately."""
+    prompt, _ = build_planner_prompt(prompt_data, feedback_text)
+    return prompt
+
+def build_gemini_prompt(system_prompt, prompt_data, feedback_text):
+    """Builds the single Gemini prompt, which embeds the system instructions."""
+    prompt, _ = build_planner_prompt(prompt_data, feedback_text)
+    return f"System Instructions:\n{system_prompt}\n---\n{prompt}"
+
+def is_schedule_json(response_text):
+    """Checks, without printing, whether an LLM response parses to an 'events' list."""
+    try:
+        return isinstance(json.loads(response_text).get("events"), list)
+    except (json.JSONDecodeError, AttributeError, TypeError):
+        return False
+
+def query_ollama(prompt_data, feedback_text, prompt_file=PROMPT_FILE):
     """Sends the structured prompt and feedback to the local Ollama server."""
     print("\nQuerying Aegis (Ollama LLM) with feedback...")
-    with open(PROMPT_FILE, "r") as f:
-        system_prompt = f.read()
-
-    full_prompt = f"""
-Here is the data for today:
-- Current Time: {datetime.datetime.now().isoformat()}
-- Available Tasks (with last completion time): {json.dumps(prompt_data['tasks'], indent=2)}
-- Free Time Slots: {json.dumps(prompt_data['free_slots'], indent=2)}
-- Recent User Feedback:
----
-{feedback_text}
----
-
-Based on all this information and your core directives, generate the JSON schedule.
-"""
-    payload = {
-        "model": OLLAMA_MODEL,
-        "system": system_prompt,
-        "prompt": full_prompt,
-        "format": "json",
-        "stream": False,
-    }
-    response = requests.post(OLLAMA_API_URL, json=payload)
-    response.raise_for_status()
-    response_json = json.loads(response.text)
-    return response_json["response"]
+    system_prompt = load_text(prompt_file)
+    cache_key = make_cache_key(OLLAMA_MODEL, system_prompt, prompt_data, feedback_text)
+    cached_response = lookup_llm_cache(cache_key)
+    if cached_response is not None:
+        return cached_response
 
-def query_gemini(prompt_data, feedback_text):
+    try:
+        with span("llm_query", backend="ollama"):
+            response_text = ollama_generate(system_prompt, build_ollama_prompt(prompt_data, feedback_text), json_format=True)
+    except Exception as e:
+        print(f"An error occurred while querying Ollama: {e}")
+        return None
+    save_to_llm_cache(cache_key, OLLAMA_MODEL, response_text)
+    return response_text
+
+def query_gemini(prompt_data, feedback_text, prompt_file=PROMPT_FILE):
     """Sends the structured prompt and feedback to the Gemini API."""
-    print("\nQuerying Aegis (Gemini 2.5 Flash)...")
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-2.5-flash')
-
-    with open(PROMPT_FILE, "r") as f:
-        system_prompt = f.read()
-
-    full_prompt = f"""
-System Instructions:
-{system_prompt}
----
-Here is the data for today:
-- Current Time: {datetime.datetime.now().isoformat()}
-- Available Tasks (with last completion time): {json.dumps(prompt_data['tasks'], indent=2)}
-- Completed or In-Progress Tasks Today: {json.dumps(prompt_data['past_events'], indent=2)}
-- Future Free Time Slots: {json.dumps(prompt_data['future_free_slots'], indent=2)}
-- Recent User Feedback:
----
-{feedback_text}
----
-Based on all this information, generate the JSON schedule for ONLY the future free slots.
-"""
+    print(f"\nQuerying Aegis ({GEMINI_MODEL})...")
+    system_prompt = load_text(prompt_file)
+    cache_key = make_cache_key(GEMINI_MODEL, system_prompt, prompt_data, feedback_text)
+    cached_response = lookup_llm_cache(cache_key)
+    if cached_response is not None:
+        return cached_response
+
     try:
-        response = model.generate_content(
-            full_prompt,
-            generation_config=genai.types.GenerationConfig(response_mime_type="application/json")
-        )
-        return response.text
+        with span("llm_query", backend="gemini"):
+            response_text = gemini_generate(build_gemini_prompt(system_prompt, prompt_data, feedback_text), json_format=True)
     except Exception as e:
         print(f"An error occurred while querying Gemini: {e}")
         return None
+    save_to_llm_cache(cache_key, GEMINI_MODEL, response_text)
+    return response_text
+
+def query_llm(prompt_data, feedback_text, prompt_file=PROMPT_FILE):
+    """Queries the configured LLM_BACKEND; 'hedged' races Ollama and Gemini and keeps the first valid schedule."""
+    if LLM_BACKEND == "ollama":
+        return query_ollama(prompt_data, feedback_text, prompt_file)
+    if LLM_BACKEND == "hedged":
+        _, response_text = hedged_generate({
+            "ollama": lambda: query_ollama(prompt_data, feedback_text, prompt_file),
+            "gemini": lambda: query_gemini(prompt_data, feedback_text, prompt_file),
+        }, is_schedule_json)
+        return response_text
+    return query_gemini(prompt_data, feedback_text, prompt_file)
+
+def stream_llm_schedule(prompt_data, feedback_text, prompt_file=PROMPT_FILE):
+    """Yields each schedule entry as soon as the LLM finishes generating it. Repeats come from the LLM cache."""
+    system_prompt = load_text(prompt_file)
+    if LLM_BACKEND == "ollama":
+        model_name = OLLAMA_MODEL
+        open_stream = lambda: ollama_stream(system_prompt, build_ollama_prompt(prompt_data, feedback_text), json_format=True)
+    else:
+        model_name = GEMINI_MODEL
+        open_stream = lambda: gemini_stream(build_gemini_prompt(system_prompt, prompt_data, feedback_text), json_format=True)
+    print(f"\nStreaming schedule from Aegis ({model_name})...")
+    cache_key = make_cache_key(model_name, system_prompt, prompt_data, feedback_text)
+    cached_response = lookup_llm_cache(cache_key)
+    if cached_response is not None:
+        yield from iter_schedule_events([cached_response])
+        return
+
+    chunks = []
+    stream = open_stream()
 
-def create_events_from_schedule(service, calendar_id, schedule_str):
-    """Parses the LLM schedule and creates events on the specified calendar."""
+    def recorded_chunks():
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+
+    try:
+        with span("llm_stream", backend=LLM_BACKEND):
+            yield from iter_schedule_events(recorded_chunks())
+            # The parser stops at the closing "]"; read the rest so the cached text is complete JSON.
+            chunks.extend(stream)
+    finally:
+        stream.close()
+    save_to_llm_cache(cache_key, model_name, "".join(chunks))
+
+def parse_schedule(schedule_str):
+    """Parses the LLM output and returns its list of planned events, or None if unusable."""
     try:
         schedule_data = json.loads(schedule_str)
         schedule_list = schedule_data.get("events")
         if not schedule_list or not isinstance(schedule_list, list):
             print("Error: JSON from LLM is missing the 'events' list.")
             return None
-    except (json.JSONDecodeError, AttributeError):
+    except (json.JSONDecodeError, AttributeError, TypeError):
         print("Error: LLM did not return valid JSON. Cannot create events.")
         print("LLM Output:", schedule_str)
         return None
+    return schedule_list
+
+def request_schedule_correction(prompt_data, feedback_text, schedule_list, problems, prompt_file=PROMPT_FILE):
+    """
+    Re-asks the LLM once when local repair had to drop entries, for only the tasks and
+    free time the repaired schedule left open, listing what was wrong. Returns the
+    additional (repaired) entries.
+    """
+    scheduled_ids = {item.get("task_id") for item in schedule_list}
+    correction_data = {
+        "tasks": [task for task in prompt_data["tasks"] if task["id"] not in scheduled_ids],
+        "past_events": prompt_data["past_events"],
+        "future_free_slots": get_remaining_free_slots(prompt_data["future_free_slots"], schedule_list),
+        "corrections": problems,
+    }
+    if not correction_data["tasks"] or not correction_data["future_free_slots"]:
+        return []
+    print(f"Local repair dropped {len(problems)} entries; asking the LLM for a targeted correction.")
+    with span("llm_correction"):
+        response_text = query_llm(correction_data, feedback_text, prompt_file)
+    corrected = parse_schedule(response_text) if response_text else None
+    if not corrected:
+        return []
+    corrected, _ = repair_schedule(corrected, correction_data["tasks"], correction_data["future_free_slots"])
+    return corrected
+
+def generate_schedule(prompt_data, feedback_text, use_llm=True, prompt_file=PROMPT_FILE):
+    """
+    Returns the list of planned events. Uses the LLM unless PLANNER_MODE is 'native'
+    or use_llm is False, and falls back to the native planner when the LLM fails or
+    returns unusable JSON. LLM output is validated and repaired locally first.
+    """
+    if use_llm and PLANNER_MODE != "native":
+        suggested_schedule_str = query_llm(prompt_data, feedback_text, prompt_file)
+        schedule_list = parse_schedule(suggested_schedule_str) if suggested_schedule_str else None
+        if schedule_list:
+            schedule_list, problems = repair_schedule(schedule_list, prompt_data["tasks"], prompt_data["future_free_slots"])
+            if problems:
+                schedule_list += request_schedule_correction(prompt_data, feedback_text, schedule_list, problems, prompt_file)
+        if schedule_list:
+            return schedule_list
+        print("LLM schedule unavailable. Falling back to the native planner.")
+    schedule = plan_schedule(prompt_data["tasks"], prompt_data["future_free_slots"], prompt_data["past_events"])
+    print(f"Native planner produced {len(schedule['events'])} events.")
+    return schedule["events"]
+
+# --- Calendar Reconciliation Functions ---
+
+def parse_event_time(value):
+    """Parses an ISO timestamp into an aware UTC datetime, assuming local time when naive."""
+    dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = pytz.timezone(LOCAL_TIMEZONE).localize(dt)
+    return dt.astimezone(datetime.timezone.utc)
+
+def build_aegis_event(item):
+    """Builds a Calendar event resource from one entry of the LLM schedule."""
+    return {
+        "summary": item.get("summary", "Aegis Task"),
+        "description": item.get("description", ""),
+        "start": {"dateTime": item["start_time"], "timeZone": LOCAL_TIMEZONE},
+        "end": {"dateTime": item["end_time"], "timeZone": LOCAL_TIMEZONE},
+        "extendedProperties": {"private": {"aegis_task_id": item.get("task_id") or ""}},
+    }
+
+def get_event_task_id(event):
+    """Returns the task id stored on an Aegis event, or an empty string."""
+    return event.get("extendedProperties", {}).get("private", {}).get("aegis_task_id", "")
 
-    print(f"\nCreating {len(schedule_list)} new events in '{AEGIS_CALENDAR_NAME}' calendar...")
+def get_event_slot(event):
+    """Returns the (start, end) UTC pair of a timed event, or None for all-day events."""
+    start_str = event.get("start", {}).get("dateTime")
+    end_str = event.get("end", {}).get("dateTime")
+    if not start_str or not end_str:
+        return None
+    return parse_event_time(start_str), parse_event_time(end_str)
+
+def get_event_content(event):
+    """Returns the user-visible fields that decide whether an event needs a patch."""
+    return event.get("summary", ""), event.get("description", ""), get_event_task_id(event)
+
+def diff_aegis_events(existing_events, schedule_list):
+    """
+    Compares the planned schedule with the existing future Aegis events.
+    Returns (inserts, patches, deletes): event bodies to insert, (event_id, body)
+    pairs to patch and event ids to delete. Unchanged events are left alone.
+    """
+    existing_by_slot = {}
+    for event in existing_events:
+        existing_by_slot.setdefault(get_event_slot(event), []).append(event)
+
+    patches = []
+    unmatched_new = []
     for item in schedule_list:
-        event = {
-            "summary": item.get("summary", "Aegis Task"),
-            "description": item.get("description", ""),
-            "start": {"dateTime": item["start_time"], "timeZone": LOCAL_TIMEZONE},
-            "end": {"dateTime": item["end_time"], "timeZone": LOCAL_TIMEZONE},
-        }
-        service.events().insert(calendarId=calendar_id, body=event).execute()
-        print(f"  - Created: {event['summary']} at {item['start_time']} ({LOCAL_TIMEZONE})")
-        time.sleep(0.2)
-    return schedule_list
+        new_event = build_aegis_event(item)
+        candidates = existing_by_slot.get(get_event_slot(new_event))
+        if candidates:
+            old_event = candidates.pop(0)
+            if get_event_content(old_event) != get_event_content(new_event):
+                patches.append((old_event["id"], new_event))
+        else:
+            unmatched_new.append(new_event)
+
+    # An event that only moved keeps its id: patch its times instead of delete + insert.
+    leftover_by_task = {}
+    for events in existing_by_slot.values():
+        for event in events:
+            leftover_by_task.setdefault(get_event_task_id(event), []).append(event)
+
+    inserts = []
+    for new_event in unmatched_new:
+        task_id = get_event_task_id(new_event)
+        movable = leftover_by_task.get(task_id) if task_id else None
+        if movable:
+            patches.append((movable.pop(0)["id"], new_event))
+        else:
+            inserts.append(new_event)
+
+    deletes = [event["id"] for events in leftover_by_task.values() for event in events]
+    return inserts, patches, deletes
+
+def reconcile_future_aegis_events(service, calendar_id, schedule_list, store=None, existing_events=None):
+    """
+    Applies only the inserts, patches and deletes needed to make the calendar match
+    the schedule. The results are written through to the local event store if given.
+    existing_events limits the reconcile to those events (default: all future ones).
+    """
+    if existing_events is None:
+        existing_events = list_future_aegis_events(service, calendar_id, store)
+    inserts, patches, deletes = diff_aegis_events(existing_events, schedule_list)
+    unchanged = len(schedule_list) - len(inserts) - len(patches)
+    print(f"\nReconciling '{AEGIS_CALENDAR_NAME}' calendar: {len(inserts)} to insert, "
+          f"{len(patches)} to patch, {len(deletes)} to delete, {unchanged} unchanged.")
+
+    events_api = service.events()
+    requests_to_send = [events_api.delete(calendarId=calendar_id, eventId=event_id) for event_id in deletes]
+    requests_to_send += [events_api.patch(calendarId=calendar_id, eventId=event_id, body=body) for event_id, body in patches]
+    requests_to_send += [events_api.insert(calendarId=calendar_id, body=body) for body in inserts]
+    if not requests_to_send:
+        print("Calendar already matches the new schedule.")
+        return []
+
+    responses, failures = execute_batched(service, requests_to_send)
+    if store is not None:
+        delete_events(store, calendar_id, [deletes[i] for i in range(len(deletes)) if i in responses])
+        upsert_events(store, calendar_id, [response for i, response in responses.items() if i >= len(deletes)])
+    for event in inserts:
+        print(f"  - Created: {event['summary']} at {event['start']['dateTime']} ({LOCAL_TIMEZONE})")
+    return failures
+
+def stream_events_to_calendar(service, calendar_id, schedule_items, store=None):
+    """
+    Reconciles schedule entries with the calendar while the LLM is still generating them.
+    A writer thread drains the queue and sends whatever has arrived as one batch, so the
+    first block lands right away and later ones coalesce. Future events the new plan
+    didn't reuse are deleted at the end, but only if at least one entry arrived and the
+    stream completed. Returns (received entries, whether the stream completed).
+    """
+    remaining_events = list_future_aegis_events(service, calendar_id, store)
+    write_queue = queue.Queue()
+    written_events = []
+    deleted_ids = []
+
+    def writer():
+        nonlocal remaining_events
+        finished = False
+        while not finished:
+            items = [write_queue.get()]
+            while True:
+                try:
+                    items.append(write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if items[-1] is None:  # The sentinel is always the last item queued.
+                finished = True
+                items.pop()
+            if not items:
+                continue
+            try:
+                inserts, patches, leftover_ids = diff_aegis_events(remaining_events, items)
+                remaining_events = [event for event in remaining_events if event["id"] in set(leftover_ids)]
+                events_api = service.events()
+                requests_to_send = [events_api.patch(calendarId=calendar_id, eventId=event_id, body=body)
+                                    for event_id, body in patches]
+                requests_to_send += [events_api.insert(calendarId=calendar_id, body=body) for body in inserts]
+                if requests_to_send:
+                    responses, _ = execute_batched(service, requests_to_send)
+                    written_events.extend(responses.values())
+                for event in inserts:
+                    print(f"  - Created: {event['summary']} at {event['start']['dateTime']} ({LOCAL_TIMEZONE})")
+            except Exception as e:
+                print(f"  [STREAM] Failed to write streamed events: {e}")
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+    schedule_list = []
+    completed = False
+    try:
+        for item in schedule_items:
+            if not isinstance(item, dict) or not item.get("start_time") or not item.get("end_time"):
+                print(f"  [STREAM] Ignoring incomplete event: {item}")
+                continue
+            schedule_list.append(item)
+            write_queue.put(item)
+        completed = True
+    except Exception as e:
+        print(f"An error occurred while streaming the schedule: {e}")
+    finally:
+        write_queue.put(None)
+        writer_thread.join()
+
+    # A broken-off stream is only part of the plan, so the events it didn't reuse may still be needed.
+    if schedule_list and remaining_events and completed:
+        events_api = service.events()
+        deletes = [event["id"] for event in remaining_events]
+        responses, _ = execute_batched(
+            service, [events_api.delete(calendarId=calendar_id, eventId=event_id) for event_id in deletes]
+        )
+        deleted_ids = [deletes[i] for i in responses]
+    # SQLite connections stay on the thread that opened them, so the store is updated here.
+    if store is not None:
+        upsert_events(store, calendar_id, written_events)
+        delete_events(store, calendar_id, deleted_ids)
+    print(f"Streamed {len(schedule_list)} events into '{AEGIS_CALENDAR_NAME}', deleted {len(deleted_ids)} stale ones.")
+    return schedule_list, completed
 
 # --- Feedback and Task Update Functions ---
 
-def read_recent_feedback(lines_to_read=15):
+def read_recent_feedback(lines_to_read=15, feedback_file=FEEDBACK_FILE):
     """Reads the last few lines of the feedback log."""
-    if not os.path.exists(FEEDBACK_FILE):
+    if not os.path.exists(feedback_file):
         return "No feedback has been provided yet."
     try:
-        with open(FEEDBACK_FILE, "r") as f:
-            return "".join(f.readlines()[-lines_to_read:])
+        return "".join(load_text(feedback_file).splitlines(keepends=True)[-lines_to_read:])
     except Exception as e:
         print(f"Could not read feedback file: {e}")
         return "Error reading feedback file."
 
-def update_tasks_completion(schedule_list):
-    """Updates the last_completed_utc field in tasks.json."""
-    with open(TASKS_FILE, "r+") as f:
-        tasks_data = json.load(f)
-        task_map = {task['id']: task for task in tasks_data['tasks']}
-        for event in schedule_list:
-            task_id = event.get("task_id")
-            if task_id in task_map:
-                task_map[task_id]["last_completed_utc"] = event.get("end_time")
-        f.seek(0)
-        json.dump(tasks_data, f, indent=2)
-        f.truncate()
-    print("Task completion times have been updated.")
-
-# --- Main Execution Loop ---
+def update_tasks_completion(schedule_list, tasks_file=TASKS_FILE):
+    """Updates the last_completed_utc field in tasks.json, atomically."""
+    updated = save_task_completions(tasks_file, schedule_list)
+    print(f"Task completion times have been updated ({updated} tasks).")
+
+# --- Speculative Pre-Planning Functions ---
+
+def fingerprint(value):
+    """Returns a stable hash of a JSON-serializable value."""
+    return hashlib.sha256(json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def get_inputs_fingerprint(tasks, feedback, prompt_file=PROMPT_FILE):
+    """
+    Fingerprints what a plan is built from besides the calendar: the task library,
+    feedback and system prompt. Completion times are left out, since every replan
+    rewrites them.
+    """
+    task_fields = sorted(
+        ({key: value for key, value in task.items() if key != "last_completed_utc"} for task in tasks),
+        key=lambda task: task.get("id", "")
+    )
+    return fingerprint({"tasks": task_fields, "feedback": feedback.strip(), "system": load_text(prompt_file)})
+
+def preplan_days(service, aegis_calendar_id, state, store=None, profile=DEFAULT_PROFILE, days=PREPLAN_DAYS):
+    """
+    Drafts the plans of the next `days` days into state["drafts"], each with fingerprints
+    of its inputs and of the day's free time, so that day's first replan can commit it
+    instead of waiting on the LLM. Drafts that are still current are kept.
+    Returns the dates that were (re)drafted.
+    """
+    today = datetime.date.today()
+    drafts = {day: draft for day, draft in state.get("drafts", {}).items() if day >= today.isoformat()}
+    task_index = load_task_index(profile["tasks_file"])
+    feedback = read_recent_feedback(feedback_file=profile["feedback_file"])
+    inputs_fingerprint = get_inputs_fingerprint(task_index["tasks"], feedback, profile["prompt_file"])
+    # Copies whose completion times advance day by day, so later drafts rotate to other tasks.
+    tasks = [dict(task) for task in task_index["tasks"]]
+    drafted = []
+    for offset in range(1, days + 1):
+        day = (today + datetime.timedelta(days=offset)).isoformat()
+        draft = drafts.get(day)
+        if draft is None or draft["inputs"] != inputs_fingerprint:
+            print(f"Pre-planning {day}...")
+            start_utc, end_utc = get_planning_window(today + datetime.timedelta(days=offset))
+            free_slots = get_free_slots(service, start_utc, end_utc, store)
+            prompt_data = {"tasks": select_candidates(build_task_index(tasks)), "past_events": [],
+                           "future_free_slots": free_slots}
+            draft = {
+                "inputs": inputs_fingerprint,
+                "busy": fingerprint(free_slots),
+                "events": generate_schedule(prompt_data, feedback, prompt_file=profile["prompt_file"]),
+                "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }
+            drafts[day] = draft
+            drafted.append(day)
+        mark_tasks_completed(tasks, draft["events"])
+    state["drafts"] = drafts
+    return drafted
+
+def get_item_interval(item):
+    """Returns the (start, end) UTC pair of a schedule entry."""
+    return parse_event_time(item["start_time"]), parse_event_time(item["end_time"])
+
+def revalidate_draft(service, draft, tasks, daily_context, feedback, store=None, profile=DEFAULT_PROFILE):
+    """
+    tasks is the whole task library; the native planner fills the gaps cheaply from it.
+    Turns today's draft into today's schedule without the LLM. If the day's free time
+    is unchanged, the draft's remaining entries are committed as they are; otherwise the
+    entries that still fit a free slot are kept and only the gaps are planned, natively.
+    Returns None when the tasks, feedback or prompt changed since the draft.
+    """
+    if draft["inputs"] != get_inputs_fingerprint(tasks, feedback, profile["prompt_file"]):
+        print("Tasks, feedback or prompt changed since the draft; planning from scratch.")
+        return None
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    remaining = [item for item in draft["events"] if get_item_interval(item)[0] >= now_utc]
+    start_utc, end_utc = get_planning_window(datetime.date.today())
+    if fingerprint(get_free_slots(service, start_utc, end_utc, store)) == draft["busy"]:
+        print(f"Committing the pre-planned draft ({len(remaining)} events); the calendar is unchanged.")
+        return remaining
+
+    free_slots = [(parse_event_time(slot["start"]), parse_event_time(slot["end"]))
+                  for slot in daily_context["future_free_slots"]]
+    kept = [
+        item for item in remaining
+        if any(slot_start <= get_item_interval(item)[0] and get_item_interval(item)[1] <= slot_end
+               for slot_start, slot_end in free_slots)
+    ]
+    kept_intervals = [get_item_interval(item) for item in kept]
+    gaps = [
+        {"start": start.isoformat(), "end": end.isoformat()}
+        for slot_start, slot_end in free_slots
+        for start, end in compute_free_slots(kept_intervals, slot_start, slot_end, buffer_minutes=0)
+    ]
+    kept_task_ids = {item.get("task_id") for item in kept}
+    open_tasks = [task for task in tasks if task.get("id") not in kept_task_ids]
+    filler = plan_schedule(open_tasks, gaps, daily_context["past_events"])["events"]
+    print(f"The calendar changed since the draft: kept {len(kept)} drafted events, planned {len(filler)} into the gaps.")
+    return sorted(kept + filler, key=lambda item: get_item_interval(item)[0])
+
+# --- Daemon Steps ---
+
+def record_changed_windows(state, intervals):
+    """Adds changed busy intervals to the ones the next replan has to cover, as UTC ISO pairs."""
+    state.setdefault("changed_windows", []).extend([start.isoformat(), end.isoformat()] for start, end in intervals)
+
+def check_for_changes(service, aegis_calendar_id, state, store=None):
+    """
+    Renews the push channel and runs change detection, updating state in place. Returns
+    True on a change. The busy intervals that changed are kept in state["changed_windows"]
+    so the replan can be limited to them.
+    """
+    state["watch_channel"] = ensure_watch_channel(service, "primary", state.get("watch_channel"))
+    is_new_day = state.get("last_planned_day") != datetime.date.today().isoformat()
+    if CHANGE_DETECTION == "sync":
+        previous_busy = {calendar_id: sync.get("busy", {}) for calendar_id, sync in state.get("busy_sync", {}).items()}
+        with span("sync_check"):
+            changed, state["busy_sync"] = check_busy_calendar_changes(service, state, store)
+            state["aegis_sync"] = sync_aegis_calendar(service, aegis_calendar_id, state, store)
+        if changed and not is_new_day:
+            for calendar_id, sync in state["busy_sync"].items():
+                record_changed_windows(state, get_changed_intervals(previous_busy.get(calendar_id, {}), sync["busy"]))
+        return changed
+    with span("hash_check"):
+        current_busy = get_primary_busy_intervals(service)
+    previous_busy = state.get("primary_busy")
+    changed_intervals = get_changed_intervals(previous_busy or {}, current_busy)
+    state["primary_busy"] = current_busy
+    if previous_busy is None or is_new_day:
+        return True
+    record_changed_windows(state, changed_intervals)
+    return bool(changed_intervals)
+
+def get_replan_scope(changed_windows):
+    """
+    Widens the changed (start, end) UTC windows by REPLAN_NEIGHBORHOOD_MINUTES, clips
+    them to the rest of today's planning window and merges them.
+    """
+    neighborhood = datetime.timedelta(minutes=REPLAN_NEIGHBORHOOD_MINUTES)
+    day_start_utc, day_end_utc = get_planning_window(datetime.date.today())
+    scope_start = max(datetime.datetime.now(datetime.timezone.utc), day_start_utc)
+    return merge_intervals(
+        (max(start - neighborhood, scope_start), min(end + neighborhood, day_end_utc))
+        for start, end in changed_windows
+        if end + neighborhood > scope_start and start - neighborhood < day_end_utc
+    )
+
+def replan_changed_windows(service, aegis_calendar_id, changed_windows, task_index, daily_context, feedback,
+                           store=None, profile=DEFAULT_PROFILE):
+    """
+    Re-plans only the Aegis events overlapping the changed busy windows (plus their
+    neighborhood) and keeps the rest of today's plan. Returns the new entries.
+    """
+    scope = get_replan_scope(changed_windows)
+    if not scope:
+        print("The calendar changes fall outside the rest of today's plan; nothing to re-plan.")
+        return []
+    future_events = [event for event in list_future_aegis_events(service, aegis_calendar_id, store)
+                     if get_event_slot(event)]
+    # Blocks already in progress count too: a meeting moved onto one has to end it.
+    affected = [
+        event for event in future_events
+        if any(get_event_slot(event)[0] < end and get_event_slot(event)[1] > start for start, end in scope)
+    ]
+    kept = [event for event in future_events if event not in affected]
+    # The freed-up time of an affected block is part of what gets re-planned.
+    scope = merge_intervals(scope + [get_event_slot(event) for event in affected])
+    kept_intervals = [get_event_slot(event) for event in kept]
+    scoped_free_slots = []
+    for slot in daily_context["future_free_slots"]:
+        slot_start, slot_end = parse_event_time(slot["start"]), parse_event_time(slot["end"])
+        for start, end in scope:
+            if max(start, slot_start) < min(end, slot_end):
+                scoped_free_slots += [
+                    {"start": gap_start.isoformat(), "end": gap_end.isoformat()}
+                    for gap_start, gap_end in compute_free_slots(
+                        kept_intervals, max(start, slot_start), min(end, slot_end), buffer_minutes=0
+                    )
+                ]
+    print(f"Re-planning {len(scope)} changed window(s): {len(affected)} Aegis events affected, {len(kept)} kept.")
+
+    kept_task_ids = {get_event_task_id(event) for event in kept} - {""}
+    prompt_data = {
+        "tasks": select_candidates(task_index, daily_context["past_events"], exclude_ids=kept_task_ids),
+        "past_events": daily_context["past_events"],
+        "future_free_slots": scoped_free_slots
+    }
+    schedule_list = []
+    if scoped_free_slots:
+        with span("generate_schedule"):
+            schedule_list = generate_schedule(prompt_data, feedback, prompt_file=profile["prompt_file"])
+    with span("reconcile_calendar"):
+        reconcile_future_aegis_events(service, aegis_calendar_id, schedule_list, store, existing_events=affected)
+    return schedule_list
+
+def plan_whole_day(service, aegis_calendar_id, state, task_index, daily_context, feedback, store=None,
+                   profile=DEFAULT_PROFILE):
+    """Plans the rest of today from the overnight draft, or else from scratch. Returns the new entries."""
+    tasks = select_candidates(task_index, daily_context["past_events"])
+    prompt_data = {
+        "tasks": tasks,
+        "past_events": daily_context["past_events"],
+        "future_free_slots": daily_context["future_free_slots"]
+    }
+    # Commit the plan drafted overnight for today, if there is one and it still holds
+    schedule_list = None
+    draft = state.get("drafts", {}).pop(datetime.date.today().isoformat(), None)
+    if draft is not None:
+        with span("commit_draft"):
+            schedule_list = revalidate_draft(service, draft, task_index["tasks"], daily_context, feedback, store, profile)
+            if schedule_list:
+                reconcile_future_aegis_events(service, aegis_calendar_id, schedule_list, store)
+    # Otherwise adapt the schedule: reconcile future events with the new plan,
+    # writing streamed entries while the LLM is still generating
+    streamed = STREAM_LLM_OUTPUT and PLANNER_MODE != "native" and LLM_BACKEND != "hedged"
+    if streamed and not schedule_list:
+        problems = []
+        with span("stream_to_calendar"):
+            schedule_items = iter_repaired_events(stream_llm_schedule(prompt_data, feedback, profile["prompt_file"]),
+                                                  tasks, prompt_data["future_free_slots"], problems)
+            schedule_list, completed = stream_events_to_calendar(service, aegis_calendar_id, schedule_items, store)
+        if schedule_list and not completed:
+            # The stream broke off: plan the rest of the day natively, then reconcile the
+            # whole plan, which also removes the stale events the stream left in place.
+            scheduled_ids = {item.get("task_id") for item in schedule_list}
+            filler = plan_schedule([task for task in tasks if task["id"] not in scheduled_ids],
+                                   get_remaining_free_slots(prompt_data["future_free_slots"], schedule_list),
+                                   prompt_data["past_events"])["events"]
+            print(f"The LLM stream broke off after {len(schedule_list)} events; planned {len(filler)} more natively.")
+            schedule_list += filler
+            reconcile_future_aegis_events(service, aegis_calendar_id, schedule_list, store)
+        elif schedule_list and problems:
+            correction = request_schedule_correction(prompt_data, feedback, schedule_list, problems, profile["prompt_file"])
+            if correction:
+                reconcile_future_aegis_events(service, aegis_calendar_id, correction, store, existing_events=[])
+                schedule_list += correction
+    if not schedule_list:
+        with span("generate_schedule"):
+            schedule_list = generate_schedule(prompt_data, feedback, use_llm=not streamed, prompt_file=profile["prompt_file"])
+        with span("reconcile_calendar"):
+            reconcile_future_aegis_events(service, aegis_calendar_id, schedule_list, store)
+    return schedule_list
+
+def replan_schedule(service, aegis_calendar_id, state, store=None, profile=DEFAULT_PROFILE, full=False):
+    """
+    Adaptively re-plans the rest of today around the calendar and the profile's tasks and
+    feedback. When only busy calendar events moved since today's plan was made, just the
+    Aegis events around the changed windows are re-planned, unless full is set.
+    """
+    print("!!! Adaptively re-planning schedule. !!!")
+    changed_windows = [(parse_event_time(start), parse_event_time(end))
+                       for start, end in state.pop("changed_windows", [])]
+    today = datetime.date.today().isoformat()
+    scoped = (changed_windows and not full and state.get("last_planned_day") == today
+              and today not in state.get("drafts", {}))
+
+    # 1. Get the full context of the day (past events and future slots)
+    with span("get_daily_context"):
+        daily_context = get_daily_context(service, aegis_calendar_id, store)
+
+    # 2. Read the task index and recent feedback (served from memory unless the files changed)
+    task_index = load_task_index(profile["tasks_file"])
+    feedback = read_recent_feedback(feedback_file=profile["feedback_file"])
+
+    # 3. Re-plan just the changed windows, or the whole rest of the day
+    if scoped:
+        with span("replan_changed_windows"):
+            schedule_list = replan_changed_windows(
+                service, aegis_calendar_id, changed_windows, task_index, daily_context, feedback, store, profile
+            )
+    else:
+        schedule_list = plan_whole_day(
+            service, aegis_calendar_id, state, task_index, daily_context, feedback, store, profile
+        )
+    if schedule_list:
+        with span("update_tasks_completion"):
+            update_tasks_completion(schedule_list, profile["tasks_file"])
+
+    state["last_planned_day"] = today
+    try:
+        with span("schedule_snapshot"):
+            write_schedule_snapshot(service, aegis_calendar_id, store, profile["snapshot_file"])
+    except Exception as e:
+        print(f"Warning: could not write the schedule snapshot: {e}")
+    print("--- Adaptive re-planning complete. ---")
+
+# --- Main Execution ---
 
 def main():
-    """Main execution block, runs as a continuous adaptive daemon."""
-    service = setup_google_calendar_api()
-    aegis_calendar_id = find_or_create_aegis_calendar(service)
-    
-    print("\n--- Aegis_Shasanam Daemon v4 (Adaptive) Initialized ---")
-    print(f"Using timezone: {LOCAL_TIMEZONE}")
-    print(f"Checking for calendar changes every {CHECK_INTERVAL_SECONDS} seconds.")
-
-    while True:
-        try:
-            print(f"\n[{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Checking for changes...")
-            state = load_state()
-            current_hash = get_primary_calendar_state_hash(service)
-
-            if current_hash != state.get("last_known_hash"):
-                print("!!! Change detected. Adaptively re-planning schedule. !!!")
-
-                # 1. Get the full context of the day (past events and future slots)
-                daily_context = get_daily_context(service, aegis_calendar_id)
-
-                # 2. Read tasks and recent feedback
-                with open(TASKS_FILE, "r") as f:
-                    tasks_data = json.load(f)
-                feedback = read_recent_feedback()
-
-                # 3. Query Gemini with the new, richer context
-                prompt_data = {
-                    "tasks": tasks_data["tasks"],
-                    "past_events": daily_context["past_events"],
-                    "future_free_slots": daily_context["future_free_slots"]
-                }
-                suggested_schedule_str = query_gemini(prompt_data, feedback)
-
-                # 4. Adapt the schedule: clear future and create new events
-                if suggested_schedule_str:
-                    clear_future_aegis_events(service, aegis_calendar_id)
-                    schedule_list = create_events_from_schedule(service, aegis_calendar_id, suggested_schedule_str)
-                    if schedule_list:
-                        update_tasks_completion(schedule_list)
-
-                # 5. Save the new state
-                save_state({"last_known_hash": current_hash})
-                print("--- Adaptive re-planning complete. ---")
-            else:
-                print("No changes detected. Standing by.")
-
-            time.sleep(CHECK_INTERVAL_SECONDS)
-
-        except HttpError as error:
-            print(f"An API error occurred: {error}")
-            time.sleep(CHECK_INTERVAL_SECONDS)
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            time.sleep(CHECK_INTERVAL_SECONDS)
+    """Main execution block, runs the adaptive daemon on an asyncio event loop."""
+    from daemon import run_daemon  # daemon builds on this module, so it is imported late
+    asyncio.run(run_daemon())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,103 @@
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+try:
+    import fcntl  # POSIX only; elsewhere writers are serialized within the process alone
+except ImportError:
+    fcntl = None
+
+from default_variables import TASK_CANDIDATES_PER_CATEGORY
+from config_files import read_cached, get_file_signature, forget_file
+from planner import staleness_key, get_done_task_ids
+
+
+# The task library: tasks.json stays the user-editable source of truth, indexed in
+# memory by id and category while the file is unchanged. Only the stalest few tasks
+# of each category are sent to the planner, so the prompt stays flat as the library
+# grows, and completion times are written atomically without losing concurrent edits.
+
+_write_lock = threading.Lock()
+
+# --- Index Functions ---
+
+def build_task_index(tasks):
+    """Indexes tasks by id and by category; each category list is kept in staleness order."""
+    by_category = {}
+    for task in tasks:
+        by_category.setdefault(task.get("category"), []).append(task)
+    for category_tasks in by_category.values():
+        category_tasks.sort(key=staleness_key)
+    return {"tasks": tasks, "by_id": {task["id"]: task for task in tasks}, "by_category": by_category}
+
+def load_task_index(tasks_file):
+    """Returns the task index of a tasks file, rebuilt only when the file changes. Read-only."""
+    return read_cached(tasks_file, lambda text: build_task_index(json.loads(text)["tasks"]))
+
+def select_candidates(index, past_events=(), exclude_ids=(), per_category=TASK_CANDIDATES_PER_CATEGORY):
+    """
+    Returns the planner's candidate tasks: the per_category stalest tasks of each
+    category that weren't already done today or excluded (0 means every task). The
+    tasks done today are kept too, since the planner counts them against the quotas.
+    """
+    if per_category <= 0:
+        return [task for task in index["tasks"] if task["id"] not in exclude_ids]
+    done_ids = get_done_task_ids(past_events)
+    candidates = [index["by_id"][task_id] for task_id in done_ids if task_id in index["by_id"]]
+    for category_tasks in index["by_category"].values():
+        open_tasks = (task for task in category_tasks if task["id"] not in done_ids and task["id"] not in exclude_ids)
+        candidates.extend(heapq.nsmallest(per_category, open_tasks, key=staleness_key))
+    return candidates
+
+# --- Completion Update Functions ---
+
+def mark_tasks_completed(tasks, schedule_list):
+    """Sets each scheduled task's last_completed_utc to the end of its block, in place."""
+    task_map = {task['id']: task for task in tasks}
+    for event in schedule_list:
+        task_id = event.get("task_id")
+        if task_id in task_map:
+            task_map[task_id]["last_completed_utc"] = event.get("end_time")
+
+def write_json_atomically(path, data):
+    """Writes JSON to a temp file next to path and renames it over path."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def save_task_completions(tasks_file, schedule_list, retries=3):
+    """
+    Updates last_completed_utc of the scheduled tasks in tasks_file. Other processes
+    using this function are locked out, and if the file is edited by hand meanwhile the
+    update is redone on the new contents, so no edit is lost. Returns the updated count.
+    """
+    with _write_lock, open(f"{tasks_file}.lock", "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        for _ in range(retries):
+            signature = get_file_signature(tasks_file)
+            with open(tasks_file, "r") as f:
+                tasks_data = json.load(f)
+            before = {task["id"]: task.get("last_completed_utc") for task in tasks_data["tasks"]}
+            mark_tasks_completed(tasks_data["tasks"], schedule_list)
+            updated = sum(1 for task in tasks_data["tasks"] if task.get("last_completed_utc") != before[task["id"]])
+            if not updated:
+                return 0
+            if get_file_signature(tasks_file) == signature:
+                write_json_atomically(tasks_file, tasks_data)
+                forget_file(tasks_file)
+                return updated
+        raise RuntimeError(f"'{tasks_file}' kept changing while its completion times were updated.")